@@ -0,0 +1,56 @@
+"""
+Benchmark: micro-batched SMTP delivery at batch sizes 1, 10 and 50.
+
+Deliveries are fed through MicroBatcher + rabitmq_consumer_batch_callback
+on a single consumer thread, against a local fake SMTP relay whose login
+costs LOGIN_DELAY seconds (standing in for DNS + TLS + AUTH) and whose
+DATA reply costs DATA_DELAY seconds. Two pool settings are shown:
+"cold" keeps no session between batches (idle_timeout=0), which is what a
+relay that drops idle sessions looks like, and "warm" keeps them.
+
+Run from the repository root:  python -m benchmarks.bench_batching
+"""
+import time
+from unittest import mock
+from benchmarks.bench_consumer_modes import otp_body, pool_options
+from sending_emails.core.batching import MicroBatcher
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeConnection, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+MESSAGES = 200
+LOGIN_DELAY = 0.02
+DATA_DELAY = 0.001
+
+
+def run(server, bodies, batch_size, idle_timeout):
+    pool = SMTPConnectionPool(**pool_options(server, 1), idle_timeout=idle_timeout)
+    connection, channel = FakeConnection(), FakeChannel()
+    logins_before = server.logins
+    with mock.patch("sending_emails.emails.smtp_pool._smtp_pool", pool):
+        batcher = MicroBatcher(connection, rabitmq_consumer_batch_callback, batch_size, max_wait=0.05)
+        started = time.perf_counter()
+        for tag, body in enumerate(bodies, start=1):
+            batcher.add(channel, FakeMethod(tag), None, body)
+        batcher.flush()
+        elapsed = time.perf_counter() - started
+    pool.close()
+    assert len(channel.acks) == len(bodies)
+    return len(bodies) / elapsed, server.logins - logins_before
+
+
+def main():
+    server = FakeSMTPServer(delay=DATA_DELAY, login_delay=LOGIN_DELAY).start()
+    bodies = [otp_body(index) for index in range(MESSAGES)]
+    print(f"{MESSAGES} messages, {LOGIN_DELAY * 1000:.0f} ms login, {DATA_DELAY * 1000:.0f} ms DATA")
+    print(f"{'pool':<6}{'batch':>7}{'msgs/s':>10}{'logins':>8}")
+    for label, idle_timeout in (("cold", 0), ("warm", 60)):
+        for batch_size in (1, 10, 50):
+            rate, logins = run(server, bodies, batch_size, idle_timeout)
+            print(f"{label:<6}{batch_size:>7}{rate:>10,.0f}{logins:>8}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
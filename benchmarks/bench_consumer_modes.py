@@ -0,0 +1,105 @@
+"""
+Throughput benchmark: threaded consumer (bounded sender threads, blocking
+smtplib pool) vs asyncio consumer (tasks + semaphore, aiosmtplib pool).
+
+Deliveries come from an in-process fake broker and are sent to a local fake
+SMTP relay that adds a fixed latency per message, so the numbers show how
+well each mode overlaps SMTP waits. The fake relay runs in this process, so
+both modes share one GIL with it and top out at the same CPU-bound ceiling;
+the interesting part is how few threads the asyncio mode needs to reach it.
+
+Run from the repository root:  python -m benchmarks.bench_consumer_modes
+"""
+import json
+import time
+import asyncio
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.worker_pool import ConcurrentDispatcher
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool
+from sending_emails.emails.encryption_utils import encrypt_data
+from sending_emails.emails.helpers import send_email
+from sending_emails.emails.send_mails import resolve_email
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeConnection, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+MESSAGES = 500
+SMTP_LATENCY = 0.01
+SMTP_CONNECTIONS = 20
+
+
+def otp_body(index):
+    return json.dumps({
+        "event": "user_otp_request",
+        "data": {
+            "user_email": f"user{index}@example.com",
+            "user_fullname": "Jane Doe",
+            "otp_reason": "Login Verification",
+            "otp": encrypt_data("482913"),
+        },
+    }).encode()
+
+
+def pool_options(server, size):
+    return {
+        "host": "127.0.0.1",
+        "port": server.port,
+        "username": "user",
+        "password": "secret",
+        "use_ssl": False,
+        "size": size,
+        "timeout": 10,
+    }
+
+
+def run_threaded(server, bodies, workers):
+    pool = SMTPConnectionPool(**pool_options(server, SMTP_CONNECTIONS))
+    connection, channel = FakeConnection(), FakeChannel()
+
+    def callback(ch, method, properties, body):
+        _, email = resolve_email(json.loads(body))
+        send_email(*email, pool=pool)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    dispatcher = ConcurrentDispatcher(connection, callback, workers=workers)
+    started = time.perf_counter()
+    for tag, body in enumerate(bodies, start=1):
+        dispatcher.dispatch(channel, FakeMethod(tag), None, body)
+    while len(channel.acks) < len(bodies):
+        connection.process_data_events(time_limit=0.01)
+    elapsed = time.perf_counter() - started
+    dispatcher.shutdown()
+    pool.close()
+    return elapsed
+
+
+async def run_asyncio(server, bodies, max_in_flight):
+    pool = AsyncSMTPConnectionPool(**pool_options(server, SMTP_CONNECTIONS))
+    consumer = AsyncRabbitMQConsumer(max_in_flight=max_in_flight, smtp_pool=pool)
+    channel = FakeChannel()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        consumer.process_message(channel, FakeMethod(tag), None, body)
+        for tag, body in enumerate(bodies, start=1)
+    ))
+    elapsed = time.perf_counter() - started
+    await pool.close()
+    return elapsed
+
+
+def main():
+    server = FakeSMTPServer(delay=SMTP_LATENCY).start()
+    bodies = [otp_body(index) for index in range(MESSAGES)]
+    print(f"{MESSAGES} messages, {SMTP_LATENCY * 1000:.0f} ms SMTP latency, {SMTP_CONNECTIONS} SMTP connections")
+    print(f"{'mode':<28}{'msgs/s':>10}")
+    for workers in (1, 4, 20):
+        elapsed = run_threaded(server, bodies, workers)
+        print(f"{f'threaded, {workers} workers':<28}{MESSAGES / elapsed:>10,.0f}")
+    for max_in_flight in (20, 100, 500):
+        elapsed = asyncio.run(run_asyncio(server, bodies, max_in_flight))
+        print(f"{f'asyncio, {max_in_flight} in flight':<28}{MESSAGES / elapsed:>10,.0f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
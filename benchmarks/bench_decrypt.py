@@ -0,0 +1,44 @@
+"""
+Benchmark: Fernet decrypt throughput with a 1-key vs 3-key MultiFernet
+keyring, for tokens made with the current key (first key tried) and with
+the oldest key (every key tried), plus the legacy str->bytes->str path.
+
+Run from the repository root:  python -m benchmarks.bench_decrypt
+"""
+import time
+from cryptography.fernet import Fernet
+from sending_emails.emails.encryption_utils import build_keyring, decrypt_bytes
+
+
+def decrypts_per_second(decrypt, token, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(200):
+            decrypt(token)
+        count += 200
+    return count / seconds
+
+
+def main(seconds: float = 1.0):
+    keys = [Fernet.generate_key() for _ in range(3)]
+    one_key = build_keyring(keys[0])
+    three_keys = build_keyring(keys[0], keys[1:])
+    current_token = Fernet(keys[0]).encrypt(b"482913").decode()
+    oldest_token = Fernet(keys[2]).encrypt(b"482913").decode()
+    legacy = Fernet(keys[0])
+
+    cases = [
+        ("legacy Fernet, str round trip", lambda t: legacy.decrypt(t.encode()).decode(), current_token),
+        ("1 key, current token", lambda t: decrypt_bytes(t, keyring=one_key), current_token),
+        ("1 key, current token, ttl", lambda t: decrypt_bytes(t, ttl=600, keyring=one_key), current_token),
+        ("3 keys, current token", lambda t: decrypt_bytes(t, keyring=three_keys), current_token),
+        ("3 keys, oldest token", lambda t: decrypt_bytes(t, keyring=three_keys), oldest_token),
+    ]
+    print(f"{'case':<34}{'decrypts/s':>12}")
+    for label, decrypt, token in cases:
+        print(f"{label:<34}{decrypts_per_second(decrypt, token, seconds):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
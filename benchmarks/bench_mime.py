@@ -0,0 +1,56 @@
+"""
+Benchmark: serializing a rendered email with the email package
+(MIMEMultipart + MIMEText + as_string, the previous path) vs byte assembly
+from a cached skeleton, for every template in sending_emails/emails/template.
+
+Run from the repository root:  python -m benchmarks.bench_mime
+"""
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from benchmarks.bench_templates import TEMPLATES, TEMPLATE_FOLDER_PATH
+from sending_emails.emails.mime import build_mime_message
+from sending_emails.emails.template_engine import TemplateCache
+
+SENDER = "no-reply@example.com"
+RECIPIENT = "jane.doe@example.com"
+
+
+def legacy_build_mime_message(subject, sender, recipient, html_content):
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg.attach(MIMEText(html_content, "html"))
+    return msg.as_string()
+
+
+def builds_per_second(build, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            build()
+        count += 100
+    return count / seconds
+
+
+def main(seconds: float = 1.0):
+    cache = TemplateCache()
+    print(f"{'template':<36}{'legacy/s':>12}{'skeleton/s':>12}{'speedup':>9}")
+    for name, replacements in TEMPLATES.items():
+        template = cache.get(f"{TEMPLATE_FOLDER_PATH}/{name}")
+        html_content = template.render(replacements)
+        text_content = template.text.render(replacements)
+        legacy = builds_per_second(
+            lambda: legacy_build_mime_message("Your credentials", SENDER, RECIPIENT, html_content), seconds
+        )
+        skeleton = builds_per_second(
+            lambda: build_mime_message("Your credentials", SENDER, RECIPIENT, html_content, text_content),
+            seconds,
+        )
+        print(f"{name:<36}{legacy:>12,.0f}{skeleton:>12,.0f}{skeleton / legacy:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
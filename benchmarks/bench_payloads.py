@@ -0,0 +1,54 @@
+"""
+Benchmark: decoding a queue body with json vs orjson (when installed), and
+decode + schema validation of an OTP payload through its event's
+precompiled pydantic model.
+
+Run from the repository root:  python -m benchmarks.bench_payloads
+"""
+import json
+import time
+from sending_emails.emails.encryption_utils import encrypt_data
+from sending_emails.emails.payloads import decode_payload, orjson
+from sending_emails.emails.send_mails import get_email_event
+
+
+def microseconds_per_call(function, body, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(200):
+            function(body)
+        count += 200
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main(seconds: float = 1.0):
+    otp_event = get_email_event("user_otp_request")
+    body = json.dumps(
+        {
+            "event": "user_otp_request",
+            "data": {
+                "user_email": "jane@example.com",
+                "user_fullname": "Jane Doe",
+                "otp_reason": "Login Verification",
+                "otp": encrypt_data("482913"),
+            },
+        }
+    ).encode()
+
+    cases = [("json.loads(body.decode())", lambda b: json.loads(b.decode()))]
+    if orjson is not None:
+        cases.append(("orjson.loads(body)", orjson.loads))
+    cases += [
+        ("decode_payload", decode_payload),
+        ("decode_payload + validate", lambda b: otp_event.validate(decode_payload(b)["data"])),
+    ]
+    print(f"orjson {'installed' if orjson is not None else 'not installed, stdlib fallback'}")
+    print(f"{'case':<34}{'us/message':>12}")
+    for label, function in cases:
+        print(f"{label:<34}{microseconds_per_call(function, body, seconds):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
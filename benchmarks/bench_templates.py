@@ -0,0 +1,79 @@
+"""
+Microbenchmark: legacy read_template + safe_replace rendering vs the
+compiled template cache, for every template in sending_emails/emails/template.
+
+Run from the repository root:  python -m benchmarks.bench_templates
+"""
+import time
+from sending_emails.emails.helpers import read_template, safe_replace
+from sending_emails.emails.template_engine import TemplateCache
+
+TEMPLATE_FOLDER_PATH = "sending_emails/emails/template"
+
+COMMON = {
+    "user_fullname": "Jane Doe",
+    "user_email": "jane.doe@example.com",
+    "hospital_name": "General Hospital",
+    "current_year": "2026",
+    "company_name": "Retinopathy",
+    "company_logo_url": "https://example.com/logo.png",
+    "password": "s3cr3t-Pa55",
+}
+
+TEMPLATES = {
+    "send_otp.html": {
+        **COMMON,
+        "otp_reason": "Login Verification",
+        "otp": "482913",
+        "otp_expiry_time": "5 minutes",
+        "otp_request_at": "2026-01-01 10:00",
+        "new_otp_request_time": "1 minute",
+        "dynamic_info_1": "info one",
+        "dynamic_info_2": "info two",
+    },
+    "technician_credentials.html": {**COMMON, "account_created": "2026-01-01"},
+    "doctor_reviewer_credentials.html": {**COMMON, "account_created": "2026-01-01"},
+    "doctor_admin_credentials.html": {**COMMON, "account_created": "2026-01-01"},
+    "credentials_updated_by_admin.html": {
+        **COMMON,
+        "role": "Technician",
+        "access_from": "2026-01-01",
+        "credentials_updated_at": "2026-01-01 10:00",
+    },
+}
+
+
+def legacy_render(template_path, replacements):
+    html = read_template(template_path)
+    for key, value in replacements.items():
+        html = safe_replace(html, f"[{key}]", value)
+    return html
+
+
+def renders_per_second(render, template_path, replacements, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            render(template_path, replacements)
+        count += 100
+    return count / seconds
+
+
+def main(seconds: float = 1.0):
+    cache = TemplateCache(check_interval=2.0)
+
+    def compiled_render(template_path, replacements):
+        return cache.get(template_path).render(replacements)
+
+    print(f"{'template':<36}{'legacy/s':>12}{'compiled/s':>12}{'speedup':>9}")
+    for name, replacements in TEMPLATES.items():
+        path = f"{TEMPLATE_FOLDER_PATH}/{name}"
+        assert legacy_render(path, replacements) == compiled_render(path, replacements)
+        legacy = renders_per_second(legacy_render, path, replacements, seconds)
+        compiled = renders_per_second(compiled_render, path, replacements, seconds)
+        print(f"{name:<36}{legacy:>12,.0f}{compiled:>12,.0f}{compiled / legacy:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
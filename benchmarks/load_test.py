@@ -0,0 +1,298 @@
+"""
+End-to-end load test of the threaded consumer loop.
+
+A RabbitMQConsumerSupervisor consumes from an in-process broker stand-in
+that honours each lane's prefetch window and timestamps every delivery and
+settle. Emails go to a local fake SMTP relay that adds SMTP_LATENCY per
+message. The workload is benchmarks.workload's mix of the five events with
+encrypted secrets. Every scenario reports messages/s, p50/p95/p99
+delivery-to-ack latency and the mean time per message of each pipeline
+stage, compared against the stored baselines in benchmarks/baselines.json.
+
+Baselines are machine-specific: record them on the machine (or CI runner)
+that checks against them.
+
+Run from the repository root:
+    python -m benchmarks.load_test                  # compare with the baselines
+    python -m benchmarks.load_test --check          # exit 1 on a regression
+    python -m benchmarks.load_test --save-baseline  # record new baselines
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from collections import defaultdict, deque
+from statistics import quantiles
+from typing import Dict, List, NamedTuple, Optional
+from unittest import mock
+from benchmarks.workload import WorkloadMessage, generate
+from sending_emails.core.idempotency import IdempotencyCache
+from sending_emails.core.lanes import BULK_LANE, PRIORITY_LANE, PUBLISHED_AT_HEADER
+from sending_emails.core.metrics import STAGE_SECONDS
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeConnection, FakeMethod, FakeProperties
+from tests.fake_smtp import FakeSMTPServer
+
+MESSAGES = 400
+SMTP_LATENCY = 0.005
+SMTP_CONNECTIONS = 10
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# A scenario regresses when its throughput drops, or its p95 grows, by more than this
+DEFAULT_TOLERANCE = 0.25
+
+
+class Scenario(NamedTuple):
+    name: str
+    workers: int
+    batch_size: int
+
+
+SCENARIOS = (
+    Scenario("inline", workers=1, batch_size=1),
+    Scenario("threaded, 8 workers", workers=8, batch_size=1),
+    Scenario("batched 10, 4 workers", workers=4, batch_size=10),
+)
+
+
+class LoadChannel:
+    """
+    Consumer channel of the load broker.
+
+    `start_consuming` keeps every subscribed lane's window of unacked
+    deliveries full, services the connection in between (acks from worker
+    threads, batch timers), and returns once every message was settled.
+    """
+
+    def __init__(self, broker: "LoadBroker", connection: FakeConnection):
+        self.broker = broker
+        self.connection = connection
+        self.is_open = True
+        self.consuming = False
+        self._prefetch_count = 0
+        self._consumers = []
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self._prefetch_count = prefetch_count
+
+    def exchange_declare(self, exchange, exchange_type="direct", **kwargs):
+        pass
+
+    def queue_declare(self, queue, **kwargs):
+        pass
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        self._consumers.append((queue, on_message_callback, self._prefetch_count))
+
+    def _settle(self, delivery_tag):
+        self.broker.settle(delivery_tag)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._settle(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._settle(delivery_tag)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._settle(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.broker.published += 1
+
+    def start_consuming(self):
+        self.consuming = True
+        while self.consuming and not self.broker.finished():
+            for queue, callback, prefetch_count in self._consumers:
+                while self.broker.unacked[queue] < prefetch_count and self.broker.ready[queue]:
+                    callback(self, *self.broker.deliver(queue))
+            self.connection.process_data_events(time_limit=0.001)
+        self.consuming = False
+
+    def stop_consuming(self):
+        self.consuming = False
+
+
+class LoadBroker:
+    """Lane queues filled up front, with a timestamp per delivery and per settle."""
+
+    def __init__(self, messages: List[WorkloadMessage]):
+        self.ready: Dict[str, deque] = {lane.queue: deque() for lane in (PRIORITY_LANE, BULK_LANE)}
+        self.unacked: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        self.delivered_at: Dict[int, float] = {}
+        self.settled_at: Dict[int, float] = {}
+        self.queue_of: Dict[int, str] = {}
+        self.published = 0
+        self.total = len(messages)
+        now = time.time()
+        for tag, message in enumerate(messages, start=1):
+            lane = PRIORITY_LANE if message.priority else BULK_LANE
+            properties = FakeProperties(message_id=message.message_id, headers={PUBLISHED_AT_HEADER: now})
+            self.ready[lane.queue].append(
+                (FakeMethod(tag, routing_key=lane.routing_key), properties, message.body)
+            )
+            self.queue_of[tag] = lane.queue
+
+    def connect(self) -> FakeConnection:
+        connection = FakeConnection()
+        connection.channel = lambda: LoadChannel(self, connection)
+        connection.close = lambda: setattr(connection, "is_open", False)
+        return connection
+
+    def deliver(self, queue: str):
+        method, properties, body = self.ready[queue].popleft()
+        with self.lock:
+            self.unacked[queue] += 1
+            self.delivered_at[method.delivery_tag] = time.perf_counter()
+        return method, properties, body
+
+    def settle(self, delivery_tag: int) -> None:
+        with self.lock:
+            self.settled_at[delivery_tag] = time.perf_counter()
+            self.unacked[self.queue_of[delivery_tag]] -= 1
+
+    def finished(self) -> bool:
+        return len(self.settled_at) >= self.total
+
+    def latencies(self) -> List[float]:
+        return [self.settled_at[tag] - self.delivered_at[tag] for tag in self.settled_at]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    cuts = quantiles(values, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p95_ms": cuts[94] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+def stage_breakdown(messages: int) -> Dict[str, float]:
+    """Milliseconds per message spent in each stage, summed over events."""
+    totals: Dict[str, float] = defaultdict(float)
+    for (stage, _), counts in STAGE_SECONDS.values(include_remote=False).items():
+        totals[stage] += counts[-1]
+    return {stage: seconds / messages * 1000 for stage, seconds in sorted(totals.items())}
+
+
+def run_scenario(scenario: Scenario, messages: List[WorkloadMessage], server: FakeSMTPServer) -> dict:
+    """Consume `messages` once through the supervisor under `scenario`'s settings."""
+    broker = LoadBroker(messages)
+    pool = SMTPConnectionPool(
+        "127.0.0.1", server.port, "user", "secret", use_ssl=False, size=SMTP_CONNECTIONS, timeout=10
+    )
+    patches = {
+        "sending_emails.core.rabitmq_consumer.consumer_workers": scenario.workers,
+        "sending_emails.core.rabitmq_consumer.consumer_batch_size": scenario.batch_size,
+        "sending_emails.emails.smtp_pool._smtp_pool": pool,
+        "sending_emails.core.idempotency._idempotency_cache": IdempotencyCache(),
+    }
+    patchers = [mock.patch(target, value) for target, value in patches.items()]
+    for patcher in patchers:
+        patcher.start()
+    STAGE_SECONDS.reset()
+    sent_before = len(server.messages)
+    try:
+        started = time.perf_counter()
+        RabbitMQConsumerSupervisor(connect=broker.connect).run("1")
+        elapsed = time.perf_counter() - started
+    finally:
+        for patcher in reversed(patchers):
+            patcher.stop()
+        pool.close()
+    if not broker.finished() or len(server.messages) - sent_before != len(messages):
+        raise RuntimeError(f"{scenario.name}: {len(broker.settled_at)}/{len(messages)} settled")
+    return {
+        "msgs_per_sec": len(messages) / elapsed,
+        **percentiles(broker.latencies()),
+        "stages_ms": stage_breakdown(len(messages)),
+    }
+
+
+def regressions(results: Dict[str, dict], baselines: Dict[str, dict], tolerance: float) -> List[str]:
+    """Scenarios slower than their baseline by more than `tolerance`."""
+    problems = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if result["msgs_per_sec"] < baseline["msgs_per_sec"] * (1 - tolerance):
+            problems.append(
+                f"{name}: {result['msgs_per_sec']:,.0f} msgs/s vs {baseline['msgs_per_sec']:,.0f} baseline"
+            )
+        if result["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {result['p95_ms']:.1f} ms vs {baseline['p95_ms']:.1f} ms baseline")
+    return problems
+
+
+def load_baselines(path: str = BASELINES_PATH) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)["scenarios"]
+
+
+def save_baselines(results: Dict[str, dict], path: str = BASELINES_PATH) -> None:
+    document = {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "messages": MESSAGES,
+            "smtp_latency_ms": SMTP_LATENCY * 1000,
+        },
+        "scenarios": {
+            name: {key: round(result[key], 2) for key in ("msgs_per_sec", "p50_ms", "p95_ms", "p99_ms")}
+            for name, result in results.items()
+        },
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
+        file.write("\n")
+
+
+def print_report(results: Dict[str, dict], baselines: Dict[str, dict]) -> None:
+    print(f"{MESSAGES} messages, {SMTP_LATENCY * 1000:.0f} ms SMTP latency, {SMTP_CONNECTIONS} SMTP connections")
+    print(f"{'scenario':<24}{'msgs/s':>10}{'baseline':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, result in results.items():
+        baseline = baselines.get(name, {}).get("msgs_per_sec")
+        print(
+            f"{name:<24}{result['msgs_per_sec']:>10,.0f}{baseline or float('nan'):>10,.0f}"
+            f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+        )
+    print("\nms per message by stage")
+    stages = sorted({stage for result in results.values() for stage in result["stages_ms"]})
+    print(f"{'scenario':<24}" + "".join(f"{stage:>13}" for stage in stages))
+    for name, result in results.items():
+        print(f"{name:<24}" + "".join(f"{result['stages_ms'].get(stage, 0):>13.3f}" for stage in stages))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baselines")
+    parser.add_argument("--check", action="store_true", help="exit with 1 when a scenario regressed")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    messages = generate(MESSAGES)
+    server = FakeSMTPServer(delay=SMTP_LATENCY).start()
+    try:
+        results = {scenario.name: run_scenario(scenario, messages, server) for scenario in SCENARIOS}
+    finally:
+        server.stop()
+    baselines = load_baselines()
+    print_report(results, baselines)
+    if args.save_baseline:
+        save_baselines(results)
+        print(f"\nBaselines saved to {BASELINES_PATH}")
+        return 0
+    problems = regressions(results, baselines, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems and args.check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,24 @@
 """This module contains the main FastAPI application"""
+import asyncio
 import threading
 import logging
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI
-from sending_emails.core.rabitmq_consumer import consume_messages
+from sending_emails.core.config import consumer_mode, consumer_processes
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.core.rabitmq_publisher import close_rabbit_mq_publishers
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.health import consumer_state
+from sending_emails.core.ingestion import router as ingestion_router
+from sending_emails.core.monitoring import router as monitoring_router
+from sending_emails.core.prewarm import begin_startup, check_startup
+from sending_emails.core.process_pool import ConsumerProcessPool
+from sending_emails.core.shutdown import drain_consumer, stop_consumer_thread
+from sending_emails.core.spool import SpoolSender, get_spool
+from sending_emails.emails.smtp_pool import get_smtp_pool
 
 
-app = FastAPI()
 # Creating logger
 dev_logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
 dev_logger.setLevel(logging.INFO)
@@ -19,10 +31,60 @@ handler.setFormatter(formatter)
 dev_logger.addHandler(handler)
 logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
 
+consumer_thread = None
 
-# Create a separate thread for message consumption
-consumer_thread = threading.Thread(target=consume_messages, daemon=True)
-consumer_thread.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the email consumer for as long as the app is up, draining it on shutdown"""
+    global consumer_thread
+    # Bad settings, keys or templates stop the start here; readiness stays
+    # off until the consumer has warmed up and is about to consume
+    startup = begin_startup()
+    check_startup(startup)
+    # With a spool, consumers only commit emails to disk; these threads send them
+    spool = get_spool()
+    spool_sender = SpoolSender(spool) if spool is not None else None
+    if spool_sender is not None:
+        spool_sender.start()
+    if consumer_mode == "asyncio":
+        consumer = AsyncRabbitMQConsumer(startup=startup)
+        await consumer.start()
+        consumer_state.watch(consumer.is_running, consumer.smtp_pool)
+        yield
+        await drain_consumer("asyncio", consumer.stop)
+    elif consumer_mode == "multiprocess":
+        process_pool = ConsumerProcessPool(consumer_processes or None)
+        process_pool.start()
+        # Each process prewarms and reports its own startup
+        startup.finish()
+        consumer_state.watch(process_pool.is_running, remote_reports=process_pool.reports)
+        yield
+        await drain_consumer("multiprocess", lambda: asyncio.to_thread(process_pool.stop))
+    else:
+        # Create a separate thread for message consumption; a daemon, so a
+        # send stuck past the drain deadline cannot hold the process up
+        supervisor = RabbitMQConsumerSupervisor(startup=startup)
+        consumer_thread = threading.Thread(
+            target=supervisor.run, args=("infinite_running",), name="email-consumer", daemon=True
+        )
+        consumer_thread.start()
+        consumer_state.watch(consumer_thread.is_alive, get_smtp_pool())
+        yield
+        await drain_consumer(
+            "threaded",
+            lambda: asyncio.to_thread(stop_consumer_thread, supervisor, consumer_thread, get_smtp_pool()),
+        )
+    if spool_sender is not None and await asyncio.to_thread(spool_sender.stop):
+        # A sender still sending would complete its batch on a closed database:
+        # leave the spool open then, its leased rows are resent after a restart
+        spool.close()
+    close_rabbit_mq_publishers()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(monitoring_router)
+app.include_router(ingestion_router)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8009, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8009, reload=True)
@@ -0,0 +1,285 @@
+"""asyncio RabbitMQ consumer running on the FastAPI event loop"""
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Set
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from sending_emails.core.config import (
+    rabbitmq_exchange,
+    consumer_max_in_flight,
+    consumer_drain_timeout,
+)
+from sending_emails.core.health import consumer_state
+from sending_emails.core.prewarm import StartupReport, prewarm_async_consumer
+from sending_emails.core.metrics import CONSUMER_RECONNECTS, MESSAGES_IN_FLIGHT
+from sending_emails.core.reconnect import ExponentialBackoff, consumer_connection_parameters
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool, get_async_smtp_pool
+from sending_emails.core.idempotency import IdempotencyCache, get_idempotency_cache
+from sending_emails.core.lanes import BULK_LANE, LANES, PRIORITY_LANE, Lane, lane_of
+from sending_emails.core.pipeline import (
+    SEND,
+    prepare,
+    settle,
+    settle_failed_send,
+    settle_sent,
+    settle_unsendable,
+    spool_emails,
+    spooled_entry,
+)
+from sending_emails.core.retry import retry_queue_declarations
+from sending_emails.core.spool import get_spool
+from sending_emails.core.tracing import traced
+from sending_emails.emails.helpers import deliver_email_async
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+
+class AsyncRabbitMQConsumer:
+    """
+    Consume the email queue with pika's asyncio adapter.
+
+    Each delivery becomes a task on the event loop; a semaphore sized to
+    `max_in_flight` (which is also the prefetch count) bounds how many
+    messages are being rendered and sent at once. SMTP goes through the
+    async pool, so in-flight messages never need a thread each. The
+    priority lane has its own prefetch window and semaphore, so bulk
+    messages in flight never hold up an OTP.
+
+    With a `startup` report, templates and the first SMTP sessions are
+    warmed after the topology is declared and before `basic_consume`.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = consumer_max_in_flight,
+        smtp_pool: Optional[AsyncSMTPConnectionPool] = None,
+        backoff: Optional[ExponentialBackoff] = None,
+        idempotency_cache: Optional[IdempotencyCache] = None,
+        startup: Optional[StartupReport] = None,
+    ):
+        self.max_in_flight = max_in_flight
+        self.startup = startup
+        self.smtp_pool = smtp_pool
+        self.backoff = backoff or ExponentialBackoff()
+        self.idempotency_cache = idempotency_cache or get_idempotency_cache()
+        self.topology_declared = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stop_event: Optional[asyncio.Event] = None
+        self._closed: Optional[asyncio.Future] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._connection = None
+        self._channel = None
+        self._consumer_tags: List[str] = []
+        self._runner: Optional[asyncio.Task] = None
+
+    def _bind_loop(self) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._semaphores = {lane.name: asyncio.Semaphore(self._window(lane)) for lane in LANES}
+            self._stop_event = asyncio.Event()
+        if self.smtp_pool is None:
+            self.smtp_pool = get_async_smtp_pool()
+
+    def _window(self, lane: Lane) -> int:
+        return self.max_in_flight if lane is BULK_LANE else lane.prefetch_count
+
+    def is_running(self) -> bool:
+        """True while the reconnect loop is alive."""
+        return self._runner is not None and not self._runner.done()
+
+    async def start(self) -> None:
+        """Start consuming in the background of the running event loop."""
+        self._bind_loop()
+        self._runner = self._loop.create_task(self._run())
+
+    async def stop(self, timeout: float = consumer_drain_timeout) -> bool:
+        """
+        Cancel the consumer, give in-flight messages `timeout` seconds to
+        finish, then close everything. Messages still sending at the
+        deadline are cancelled and nacked back to the queue; returns
+        whether everything finished in time.
+        """
+        self._stop_event.set()
+        if self._channel is not None and self._channel.is_open:
+            for consumer_tag in self._consumer_tags:
+                self._channel.basic_cancel(consumer_tag)
+        unfinished = set()
+        if self._tasks:
+            _, unfinished = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        if self._connection is not None and not (
+            self._connection.is_closed or self._connection.is_closing
+        ):
+            self._connection.close()
+        if self._runner is not None:
+            await self._runner
+        await self.smtp_pool.close()
+        return not unfinished
+
+    async def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                await self._consume_until_closed()
+            except Exception as exc:
+                logger.info("An error occurred: %s", exc)
+                consumer_state.mark_disconnected(exc)
+            if not self._stop_event.is_set():
+                CONSUMER_RECONNECTS.inc()
+                delay = self.backoff.next_delay()
+                logger.info("Reconnecting to RabbitMQ in %.2f seconds...", delay)
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _wait_for_callback(self, register: Callable[[Callable], None]):
+        """Turn a pika callback-style call into an awaitable that fails if the connection drops."""
+        future = self._loop.create_future()
+
+        def on_done(*args):
+            if not future.done():
+                future.set_result(args[0] if args else None)
+
+        register(on_done)
+        await asyncio.wait({future, self._closed}, return_when=asyncio.FIRST_COMPLETED)
+        if not future.done():
+            raise pika.exceptions.AMQPConnectionError("Connection closed during setup")
+        return future.result()
+
+    async def _consume_until_closed(self) -> None:
+        opened = self._loop.create_future()
+        self._closed = self._loop.create_future()
+
+        def on_open_error(connection, error):
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPConnectionError(error))
+
+        def on_close(connection, reason):
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPConnectionError(reason))
+            if not self._closed.done():
+                self._closed.set_result(reason)
+
+        self._connection = AsyncioConnection(
+            consumer_connection_parameters(),
+            on_open_callback=lambda connection: opened.done() or opened.set_result(connection),
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_close,
+            custom_ioloop=self._loop,
+        )
+        connection = await opened
+
+        channel = await self._wait_for_callback(
+            lambda cb: connection.channel(on_open_callback=cb)
+        )
+        channel.add_on_close_callback(self._on_channel_closed)
+        warming = self.startup is not None and not self.startup.finished
+        if not self.topology_declared:
+            if warming:
+                with self.startup.step("topology"):
+                    await self._declare_topology(channel)
+            else:
+                await self._declare_topology(channel)
+        if warming:
+            await prewarm_async_consumer(self.startup, self.smtp_pool)
+        self._channel = channel
+        self._consumer_tags = []
+        for lane in LANES:
+            # Per-consumer prefetch: each lane gets its own window
+            await self._wait_for_callback(
+                lambda cb, lane=lane: channel.basic_qos(prefetch_count=self._window(lane), callback=cb)
+            )
+            self._consumer_tags.append(
+                channel.basic_consume(queue=lane.queue, on_message_callback=self.on_message, auto_ack=False)
+            )
+        logger.info(
+            "Async email consumer listening on %s with %s messages in flight (%s in the priority lane)",
+            ", ".join(lane.queue for lane in LANES),
+            self.max_in_flight,
+            PRIORITY_LANE.prefetch_count,
+        )
+        consumer_state.mark_connected()
+        self.backoff.reset()
+        reason = await self._closed
+        consumer_state.mark_disconnected(reason)
+        logger.info("RabbitMQ connection closed: %s", reason)
+
+    async def _declare_topology(self, channel) -> None:
+        await self._wait_for_callback(
+            lambda cb: channel.exchange_declare(
+                exchange=rabbitmq_exchange, exchange_type="direct", callback=cb
+            )
+        )
+        for lane in LANES:
+            await self._wait_for_callback(
+                lambda cb, lane=lane: channel.queue_declare(queue=lane.queue, callback=cb)
+            )
+            await self._wait_for_callback(
+                lambda cb, lane=lane: channel.queue_bind(
+                    queue=lane.queue,
+                    exchange=rabbitmq_exchange,
+                    routing_key=lane.routing_key,
+                    callback=cb,
+                )
+            )
+        for queue, arguments in retry_queue_declarations():
+            await self._wait_for_callback(
+                lambda cb, queue=queue, arguments=arguments: channel.queue_declare(
+                    queue=queue, durable=True, arguments=arguments, callback=cb
+                )
+            )
+        self.topology_declared = True
+
+    def _on_channel_closed(self, channel, reason) -> None:
+        """A closed channel stops consumption: drop the connection so `_run` reconnects."""
+        if isinstance(reason, pika.exceptions.ChannelClosedByBroker) and reason.reply_code == 404:
+            # The broker restarted without our queue: declare it on the next connection
+            self.topology_declared = False
+        if self._stop_event.is_set():
+            return
+        logger.info("RabbitMQ channel closed: %s", reason)
+        if self._connection is not None and not (
+            self._connection.is_closed or self._connection.is_closing
+        ):
+            self._connection.close()
+
+    def on_message(self, channel, method, properties, body) -> None:
+        """pika `on_message_callback`: schedule the delivery as a task."""
+        task = self._loop.create_task(self.process_message(channel, method, properties, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def process_message(self, channel, method, properties, body) -> bool:
+        """Render and send one delivery, then ack it on the loop thread."""
+        self._bind_loop()
+        try:
+            with traced(method, properties):
+                async with self._semaphores[lane_of(method).name]:
+                    return await self._process(channel, method, properties, body)
+        except asyncio.CancelledError:
+            # Shutdown deadline passed: hand the delivery back before the connection closes
+            if channel.is_open:
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            raise
+
+    async def _process(self, channel, method, properties, body) -> bool:
+        MESSAGES_IN_FLIGHT.inc()
+        try:
+            prepared = prepare(properties, body, self.idempotency_cache)
+            if prepared.action != SEND:
+                return settle_unsendable(channel, method, properties, body, prepared)
+            entries = [spooled_entry(properties, prepared)]
+            # The append fsyncs: keep it off the loop, and skip the thread hop without a spool
+            if get_spool() is not None and await asyncio.to_thread(spool_emails, entries, self.idempotency_cache):
+                settle(channel.basic_ack, "spooled", prepared.event, delivery_tag=method.delivery_tag)
+                return True
+            try:
+                await deliver_email_async(*prepared.email, pool=self.smtp_pool)
+            except Exception as send_error:
+                return settle_failed_send(channel, method, properties, body, prepared, send_error)
+            return settle_sent(channel, method, properties, prepared, self.idempotency_cache)
+        finally:
+            MESSAGES_IN_FLIGHT.dec()
@@ -0,0 +1,153 @@
+"""Micro-batching of RabbitMQ deliveries for multi-message SMTP sessions"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from sending_emails.core.worker_pool import ThreadSafeChannel
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+
+class Delivery(NamedTuple):
+    """One message as handed to pika's `on_message_callback`."""
+
+    method: object
+    properties: object
+    body: bytes
+
+
+class SettlementTracker:
+    """
+    Channel stand-in that remembers which delivery tags were settled.
+
+    If `process_batch` raises halfway, only the deliveries it has not yet
+    acked, nacked or rejected may be nacked: settling a tag twice is a
+    PRECONDITION_FAILED that closes the channel.
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+        self.settled = set()
+
+    def basic_ack(self, delivery_tag=0, multiple=False) -> None:
+        self._channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+        self.settled.add(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True) -> None:
+        self._channel.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+        self.settled.add(delivery_tag)
+
+    def basic_reject(self, delivery_tag=0, requeue=True) -> None:
+        self._channel.basic_reject(delivery_tag=delivery_tag, requeue=requeue)
+        self.settled.add(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None) -> None:
+        self._channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+
+class MicroBatcher:
+    """
+    Collect deliveries until `batch_size` arrived or `max_wait` seconds passed.
+
+    Runs on the pika connection thread: `add` is the `on_message_callback`
+    and the flush timer is a `call_later` on the same connection. Full
+    batches go to `process_batch(channel, deliveries)`, inline or on a pool
+    of `workers` threads (acks then go through `ThreadSafeChannel`). The
+    prefetch count must be at least `batch_size` or batches never fill.
+    Deliveries for which `urgent(method)` is true skip the wait and go out
+    as a batch of their own.
+    """
+
+    def __init__(
+        self,
+        connection,
+        process_batch: Callable[[object, List[Delivery]], object],
+        batch_size: int,
+        max_wait: float,
+        workers: int = 1,
+        urgent: Optional[Callable[[object], bool]] = None,
+    ):
+        self.connection = connection
+        self.process_batch = process_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.urgent = urgent
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-batch-sender")
+        self._pending: List[Delivery] = []
+        # Batches handed to the executor, until they are done
+        self._submitted: List[Tuple[Future, List[Delivery]]] = []
+        self._channel = None
+        self._timer = None
+
+    def add(self, ch, method, properties, body) -> None:
+        """pika `on_message_callback`: queue the delivery, flushing when the batch is full."""
+        self._channel = ch
+        if self.urgent is not None and self.urgent(method):
+            self._dispatch([Delivery(method, properties, body)])
+            return
+        self._pending.append(Delivery(method, properties, body))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self.connection.call_later(self.max_wait, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def flush(self) -> None:
+        """Hand whatever is pending to `process_batch`."""
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Delivery]) -> None:
+        if self.executor is None:
+            self._run(self._channel, batch)
+        else:
+            self._submitted = [(future, sent) for future, sent in self._submitted if not future.done()]
+            future = self.executor.submit(self._run, ThreadSafeChannel(self.connection, self._channel), batch)
+            self._submitted.append((future, batch))
+
+    def _run(self, ch, batch: List[Delivery]) -> None:
+        tracker = SettlementTracker(ch)
+        try:
+            self.process_batch(tracker, batch)
+        except Exception as exc:
+            logger.exception("Error while processing a batch of %s deliveries: %s", len(batch), exc)
+            for delivery in batch:
+                if delivery.method.delivery_tag in tracker.settled:
+                    continue
+                ch.basic_nack(
+                    delivery_tag=delivery.method.delivery_tag,
+                    requeue=not delivery.method.redelivered,
+                )
+
+    def shutdown(self) -> int:
+        """
+        Let running batches finish, then nack the deliveries that never
+        started (unflushed or still queued for a worker) back to the broker;
+        returns how many were nacked.
+        """
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+        unsent, self._pending = self._pending, []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            for future, batch in self._submitted:
+                if future.cancelled():
+                    unsent.extend(batch)
+            self._submitted = []
+        if unsent and self.connection.is_open:
+            # Still on the connection thread, but workers may be queueing acks too
+            channel = ThreadSafeChannel(self.connection, self._channel)
+            for delivery in unsent:
+                channel.basic_nack(delivery_tag=delivery.method.delivery_tag, requeue=True)
+        if unsent:
+            logger.info("Requeued %s deliveries that had not started sending", len(unsent))
+        return len(unsent)
@@ -1,4 +1,4 @@
-from decouple import config
+from decouple import Csv, config
 
 
 rabbitmq_host = config("RABBITMQ_HOST")
@@ -8,3 +8,94 @@ rabbitmq_password = config("RABBITMQ_PASSWORD")
 rabbitmq_quee = config("RABBITMQ_QUEE")
 rabbitmq_exchange = config("RABBITMQ_EXCHANGE")
 rabbitmq_routing_key = config("RABBITMQ_ROUTING_KEY")
+
+# Connection liveness: AMQP heartbeat interval and how long the broker may
+# keep the connection blocked before we drop it and reconnect (seconds).
+rabbitmq_heartbeat = config("RABBITMQ_HEARTBEAT", default=30, cast=int)
+rabbitmq_blocked_connection_timeout = config("RABBITMQ_BLOCKED_CONNECTION_TIMEOUT", default=60, cast=float)
+
+# Publisher (re)connects: how long opening the connection may take, and how
+# long other publishes wait for a connect in progress before giving up.
+rabbitmq_publisher_connect_timeout = config("RABBITMQ_PUBLISHER_CONNECT_TIMEOUT", default=5, cast=float)
+
+# Reconnect pacing: full-jitter exponential backoff from BASE up to CAP seconds
+reconnect_backoff_base = config("RECONNECT_BACKOFF_BASE", default=0.2, cast=float)
+reconnect_backoff_cap = config("RECONNECT_BACKOFF_CAP", default=30, cast=float)
+
+# Consumer flow control: unacked deliveries the broker may push to us, and
+# sender threads that process them (1 = run the callback inline).
+rabbitmq_prefetch_count = config("RABBITMQ_PREFETCH_COUNT", default=10, cast=int)
+consumer_workers = config("CONSUMER_WORKERS", default=1, cast=int)
+
+# "threaded" runs the blocking pika consumer on a thread beside uvicorn,
+# "asyncio" runs it on the FastAPI event loop with async SMTP sending,
+# "multiprocess" runs CONSUMER_PROCESSES threaded consumers in child processes.
+consumer_mode = config("CONSUMER_MODE", default="threaded")
+consumer_max_in_flight = config("CONSUMER_MAX_IN_FLIGHT", default=100, cast=int)
+
+# Multiprocess mode: process count (0 = one per CPU) and seconds between the
+# metric/health reports each process sends. In every mode, a stopping
+# consumer gets CONSUMER_DRAIN_TIMEOUT seconds to finish in-flight messages.
+consumer_processes = config("CONSUMER_PROCESSES", default=0, cast=int)
+consumer_report_interval = config("CONSUMER_REPORT_INTERVAL", default=1, cast=float)
+consumer_drain_timeout = config("CONSUMER_DRAIN_TIMEOUT", default=30, cast=float)
+
+# Micro-batching: deliver up to this many messages per SMTP session, waiting
+# at most CONSUMER_BATCH_WAIT_MS for a batch to fill (1 = no batching).
+consumer_batch_size = config("CONSUMER_BATCH_SIZE", default=1, cast=int)
+consumer_batch_wait_ms = config("CONSUMER_BATCH_WAIT_MS", default=50, cast=int)
+
+# Health checks: how long the consumer may hold deliveries (/healthz) or sit
+# on a non-empty queue (/readyz) without settling a message before the probe
+# fails; and how long a passive queue_declare backlog reading is reused.
+health_stall_seconds = config("HEALTH_STALL_SECONDS", default=300, cast=int)
+health_backlog_cache_seconds = config("HEALTH_BACKLOG_CACHE_SECONDS", default=5, cast=float)
+
+# Retries of failed sends: default attempts and the delay tiers (seconds)
+# a message waits in `<queue>.retry.<delay>s` before returning to the queue.
+# Messages that run out of retries end up in `<queue>.dead`.
+retry_max_retries = config("RETRY_MAX_RETRIES", default=5, cast=int)
+retry_delays = config("RETRY_DELAYS", default="5,30,120,600", cast=Csv(int))
+
+# De-duplication of redelivered messages: how many delivered message ids
+# each process remembers and for how long. Setting IDEMPOTENCY_SQLITE_PATH
+# shares them between consumer processes through a SQLite file.
+idempotency_cache_size = config("IDEMPOTENCY_CACHE_SIZE", default=10000, cast=int)
+idempotency_ttl_seconds = config("IDEMPOTENCY_TTL_SECONDS", default=86400, cast=float)
+idempotency_sqlite_path = config("IDEMPOTENCY_SQLITE_PATH", default="")
+
+# Priority lane: events whose priority is at least PRIORITY_LANE_MIN_PRIORITY
+# are published to `<queue>.priority` (routing key `<routing key>.priority`),
+# consumed beside the main queue with their own prefetch window, so bulk
+# bursts in the main queue cannot delay them.
+priority_lane_min_priority = config("PRIORITY_LANE_MIN_PRIORITY", default=5, cast=int)
+priority_lane_prefetch_count = config("PRIORITY_LANE_PREFETCH_COUNT", default=10, cast=int)
+
+# Local spool: with SPOOL_PATH set, rendered emails are committed to this
+# SQLite file and acked at once, so SMTP latency and outages no longer hold
+# deliveries unacked. SPOOL_SENDERS threads send them in batches of
+# SPOOL_BATCH_SIZE, retrying with the event's retry policy; a claimed email
+# whose sender died is sent again once its SPOOL_LEASE_SECONDS lease ran out.
+# Emails that failed for good or whose secrets expired are kept, without
+# their bodies, for SPOOL_DEAD_RETENTION_SECONDS.
+spool_path = config("SPOOL_PATH", default="")
+spool_senders = config("SPOOL_SENDERS", default=4, cast=int)
+spool_batch_size = config("SPOOL_BATCH_SIZE", default=20, cast=int)
+spool_lease_seconds = config("SPOOL_LEASE_SECONDS", default=120, cast=float)
+spool_poll_interval = config("SPOOL_POLL_INTERVAL", default=1, cast=float)
+spool_dead_retention_seconds = config("SPOOL_DEAD_RETENTION_SECONDS", default=7 * 24 * 3600, cast=float)
+
+# Tracing: publishers stamp a W3C traceparent header and sample
+# TRACE_SAMPLE_RATE of the messages; consumers append the spans of sampled
+# messages to TRACE_EXPORT_PATH as OTLP/JSON lines (empty = not exported).
+trace_sample_rate = config("TRACE_SAMPLE_RATE", default=0.01, cast=float)
+trace_export_path = config("TRACE_EXPORT_PATH", default="")
+trace_service_name = config("TRACE_SERVICE_NAME", default="retinopathy-email-service")
+
+# Bulk HTTP ingestion (POST /v1/emails:batch): the shared token callers send
+# as `Authorization: Bearer <token>` (the endpoint refuses every request while
+# it is unset), most events accepted per request, and the TTL (seconds) of the
+# messages it publishes.
+ingest_api_token = config("INGEST_API_TOKEN", default="")
+ingest_max_batch_size = config("INGEST_MAX_BATCH_SIZE", default=1000, cast=int)
+ingest_message_ttl = config("INGEST_MESSAGE_TTL", default=3600, cast=int)
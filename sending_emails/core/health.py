@@ -0,0 +1,285 @@
+"""Consumer liveness/readiness state behind /healthz and /readyz"""
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import pika
+from sending_emails.core.config import (
+    rabbitmq_username,
+    rabbitmq_password,
+    rabbitmq_host,
+    rabbitmq_port,
+    health_stall_seconds,
+    health_backlog_cache_seconds,
+)
+from sending_emails.core.lanes import LANES
+from sending_emails.core.metrics import MESSAGES_IN_FLIGHT, Gauge
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+QUEUE_BACKLOG = Gauge(
+    "email_queue_backlog",
+    "Ready messages in each lane queue at the last passive queue_declare",
+    ("queue",),
+)
+
+
+class QueueBacklogProbe:
+    """
+    Read the lane queue depths with passive `queue_declare`s on a short-lived connection.
+
+    The consumer's own connection is owned by its thread (or event loop), so
+    the probe never touches it. Readings are cached for `cache_seconds` so
+    frequent orchestrator probes do not turn into broker connections.
+    """
+
+    def __init__(
+        self,
+        queues: Sequence[str] = tuple(lane.queue for lane in LANES),
+        cache_seconds: float = health_backlog_cache_seconds,
+        connect: Optional[Callable[[], object]] = None,
+    ):
+        self.queues = tuple(queues)
+        self.cache_seconds = cache_seconds
+        self._connect = connect or self._default_connect
+        self._lock = threading.Lock()
+        self._checked_at: Optional[float] = None
+        self._reading: Optional[dict] = None
+
+    @staticmethod
+    def _default_connect():
+        credentials = pika.PlainCredentials(rabbitmq_username, rabbitmq_password)
+        return pika.BlockingConnection(
+            pika.ConnectionParameters(
+                rabbitmq_host,
+                rabbitmq_port,
+                "/",
+                credentials,
+                connection_attempts=1,
+                socket_timeout=2,
+                blocked_connection_timeout=2,
+            )
+        )
+
+    def _probe(self) -> dict:
+        unknown = {"messages": None, "consumers": None, "queues": {}}
+        try:
+            connection = self._connect()
+        except Exception as exc:
+            return dict(unknown, error=repr(exc))
+        try:
+            # A missing queue closes the channel, so that reading fails as a whole
+            channel = connection.channel()
+            queues = {}
+            for queue in self.queues:
+                frame = channel.queue_declare(queue=queue, passive=True)
+                QUEUE_BACKLOG.set(labels=(queue,), value=frame.method.message_count)
+                queues[queue] = {
+                    "messages": frame.method.message_count,
+                    "consumers": frame.method.consumer_count,
+                }
+            return {
+                "messages": sum(queue["messages"] for queue in queues.values()),
+                "consumers": min(queue["consumers"] for queue in queues.values()),
+                "queues": queues,
+                "error": None,
+            }
+        except Exception as exc:
+            return dict(unknown, error=repr(exc))
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def read(self) -> dict:
+        """Return the cached reading, probing the broker when it is stale."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.cache_seconds:
+                self._reading = self._probe()
+                self._checked_at = now
+            return dict(self._reading, age_seconds=round(now - self._checked_at, 3))
+
+
+class ConsumerState:
+    """
+    What the consumer last reported about itself.
+
+    The consumer marks connects, disconnects and settled deliveries; the
+    lifespan registers how to tell whether the consumer is still running and
+    which SMTP pool it sends through. Reads never block the consumer.
+
+    Liveness only asks whether the consumer itself is dead or wedged, so a
+    broker outage or a deep queue never gets the pod restarted; those fail
+    readiness instead.
+
+    In multiprocess mode each consumer process keeps its own state and ships
+    `report()` to the FastAPI process, whose state is then built from those
+    reports (`remote_reports`) instead of its own fields.
+    """
+
+    def __init__(
+        self,
+        backlog_probe: Optional[QueueBacklogProbe] = None,
+        stall_seconds: float = health_stall_seconds,
+    ):
+        self.backlog_probe = backlog_probe or QueueBacklogProbe()
+        self.stall_seconds = stall_seconds
+        self._is_running: Optional[Callable[[], bool]] = None
+        self._smtp_pool = None
+        self._remote_reports: Optional[Callable[[], Dict[str, dict]]] = None
+        self.connected = False
+        self.draining = False
+        self.prewarming = False
+        self.startup: Optional[dict] = None
+        self.changed_at = time.time()
+        self.last_error: Optional[str] = None
+        self.last_ack_at: Optional[float] = None
+        self.last_settled_at: Optional[float] = None
+
+    def watch(
+        self,
+        is_running: Callable[[], bool],
+        smtp_pool=None,
+        remote_reports: Optional[Callable[[], Dict[str, dict]]] = None,
+    ) -> None:
+        """Register the running-check of the consumer and where its state comes from."""
+        self._is_running = is_running
+        self._smtp_pool = smtp_pool
+        self._remote_reports = remote_reports
+
+    def mark_connected(self) -> None:
+        self.connected = True
+        self.changed_at = time.time()
+
+    def mark_disconnected(self, error: object = None) -> None:
+        if self.connected:
+            self.connected = False
+            self.changed_at = time.time()
+        if error is not None:
+            self.last_error = repr(error)
+
+    def mark_prewarming(self) -> None:
+        """Startup began: not ready until the consumer is prewarmed."""
+        self.prewarming = True
+
+    def mark_prewarmed(self, startup: dict) -> None:
+        """Prewarming finished; `startup` is the startup-time report shown on /readyz."""
+        self.prewarming = False
+        self.startup = startup
+
+    def mark_draining(self) -> None:
+        """Shutdown started: fail readiness so no new work is routed here."""
+        self.draining = True
+
+    def mark_settled(self, acked: bool) -> None:
+        now = time.time()
+        self.last_settled_at = now
+        if acked:
+            self.last_ack_at = now
+
+    def report(self) -> dict:
+        """This process's consumer state as plain, picklable data."""
+        return {
+            "connected": self.connected,
+            "since": self.changed_at,
+            "last_error": self.last_error,
+            "last_ack_at": self.last_ack_at,
+            "last_settled_at": self.last_settled_at,
+            "prewarming": self.prewarming,
+            "startup": self.startup,
+            "in_flight": int(MESSAGES_IN_FLIGHT.values(include_remote=False).get((), 0)),
+            "smtp": None if self._smtp_pool is None else self._smtp_pool.health(),
+        }
+
+    def _reports(self) -> Dict[str, dict]:
+        if self._remote_reports is not None:
+            return self._remote_reports()
+        return {"consumer": self.report()}
+
+    def _stalled(self, now: float, reports: Dict[str, dict]) -> List[str]:
+        """Consumers holding deliveries they have not settled for `stall_seconds`."""
+        problems = []
+        for name, report in reports.items():
+            prefix = "" if len(reports) == 1 else f"{name}: "
+            progress_at = max(report["last_settled_at"] or 0, report["since"])
+            if report["in_flight"] and now - progress_at > self.stall_seconds:
+                problems.append(
+                    f"{prefix}{report['in_flight']} in flight but nothing settled for {now - progress_at:.0f}s"
+                )
+        return problems
+
+    def _backlogged(self, now: float, reports: Dict[str, dict], backlog: dict) -> List[str]:
+        """Connected consumers sitting on a non-empty queue without settling anything."""
+        problems = []
+        for name, report in reports.items():
+            prefix = "" if len(reports) == 1 else f"{name}: "
+            if report["connected"] and backlog["messages"]:
+                progress_at = max(report["last_settled_at"] or 0, report["since"])
+                if now - progress_at > self.stall_seconds:
+                    problems.append(
+                        f"{prefix}{backlog['messages']} queued but nothing settled for {now - progress_at:.0f}s"
+                    )
+        return problems
+
+    def liveness(self) -> Tuple[bool, dict]:
+        """Alive unless the consumer died or stopped settling the deliveries it holds."""
+        now = time.time()
+        running = self._is_running is not None and self._is_running()
+        reports = self._reports()
+        problems = [] if running else ["consumer is not running"]
+        problems.extend(self._stalled(now, reports))
+        acks = [report["last_ack_at"] for report in reports.values() if report["last_ack_at"]]
+        settles = [report["last_settled_at"] for report in reports.values() if report["last_settled_at"]]
+        report = {
+            "status": "fail" if problems else "ok",
+            "problems": problems,
+            "consumer_running": running,
+            "in_flight": sum(report["in_flight"] for report in reports.values()),
+            "broker": {
+                "connected": bool(reports) and all(report["connected"] for report in reports.values()),
+                "since": max((report["since"] for report in reports.values()), default=None),
+                "last_error": next(
+                    (report["last_error"] for report in reports.values() if report["last_error"]), None
+                ),
+            },
+            "last_ack_at": max(acks, default=None),
+            "last_settled_at": max(settles, default=None),
+        }
+        if self._remote_reports is not None:
+            report["processes"] = reports
+        return not problems, report
+
+    def readiness(self) -> Tuple[bool, dict]:
+        """
+        Ready when alive, prewarmed, not shutting down, connected to the
+        broker, keeping up with the lane queues and able to reach SMTP.
+        """
+        alive, report = self.liveness()
+        problems = report["problems"]
+        reports = self._reports()
+        if self.prewarming or any(worker.get("prewarming") for worker in reports.values()):
+            problems.append("prewarming")
+        if self.draining:
+            problems.append("draining for shutdown")
+        if not report["broker"]["connected"]:
+            problems.append("broker not connected")
+        backlog = self.backlog_probe.read()
+        problems.extend(self._backlogged(time.time(), reports, backlog))
+        report["backlog"] = backlog
+        smtp_reports = [worker["smtp"] for worker in reports.values()]
+        if not smtp_reports or None in smtp_reports:
+            problems.append("SMTP pool not started")
+        else:
+            for smtp in smtp_reports:
+                if not smtp["healthy"]:
+                    problems.append(f"SMTP relay {smtp['relay']} unhealthy: {smtp['last_error']}")
+        report["smtp"] = smtp_reports[0] if len(smtp_reports) == 1 else smtp_reports
+        startups = [worker.get("startup") for worker in reports.values()]
+        report["startup"] = startups[0] if len(startups) == 1 else startups
+        report["status"] = "fail" if problems else "ok"
+        return not problems, report
+
+
+consumer_state = ConsumerState()
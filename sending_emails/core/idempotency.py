@@ -0,0 +1,174 @@
+"""Remember delivered messages so redeliveries are acked without sending twice"""
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Optional
+from sending_emails.core.config import (
+    idempotency_cache_size,
+    idempotency_ttl_seconds,
+    idempotency_sqlite_path,
+)
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+
+def delivery_key(properties, body: bytes) -> str:
+    """
+    The AMQP `message_id` of a delivery, or a hash of its body.
+
+    The publisher sets a message id on everything it sends; the body hash
+    covers messages from publishers that do not.
+    """
+    message_id = getattr(properties, "message_id", None)
+    if message_id:
+        return f"id:{message_id}"
+    return f"sha256:{hashlib.sha256(body).hexdigest()}"
+
+
+class IdempotencyBackend(ABC):
+    """Shared store of delivered keys, visible to every consumer process."""
+
+    @abstractmethod
+    def contains(self, key: str, now: float) -> bool:
+        """Tell whether `key` was delivered and has not expired at `now`."""
+
+    @abstractmethod
+    def add(self, key: str, expires_at: float) -> None:
+        """Record `key` as delivered until `expires_at`."""
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteIdempotencyBackend(IdempotencyBackend):
+    """
+    Delivered keys in a SQLite file shared by the processes of one host.
+
+    WAL mode lets readers in other processes proceed while one writes.
+    Expired rows are pruned every `prune_every` writes.
+    """
+
+    def __init__(self, path: str, prune_every: int = 1000):
+        self.path = path
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS delivered (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+
+    def contains(self, key: str, now: float) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT expires_at FROM delivered WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > now
+
+    def add(self, key: str, expires_at: float) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO delivered (key, expires_at) VALUES (?, ?)", (key, expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._db.execute("DELETE FROM delivered WHERE expires_at <= ?", (time.time(),))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU of delivered keys, each remembered for `ttl` seconds.
+
+    The in-process LRU answers most lookups with a dict access; with a
+    `backend`, misses fall through to it and every delivery is written to
+    it, so a message redelivered to another process is recognised too.
+    Only successful sends are remembered, so a failed attempt stays free
+    to be retried.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = idempotency_cache_size,
+        ttl: float = idempotency_ttl_seconds,
+        backend: Optional[IdempotencyBackend] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+
+    def _remember_locally(self, key: str, expires_at: float) -> None:
+        self._entries[key] = expires_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def seen(self, key: str) -> bool:
+        """Tell whether `key` was already delivered within the TTL."""
+        now = self.clock()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return True
+                del self._entries[key]
+        if self.backend is None:
+            return False
+        try:
+            found = self.backend.contains(key, now)
+        except Exception as exc:
+            # Sending twice beats not sending: treat an unreadable backend as a miss
+            logger.warning("Idempotency backend lookup failed: %s", exc)
+            return False
+        if found:
+            with self._lock:
+                self._remember_locally(key, now + self.ttl)
+        return found
+
+    def remember(self, key: str) -> None:
+        """Record `key` as delivered."""
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._remember_locally(key, expires_at)
+        if self.backend is not None:
+            try:
+                self.backend.add(key, expires_at)
+            except Exception as exc:
+                logger.warning("Idempotency backend write failed: %s", exc)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def close(self) -> None:
+        if self.backend is not None:
+            self.backend.close()
+
+
+_idempotency_cache: Optional[IdempotencyCache] = None
+_idempotency_cache_lock = threading.Lock()
+
+
+def get_idempotency_cache() -> IdempotencyCache:
+    """Return the process-wide cache, backed by SQLite when a path is configured."""
+    global _idempotency_cache
+    if _idempotency_cache is None:
+        with _idempotency_cache_lock:
+            if _idempotency_cache is None:
+                backend = (
+                    SQLiteIdempotencyBackend(idempotency_sqlite_path) if idempotency_sqlite_path else None
+                )
+                _idempotency_cache = IdempotencyCache(backend=backend)
+    return _idempotency_cache
@@ -0,0 +1,125 @@
+"""Bulk HTTP ingestion for producers that cannot speak AMQP"""
+import hmac
+import uuid
+import logging
+from typing import Any, List, NamedTuple, Optional
+from fastapi import APIRouter, Body, Header
+from fastapi.responses import JSONResponse
+from sending_emails.core.config import ingest_api_token, ingest_max_batch_size, ingest_message_ttl
+from sending_emails.core.metrics import Counter
+from sending_emails.core.rabitmq_publisher import get_rabbit_mq_publisher
+from sending_emails.emails.events import InvalidEmailPayload
+from sending_emails.emails.payloads import encode_payload
+# Importing send_mails registers the events we validate against
+from sending_emails.emails.send_mails import get_email_event
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+INGESTED_TOTAL = Counter(
+    "email_ingested_total",
+    "Events received over HTTP, by event and status (accepted, invalid, failed)",
+    ("event", "status"),
+)
+
+router = APIRouter()
+
+
+class IngestedItem(NamedTuple):
+    event: str
+    body: Optional[bytes]
+    priority: int
+    error: Optional[str]
+
+
+def validate_item(item: Any) -> IngestedItem:
+    """
+    Check one `{event, data}` item the way the consumer will, short of
+    decrypting secrets, and serialize it for publishing.
+    """
+    event_name = item.get("event") if isinstance(item, dict) else None
+    email_event = get_email_event(event_name) if isinstance(event_name, str) else None
+    if email_event is None:
+        error = "item must be an object" if not isinstance(item, dict) else f"unknown event: {event_name}"
+        return IngestedItem("invalid", None, 0, error)
+    try:
+        email_event.validate(item.get("data"))
+    except InvalidEmailPayload as exc:
+        return IngestedItem(email_event.name, None, 0, str(exc))
+    body = encode_payload({"event": email_event.name, "data": item["data"]})
+    return IngestedItem(email_event.name, body, email_event.priority, None)
+
+
+def ingest_batch(items: List[Any], publisher=None, ttl: int = ingest_message_ttl) -> List[dict]:
+    """
+    Validate every item, then publish the valid ones in one confirmed batch.
+
+    Returns one result per item, in order: `accepted` with the message id
+    the consumer will see, `invalid` (fix the item, do not resend it as is)
+    or `failed` (the broker did not confirm it; safe to resend).
+    """
+    validated = [validate_item(item) for item in items]
+    valid = [index for index, item in enumerate(validated) if item.error is None]
+    message_ids = [uuid.uuid4().hex for _ in valid]
+    confirmed = []
+    if valid:
+        publisher = publisher or get_rabbit_mq_publisher()
+        confirmed = publisher.publish_many(
+            [validated[index].body for index in valid],
+            ttl,
+            priorities=[validated[index].priority for index in valid],
+            message_ids=message_ids,
+        )
+    published = {index: (message_id, ok) for index, message_id, ok in zip(valid, message_ids, confirmed)}
+
+    results = []
+    for index, item in enumerate(validated):
+        if item.error is not None:
+            status, result = "invalid", {"error": item.error}
+        elif published[index][1]:
+            status, result = "accepted", {"message_id": published[index][0]}
+        else:
+            status, result = "failed", {"error": "not confirmed by the broker"}
+        INGESTED_TOTAL.inc((item.event, status))
+        results.append({"index": index, "status": status, **result})
+    logger.info(
+        "Ingested %d events: %d accepted, %d invalid",
+        len(items), sum(confirmed), len(items) - len(valid),
+    )
+    return results
+
+
+def is_authorized(authorization: Optional[str]) -> bool:
+    """Whether `authorization` is `Bearer <INGEST_API_TOKEN>`; never true while no token is configured."""
+    if not ingest_api_token or not isinstance(authorization, str):
+        return False
+    scheme, _, credentials = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        credentials.strip().encode(), ingest_api_token.encode()
+    )
+
+
+@router.post("/v1/emails:batch")
+def publish_email_batch(
+    items: List[Any] = Body(...), authorization: Optional[str] = Header(None)
+) -> JSONResponse:
+    """
+    Queue a batch of `{event, data}` emails in one round trip.
+
+    202 when every item was queued, 207 with per-item statuses otherwise,
+    401 without the INGEST_API_TOKEN bearer token, 413 when the batch
+    exceeds INGEST_MAX_BATCH_SIZE.
+    """
+    if not is_authorized(authorization):
+        logger.warning("Refused an unauthenticated batch of %d events", len(items))
+        return JSONResponse(
+            {"detail": "a valid bearer token is required"},
+            status_code=401,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if len(items) > ingest_max_batch_size:
+        return JSONResponse(
+            {"detail": f"at most {ingest_max_batch_size} items per batch"}, status_code=413
+        )
+    results = ingest_batch(items)
+    all_accepted = all(result["status"] == "accepted" for result in results)
+    return JSONResponse({"results": results}, status_code=202 if all_accepted else 207)
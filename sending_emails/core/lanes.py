@@ -0,0 +1,93 @@
+"""Priority and bulk lanes: one queue each, so urgent emails never wait behind bulk ones"""
+import math
+import time
+from typing import NamedTuple, Optional
+from sending_emails.core.config import (
+    rabbitmq_quee,
+    rabbitmq_routing_key,
+    rabbitmq_prefetch_count,
+    priority_lane_min_priority,
+    priority_lane_prefetch_count,
+)
+from sending_emails.core.metrics import Histogram
+from sending_emails.emails.payloads import decode_payload
+# Importing send_mails registers the events whose priorities we look up
+from sending_emails.emails.send_mails import get_email_event
+
+# Wall-clock publish time (epoch seconds) set by the publisher
+PUBLISHED_AT_HEADER = "x-published-at"
+
+DELIVERY_LATENCY = Histogram(
+    "email_delivery_latency_seconds",
+    "Time from publish to a settled send, by lane and event",
+    ("lane", "event"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+class Lane(NamedTuple):
+    name: str
+    queue: str
+    routing_key: str
+    prefetch_count: int
+
+
+def priority_queue_name(queue: str = rabbitmq_quee) -> str:
+    return f"{queue}.priority"
+
+
+def priority_routing_key(routing_key: str = rabbitmq_routing_key) -> str:
+    return f"{routing_key}.priority"
+
+
+PRIORITY_LANE = Lane("priority", priority_queue_name(), priority_routing_key(), priority_lane_prefetch_count)
+# The bulk lane is the original queue, so its arguments and backlog are untouched
+BULK_LANE = Lane("bulk", rabbitmq_quee, rabbitmq_routing_key, rabbitmq_prefetch_count)
+LANES = (PRIORITY_LANE, BULK_LANE)
+
+
+def is_priority(priority: int) -> bool:
+    return priority >= priority_lane_min_priority
+
+
+def event_priority(event: Optional[str]) -> int:
+    """AMQP priority (0-9) of a registered event; unknown events are bulk."""
+    email_event = get_email_event(event)
+    return 0 if email_event is None else email_event.priority
+
+
+def message_priority(message: bytes) -> int:
+    """Priority of a serialized message, read from its `event` field."""
+    try:
+        payload = decode_payload(message)
+    except ValueError:
+        return 0
+    return event_priority(payload.get("event")) if isinstance(payload, dict) else 0
+
+
+def lane_of(method) -> Lane:
+    """The lane a delivery came through, told apart by its routing key."""
+    return PRIORITY_LANE if getattr(method, "routing_key", None) == PRIORITY_LANE.routing_key else BULK_LANE
+
+
+def is_priority_delivery(method) -> bool:
+    return lane_of(method) is PRIORITY_LANE
+
+
+def published_at(properties) -> Optional[float]:
+    """The publish time a delivery carries, or None when it is missing or not a number."""
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        value = float(headers.get(PUBLISHED_AT_HEADER))
+    except (TypeError, ValueError):
+        # Absent, or set by a producer we do not control
+        return None
+    return value if math.isfinite(value) else None
+
+
+def record_delivery_latency(method, properties, event: str) -> None:
+    """Observe publish-to-send latency for deliveries that carry a publish time."""
+    published = published_at(properties)
+    if published is None:
+        return
+    DELIVERY_LATENCY.observe((lane_of(method).name, event), max(0.0, time.time() - published))
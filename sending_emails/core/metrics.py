@@ -0,0 +1,274 @@
+"""Low-overhead Prometheus-style metrics for the consumer and SMTP hot paths"""
+import math
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Event being processed by the current thread / asyncio task, used as the
+# default `event` label by code that does not know which event it serves
+# (SMTP pools, ack paths).
+current_event: ContextVar[str] = ContextVar("current_event", default="none")
+# Trace (a tracing.MessageTrace) of the delivery being processed, if any;
+# every recorded stage is added to it as a span
+current_trace: ContextVar[Optional[Any]] = ContextVar("current_trace", default=None)
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(labelnames, labels)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardOwner:
+    """Weak-referenceable stand-in for a thread's ownership of its shard."""
+
+    __slots__ = ("__weakref__",)
+
+
+class _ShardedMetric:
+    """
+    Base for metrics whose hot-path writes go to a per-thread dict.
+
+    Writers never take a lock: each thread only touches its own shard.
+    A scrape copies every shard (a single C-level dict copy under the GIL)
+    and merges them, so the cost of aggregation is paid by the reader.
+
+    When a thread ends, its shard is folded into a base shard and dropped,
+    so short-lived threads (asyncio.to_thread, per-connection workers) do
+    not grow the shard list forever.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._base: dict = {}
+        self._shards: List[dict] = [self._base]
+        # Reentrant: a shard may be retired by whatever thread runs its finalizer
+        self._shards_lock = threading.RLock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Dies with the thread's locals, and takes the shard to the base with it
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard: dict) -> None:
+        with self._shards_lock:
+            self._fold(shard)
+            self._shards = [live for live in self._shards if live is not shard]
+
+    def _fold(self, shard: dict) -> None:
+        """Add a retired shard's values to the base shard."""
+        raise NotImplementedError
+
+    def _snapshots(self, include_remote: bool = True) -> List[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        snapshots = [shard.copy() for shard in shards]
+        if include_remote:
+            for remote in list(_remote_snapshots.values()):
+                snapshots.append(remote.get(self.name, {}))
+        return snapshots
+
+    def reset(self) -> None:
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _fold(self, shard: dict) -> None:
+        for labels, value in list(shard.items()):
+            self._base[labels] = self._base.get(labels, 0) + value
+
+    def values(self, include_remote: bool = True) -> Dict[Tuple[str, ...], float]:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for snapshot in self._snapshots(include_remote):
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.values().items())
+        ]
+
+
+class Gauge(Counter):
+    """Value that goes up and down; per-thread deltas are summed on scrape."""
+
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple[str, ...] = (), value: float = 0) -> None:
+        """Set an absolute value (slow path: resets every shard's delta)."""
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.pop(labels, None)
+        self.inc(labels, value)
+
+
+class Histogram(_ShardedMetric):
+    """Latency histogram with fixed, cumulative-on-export buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # one slot per bucket, one for +Inf, then the running sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _fold(self, shard: dict) -> None:
+        for labels, counts in list(shard.items()):
+            base = self._base.setdefault(labels, [0] * len(counts))
+            for index, count in enumerate(counts):
+                base[index] += count
+
+    def values(self, include_remote: bool = True) -> Dict[Tuple[str, ...], List[float]]:
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for snapshot in self._snapshots(include_remote):
+            for labels, counts in snapshot.items():
+                merged = totals.setdefault(labels, [0] * len(counts))
+                for index, value in enumerate(list(counts)):
+                    merged[index] += value
+        return totals
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_ShardedMetric] = []
+
+# Latest snapshot from each consumer process (multiprocess mode), by source
+_remote_snapshots: Dict[str, Dict[str, dict]] = {}
+
+STAGE_SECONDS = Histogram(
+    "email_stage_duration_seconds",
+    "Time spent per pipeline stage (decode, decrypt, render, spool_append, smtp_throttle, smtp_connect, smtp_login, smtp_send, ack)",
+    ("stage", "event"),
+)
+MESSAGES_TOTAL = Counter(
+    "email_messages_total",
+    "Deliveries handled, by event and outcome (acked, spooled, duplicate, rejected, nacked, retried, dead_lettered)",
+    ("event", "outcome"),
+)
+MESSAGES_IN_FLIGHT = Gauge(
+    "email_messages_in_flight",
+    "Deliveries received but not yet acked, rejected or nacked",
+)
+CONSUMER_RECONNECTS = Counter(
+    "email_consumer_reconnects_total",
+    "Times the consumer lost its broker connection and reconnected",
+)
+
+
+def record_stage(stage: str, started: float, event: Optional[str] = None) -> None:
+    """Observe the time since `started` (a perf_counter value) for `stage`."""
+    ended = time.perf_counter()
+    STAGE_SECONDS.observe((stage, event or current_event.get()), ended - started)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, started, ended)
+
+
+@contextmanager
+def observe_stage(stage: str, event: Optional[str] = None) -> Iterator[None]:
+    """Time the enclosed block as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, started, event)
+
+
+def snapshot() -> Dict[str, dict]:
+    """This process's own metric values, picklable for shipping to another process."""
+    return {metric.name: metric.values(include_remote=False) for metric in REGISTRY}
+
+
+def set_remote_snapshot(source: str, values: Dict[str, dict]) -> None:
+    """Merge `values` (from `snapshot()` in another process) into every scrape."""
+    _remote_snapshots[source] = values
+
+
+def drop_remote_snapshot(source: str) -> None:
+    _remote_snapshots.pop(source, None)
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
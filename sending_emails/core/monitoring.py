@@ -0,0 +1,31 @@
+"""Operational endpoints served next to the consumer"""
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sending_emails.core.health import consumer_state
+from sending_emails.core.metrics import render_metrics
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics() -> PlainTextResponse:
+    """Prometheus scrape endpoint for the consumer and SMTP hot paths"""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def _probe_response(healthy: bool, report: dict) -> JSONResponse:
+    return JSONResponse(report, status_code=200 if healthy else 503)
+
+
+@router.get("/healthz")
+def healthz() -> JSONResponse:
+    """Liveness: fails when the consumer died or stopped settling the deliveries it holds"""
+    return _probe_response(*consumer_state.liveness())
+
+
+@router.get("/readyz")
+def readyz() -> JSONResponse:
+    """Readiness: additionally requires a broker connection, no stalled backlog and a healthy SMTP pool"""
+    return _probe_response(*consumer_state.readiness())
@@ -0,0 +1,150 @@
+"""
+Mode-independent steps of handling a delivery.
+
+Every consumer mode (inline, micro-batched, asyncio) decodes, de-duplicates,
+resolves, spools and settles deliveries through these functions; the modes
+only differ in how they send over SMTP and how they run the spool append.
+"""
+import time
+import logging
+from typing import Collection, List, NamedTuple, Optional, Tuple
+from sending_emails.core.health import consumer_state
+from sending_emails.core.idempotency import IdempotencyCache, delivery_key
+from sending_emails.core.lanes import published_at, record_delivery_latency
+from sending_emails.core.metrics import MESSAGES_TOTAL, current_event, observe_stage, record_stage
+from sending_emails.core.retry import retry_or_dead_letter, retry_policy_for
+from sending_emails.core.spool import SpooledEmail, get_spool
+from sending_emails.core.tracing import finish_trace
+from sending_emails.emails.events import EmailEvent
+from sending_emails.emails.helpers import OutgoingEmail
+from sending_emails.emails.payloads import decode_payload
+from sending_emails.emails.send_mails import InvalidEmailPayload, get_email_event, resolve_email
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+# What to do with a prepared delivery
+SEND = "send"
+DUPLICATE = "duplicate"
+REJECT = "reject"
+RETRY = "retry"
+
+
+class PreparedDelivery(NamedTuple):
+    action: str
+    event: str
+    key: Optional[str] = None
+    email_event: Optional[EmailEvent] = None
+    email: Optional[OutgoingEmail] = None
+    error: Optional[BaseException] = None
+
+
+def decode(body: bytes) -> Tuple[object, str]:
+    """Parse a delivery body, timing it under the event it turns out to carry"""
+    started = time.perf_counter()
+    user_payload = decode_payload(body)
+    event = user_payload.get("event") if isinstance(user_payload, dict) else None
+    event = event if isinstance(event, str) else "invalid"
+    record_stage("decode", started, event)
+    # Each thread / task runs in its own context, so this labels only this message
+    current_event.set(event)
+    return user_payload, event
+
+
+def prepare(
+    properties, body: bytes, idempotency_cache: IdempotencyCache, batch_keys: Collection[str] = ()
+) -> PreparedDelivery:
+    """
+    Decode, de-duplicate and render a delivery; never raises.
+
+    `batch_keys` are the deliveries already taken by the same micro-batch.
+    """
+    try:
+        user_payload, event = decode(body)
+    except ValueError as invalid_json:
+        return PreparedDelivery(REJECT, "invalid", error=InvalidEmailPayload(f"not valid JSON ({invalid_json})"))
+    key = delivery_key(properties, body)
+    if key in batch_keys or idempotency_cache.seen(key):
+        return PreparedDelivery(DUPLICATE, event, key)
+    try:
+        email_event, email = resolve_email(user_payload)
+    except InvalidEmailPayload as invalid_payload:
+        # Unknown events and bad payloads can never succeed
+        return PreparedDelivery(REJECT, event, key, error=invalid_payload)
+    except Exception as build_error:
+        # e.g. a broken template or an unreadable key: retry, then dead-letter
+        return PreparedDelivery(RETRY, event, key, get_email_event(event), error=build_error)
+    return PreparedDelivery(SEND, event, key, email_event, email)
+
+
+def settle(settle_call, outcome: str, event: str, **kwargs) -> None:
+    """Ack, nack or reject a delivery, counting the outcome and timing the call"""
+    with observe_stage("ack", event):
+        settle_call(**kwargs)
+    MESSAGES_TOTAL.inc((event, outcome))
+    consumer_state.mark_settled(outcome in ("acked", "spooled"))
+    finish_trace(event, outcome)
+
+
+def retry_later(channel, method, properties, body: bytes, email_event, error: BaseException, event: str) -> None:
+    """Move a failed delivery to its retry tier (or the DLQ) instead of requeueing it"""
+    with observe_stage("ack", event):
+        outcome = retry_or_dead_letter(channel, method, properties, body, retry_policy_for(email_event), error)
+    MESSAGES_TOTAL.inc((event, outcome))
+    consumer_state.mark_settled(False)
+    finish_trace(event, outcome)
+
+
+def settle_unsendable(channel, method, properties, body: bytes, prepared: PreparedDelivery) -> bool:
+    """Settle a delivery that `prepare` did not clear for sending; True when it counts as handled."""
+    if prepared.action == DUPLICATE:
+        # Sent before the ack got lost: settle the redelivery without SMTP
+        logger.info("Skipping duplicate delivery %s", prepared.key)
+        settle(channel.basic_ack, "duplicate", prepared.event, delivery_tag=method.delivery_tag)
+        return True
+    if prepared.action == REJECT:
+        # Dropped (dead-lettered if the queue has a DLX) instead of left unacked
+        logger.info("Rejected message %s: %s", method.delivery_tag, prepared.error)
+        settle(channel.basic_reject, "rejected", prepared.event, delivery_tag=method.delivery_tag, requeue=False)
+        return False
+    logger.error("Failed to build %s email: %s", prepared.event, prepared.error)
+    retry_later(channel, method, properties, body, prepared.email_event, prepared.error, prepared.event)
+    return False
+
+
+def spool_emails(entries: List[SpooledEmail], idempotency_cache: IdempotencyCache) -> bool:
+    """Commit rendered emails to the local spool; False (send directly) when there is none or it failed"""
+    spool = get_spool()
+    if spool is None:
+        return False
+    try:
+        spool.append(entries)
+    except Exception as spool_error:
+        logger.error("Could not spool %s emails, sending directly: %s", len(entries), spool_error)
+        return False
+    for entry in entries:
+        idempotency_cache.remember(entry.key)
+    return True
+
+
+def spooled_entry(properties, prepared: PreparedDelivery) -> SpooledEmail:
+    """The spool row of a rendered delivery, expiring with the secrets it carries."""
+    expires_at = None
+    if prepared.email_event.secret_ttl:
+        expires_at = (published_at(properties) or time.time()) + prepared.email_event.secret_ttl
+    return SpooledEmail(prepared.key, prepared.event, prepared.email, expires_at)
+
+
+def settle_sent(
+    channel, method, properties, prepared: PreparedDelivery, idempotency_cache: IdempotencyCache
+) -> bool:
+    """Remember and ack a delivery whose email the relay accepted"""
+    idempotency_cache.remember(prepared.key)
+    record_delivery_latency(method, properties, prepared.event)
+    settle(channel.basic_ack, "acked", prepared.event, delivery_tag=method.delivery_tag)
+    return True
+
+
+def settle_failed_send(channel, method, properties, body: bytes, prepared: PreparedDelivery, error: BaseException) -> bool:
+    logger.error("Failed to send %s email: %s", prepared.event, error)
+    retry_later(channel, method, properties, body, prepared.email_event, error, prepared.event)
+    return False
@@ -0,0 +1,163 @@
+"""Startup prewarming: a consumer is at full speed before it takes its first message"""
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from sending_emails.core.config import (
+    consumer_mode,
+    consumer_workers,
+    consumer_batch_size,
+    rabbitmq_prefetch_count,
+    retry_delays,
+)
+from sending_emails.core.health import consumer_state
+from sending_emails.core.metrics import Gauge
+from sending_emails.emails.config import EMAIL_HOST, EMAIL_HOST_USER, EMAIL_PORT, SMTP_POOL_PREWARM
+from sending_emails.emails.encryption_utils import decrypt_data, encrypt_data
+from sending_emails.emails.events import email_events
+from sending_emails.emails.mime import get_skeleton
+# Importing send_mails registers the events whose templates we compile
+from sending_emails.emails import send_mails  # noqa: F401
+from sending_emails.emails.template_engine import get_template
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+STARTUP_SECONDS = Gauge(
+    "email_startup_seconds",
+    "Seconds each startup step took at the last start; `total` runs from start to consuming",
+    ("step",),
+)
+CONSUMER_MODES = ("threaded", "asyncio", "multiprocess")
+
+
+class PrewarmError(RuntimeError):
+    """A setting, key or template that would fail every message: refuse to start."""
+
+
+class StartupReport:
+    """
+    How long each startup step took, measured from `started`.
+
+    Fatal steps raise `PrewarmError`; the others (reaching the SMTP relay)
+    are logged and recorded as problems, since the consumer recovers from
+    them on its own once the relay is back.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.steps: Dict[str, float] = {}
+        self.problems: List[str] = []
+        self.total: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.total is not None
+
+    @contextmanager
+    def step(self, name: str, fatal: bool = True) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except PrewarmError:
+            raise
+        except Exception as exc:
+            if fatal:
+                raise PrewarmError(f"{name}: {exc}") from exc
+            logger.warning("Startup step %s failed: %s", name, exc)
+            self.problems.append(f"{name}: {exc}")
+        finally:
+            self.steps[name] = self.steps.get(name, 0.0) + time.perf_counter() - started
+            STARTUP_SECONDS.set(labels=(name,), value=self.steps[name])
+
+    def finish(self) -> dict:
+        """Close the report once consuming starts; logs it and marks the consumer prewarmed."""
+        self.total = time.perf_counter() - self.started
+        STARTUP_SECONDS.set(labels=("total",), value=self.total)
+        logger.info(
+            "Started in %.2fs (%s)%s",
+            self.total,
+            ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.steps.items()),
+            f"; problems: {'; '.join(self.problems)}" if self.problems else "",
+        )
+        summary = self.summary()
+        consumer_state.mark_prewarmed(summary)
+        return summary
+
+    def summary(self) -> dict:
+        return {
+            "total_seconds": None if self.total is None else round(self.total, 3),
+            "steps": {name: round(seconds, 3) for name, seconds in self.steps.items()},
+            "problems": list(self.problems),
+        }
+
+
+def begin_startup() -> StartupReport:
+    """Start timing a consumer's startup; readiness fails until its report is finished."""
+    consumer_state.mark_prewarming()
+    return StartupReport()
+
+
+def check_config() -> None:
+    problems = []
+    if consumer_mode not in CONSUMER_MODES:
+        problems.append(f"CONSUMER_MODE must be one of {', '.join(CONSUMER_MODES)}, not {consumer_mode!r}")
+    if not EMAIL_HOST or not EMAIL_HOST_USER:
+        problems.append("EMAIL_HOST and EMAIL_HOST_USER must be set")
+    try:
+        int(EMAIL_PORT)
+    except (TypeError, ValueError):
+        problems.append(f"EMAIL_PORT must be a number, not {EMAIL_PORT!r}")
+    for name, value in (
+        ("CONSUMER_WORKERS", consumer_workers),
+        ("CONSUMER_BATCH_SIZE", consumer_batch_size),
+        ("RABBITMQ_PREFETCH_COUNT", rabbitmq_prefetch_count),
+    ):
+        if value < 1:
+            problems.append(f"{name} must be at least 1")
+    if any(delay <= 0 for delay in retry_delays):
+        problems.append("RETRY_DELAYS must be positive")
+    if problems:
+        raise PrewarmError("invalid settings: " + "; ".join(problems))
+
+
+def check_fernet_key() -> None:
+    """Round-trip a token, so a wrong OTP_FERNET_KEY fails the start and not every OTP."""
+    if decrypt_data(encrypt_data("prewarm")) != "prewarm":
+        raise PrewarmError("OTP_FERNET_KEY does not decrypt its own tokens")
+
+
+def compile_templates() -> int:
+    """Load and compile every event's HTML and plain-text template, and the MIME skeleton."""
+    for event in email_events:
+        get_template(event.template_path).text
+    get_skeleton(EMAIL_HOST_USER)
+    return len(email_events.names())
+
+
+def check_startup(report: StartupReport) -> None:
+    """Fatal, local checks run before any consumer starts; raises `PrewarmError`."""
+    with report.step("config"):
+        check_config()
+    with report.step("fernet_key"):
+        check_fernet_key()
+    with report.step("templates"):
+        compile_templates()
+
+
+def prewarm_consumer(report: StartupReport, smtp_pool, connections: int = SMTP_POOL_PREWARM) -> dict:
+    """Last steps before `basic_consume`: compiled templates and open SMTP sessions."""
+    with report.step("templates"):
+        compile_templates()
+    with report.step("smtp", fatal=False):
+        smtp_pool.prewarm(connections)
+    return report.finish()
+
+
+async def prewarm_async_consumer(report: StartupReport, smtp_pool, connections: int = SMTP_POOL_PREWARM) -> dict:
+    """`prewarm_consumer` for the asyncio consumer: templates off the loop, async SMTP sessions."""
+    with report.step("templates"):
+        await asyncio.to_thread(compile_templates)
+    with report.step("smtp", fatal=False):
+        await smtp_pool.prewarm(connections)
+    return report.finish()
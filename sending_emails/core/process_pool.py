@@ -0,0 +1,254 @@
+"""Multiprocess consumer mode: one supervised consumer process per core"""
+import os
+import sys
+import queue
+import signal
+import logging
+import threading
+import multiprocessing
+import time
+from typing import Callable, Dict, Optional
+from sending_emails.core.config import consumer_drain_timeout, consumer_report_interval
+from sending_emails.core.health import consumer_state
+from sending_emails.core.metrics import Counter, drop_remote_snapshot, set_remote_snapshot, snapshot
+from sending_emails.core.prewarm import begin_startup
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.core.reconnect import ExponentialBackoff
+from sending_emails.emails.smtp_pool import get_smtp_pool
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+CONSUMER_PROCESS_RESTARTS = Counter(
+    "email_consumer_process_restarts_total",
+    "Consumer processes restarted after exiting unexpectedly",
+)
+
+
+def _configure_logging() -> None:
+    process_logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+    if not process_logger.handlers:
+        process_logger.setLevel(logging.INFO)
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s  | %(levelname)s | %(processName)s | %(filename)s | %(message)s"
+        ))
+        process_logger.addHandler(handler)
+
+
+def _send_report(reports, index: int) -> None:
+    try:
+        reports.put_nowait((index, os.getpid(), snapshot(), consumer_state.report()))
+    except queue.Full:
+        # The parent is behind; the next report carries the same totals
+        pass
+
+
+def run_consumer_process(
+    index: int,
+    reports,
+    report_interval: float,
+    drain_timeout: float,
+    consumer_factory: Callable[[], object],
+) -> None:
+    """
+    Body of one consumer process.
+
+    The consumer (anything with `run(loop_behavior)` and `stop()`) runs on
+    a thread with its own broker connection and SMTP pool, while the main
+    thread ships metrics and health to the parent every `report_interval`
+    seconds and turns SIGTERM into a graceful `stop()`.
+    """
+    _configure_logging()
+    # Ctrl-C reaches the whole process group: let the parent decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    consumer = consumer_factory()
+    runner = threading.Thread(
+        target=consumer.run, args=("infinite_running",), name="email-consumer", daemon=True
+    )
+    consumer_state.watch(runner.is_alive, get_smtp_pool())
+    runner.start()
+    while runner.is_alive() and not stopping.wait(report_interval):
+        _send_report(reports, index)
+
+    if stopping.is_set():
+        logger.info("Consumer process %s draining", index)
+        consumer.stop()
+        runner.join(drain_timeout)
+    _send_report(reports, index)
+    if runner.is_alive():
+        logger.warning("Consumer process %s did not drain within %ss", index, drain_timeout)
+        sys.exit(1)
+    # A consumer that returns without being asked to is a crash: get restarted
+    sys.exit(0 if stopping.is_set() else 1)
+
+
+def prewarmed_consumer() -> RabbitMQConsumerSupervisor:
+    """Default consumer of a process, prewarmed before its first message."""
+    return RabbitMQConsumerSupervisor(startup=begin_startup())
+
+
+class _ProcessSlot:
+    def __init__(self, index: int, backoff: ExponentialBackoff):
+        self.index = index
+        self.name = f"consumer-{index}"
+        self.backoff = backoff
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at: Optional[float] = None
+
+
+class ConsumerProcessPool:
+    """
+    Run `processes` consumer processes and keep them running.
+
+    Each process has its own broker connection, SMTP pool and GIL. A
+    monitor thread in the FastAPI process restarts processes that exit
+    (with per-slot backoff, so a crash loop does not spin), and collects
+    their periodic metric snapshots and health reports so `/metrics`,
+    `/healthz` and `/readyz` cover every process. `stop()` sends SIGTERM
+    and gives each process `drain_timeout` seconds to finish in-flight
+    messages before killing it.
+    """
+
+    def __init__(
+        self,
+        processes: Optional[int] = None,
+        consumer_factory: Callable[[], object] = prewarmed_consumer,
+        report_interval: float = consumer_report_interval,
+        drain_timeout: float = consumer_drain_timeout,
+        backoff_factory: Callable[[], ExponentialBackoff] = lambda: ExponentialBackoff(base=1, cap=30),
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        self.consumer_factory = consumer_factory
+        self.report_interval = report_interval
+        self.drain_timeout = drain_timeout
+        # spawn, not fork: the FastAPI process already runs threads and an event loop
+        self._context = multiprocessing.get_context("spawn")
+        self._reports_queue = self._context.Queue(maxsize=self.processes * 16)
+        self._slots = [_ProcessSlot(index, backoff_factory()) for index in range(self.processes)]
+        self._reports: Dict[str, dict] = {}
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self.restarts = 0
+
+    def start(self) -> None:
+        for slot in self._slots:
+            self._spawn(slot)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="email-consumer-monitor", daemon=True)
+        self._monitor.start()
+        logger.info("Started %s consumer processes", self.processes)
+
+    def _spawn(self, slot: _ProcessSlot) -> None:
+        slot.process = self._context.Process(
+            target=run_consumer_process,
+            args=(slot.index, self._reports_queue, self.report_interval, self.drain_timeout, self.consumer_factory),
+            name=f"email-{slot.name}",
+            daemon=True,
+        )
+        slot.process.start()
+        slot.started_at = time.time()
+        slot.restart_at = None
+        self._reports.pop(slot.name, None)
+
+    def _monitor_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._drain_reports(timeout=min(self.report_interval, 0.5))
+            if not self._stopping.is_set():
+                self._restart_exited()
+
+    def _drain_reports(self, timeout: float = 0) -> None:
+        try:
+            item = self._reports_queue.get(timeout=timeout) if timeout else self._reports_queue.get_nowait()
+        except (queue.Empty, OSError, ValueError):
+            return
+        while True:
+            index, pid, values, report = item
+            slot = self._slots[index]
+            if slot.process is not None and slot.process.pid == pid:
+                set_remote_snapshot(slot.name, values)
+                self._reports[slot.name] = dict(report, pid=pid)
+                if report["connected"]:
+                    slot.backoff.reset()
+            try:
+                item = self._reports_queue.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                return
+
+    def _restart_exited(self) -> None:
+        now = time.monotonic()
+        for slot in self._slots:
+            if slot.process is None or slot.process.is_alive():
+                continue
+            if slot.restart_at is None:
+                delay = slot.backoff.next_delay()
+                logger.warning(
+                    "Consumer process %s exited with code %s, restarting in %.2fs",
+                    slot.index, slot.process.exitcode, delay,
+                )
+                slot.restart_at = now + delay
+            elif now >= slot.restart_at:
+                self.restarts += 1
+                CONSUMER_PROCESS_RESTARTS.inc()
+                self._spawn(slot)
+
+    def is_running(self) -> bool:
+        """True while the monitor runs and at least one consumer process is alive."""
+        return (
+            self._monitor is not None
+            and self._monitor.is_alive()
+            and any(slot.process is not None and slot.process.is_alive() for slot in self._slots)
+        )
+
+    def reports(self) -> Dict[str, dict]:
+        """Latest health report of every live process (placeholders until the first one arrives)."""
+        reports = {}
+        for slot in self._slots:
+            if slot.process is None or not slot.process.is_alive():
+                continue
+            reports[slot.name] = self._reports.get(slot.name) or {
+                "connected": False,
+                "since": slot.started_at,
+                "last_error": None,
+                "last_ack_at": None,
+                "last_settled_at": None,
+                "in_flight": 0,
+                "smtp": None,
+                "pid": slot.process.pid,
+            }
+        return reports
+
+    def stop(self) -> bool:
+        """
+        SIGTERM every process, wait up to `drain_timeout` for them to drain,
+        kill the rest; returns whether all of them drained in time.
+        """
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        processes = [slot.process for slot in self._slots if slot.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        while any(process.is_alive() for process in processes) and time.monotonic() < deadline:
+            # Keep reading: a process cannot exit while its last report is stuck in the pipe
+            self._drain_reports(timeout=0.05)
+        drained = True
+        for process in processes:
+            if process.is_alive():
+                logger.warning("Consumer process %s did not drain in time, killing it", process.pid)
+                process.kill()
+                process.join()
+                drained = False
+            elif process.exitcode:
+                # The process gave up on its own deadline
+                drained = False
+        self._drain_reports()
+        for slot in self._slots:
+            drop_remote_snapshot(slot.name)
+        self._reports_queue.close()
+        logger.info("Stopped %s consumer processes", len(processes))
+        return drained
@@ -1,23 +1,36 @@
-import json
 import time
 import logging
+import threading
+from typing import Callable, List, Optional
 import pika
 from sending_emails.core.config import (
-    rabbitmq_username,
-    rabbitmq_password,
-    rabbitmq_host,
-    rabbitmq_port,
-    rabbitmq_quee,
     rabbitmq_exchange,
-    rabbitmq_routing_key,
+    consumer_workers,
+    consumer_batch_size,
+    consumer_batch_wait_ms,
 )
-from sending_emails.emails.send_mails import (
-    send_otp_email,
-    send_technician_credentials_create_by_hospital_admin_email,
-    send_doctor_reviewer_credentials_create_by_hospital_admin_email,
-    send_doctor_admin_credentials_create_by_hospital_admin_email,
-    notify_user_credentials_updated_by_hospital_admin_email,
+from sending_emails.core.batching import Delivery, MicroBatcher
+from sending_emails.core.health import consumer_state
+from sending_emails.core.prewarm import StartupReport, prewarm_consumer
+from sending_emails.core.metrics import CONSUMER_RECONNECTS, MESSAGES_IN_FLIGHT, current_event
+from sending_emails.core.reconnect import ExponentialBackoff, consumer_connection_parameters
+from sending_emails.core.worker_pool import ConcurrentDispatcher
+from sending_emails.core.idempotency import get_idempotency_cache
+from sending_emails.core.lanes import LANES, is_priority_delivery
+from sending_emails.core.pipeline import (
+    SEND,
+    prepare,
+    settle,
+    settle_failed_send,
+    settle_sent,
+    settle_unsendable,
+    spool_emails,
+    spooled_entry,
 )
+from sending_emails.core.retry import declare_retry_topology
+from sending_emails.core.tracing import MessageTrace, active_trace, traced
+from sending_emails.emails.helpers import deliver_email, deliver_emails
+from sending_emails.emails.smtp_pool import get_smtp_pool
 
 
 
@@ -26,100 +39,279 @@ SUCCESS = True
 FAILURE = False
 
 
-def continous_consuming_rabitmq_messages(loop_behavior:str)->None:
-    """Consume messages from a RabbitMQ queue and process them based on the user's role"""
-    sleep_time = 10
-    try:
-        credentials = pika.PlainCredentials(rabbitmq_username, rabbitmq_password)
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(
-                rabbitmq_host, rabbitmq_port, "/", credentials
+class RabbitMQConsumerSupervisor:
+    """
+    Keep the blocking consumer connected, one connection at a time.
+
+    Every lost connection is retried in a loop (never by recursion) after a
+    full-jitter exponential backoff that resets as soon as consuming resumes.
+    The exchange, the lane queues and their bindings are declared on the
+    first connection only; reconnects go straight to `basic_consume` and
+    declare again only if the broker lost a queue (404) across a restart.
+
+    With a `startup` report, the first connection also prewarms the
+    consumer (templates, SMTP sessions) between declaring the topology and
+    `basic_consume`, and finishes the report once consuming can start.
+    """
+
+    def __init__(
+        self,
+        backoff: Optional[ExponentialBackoff] = None,
+        connect: Optional[Callable[[], pika.BlockingConnection]] = None,
+        startup: Optional[StartupReport] = None,
+    ):
+        self.backoff = backoff or ExponentialBackoff()
+        self.connect = connect or (lambda: pika.BlockingConnection(consumer_connection_parameters()))
+        self.startup = startup
+        self.topology_declared = False
+        self._stopping = threading.Event()
+        self._connection = None
+        self._channel = None
+
+    def run(self, loop_behavior: str) -> None:
+        """Consume until `stop()`; `loop_behavior == "1"` makes a single attempt."""
+        while not self._stopping.is_set():
+            try:
+                self.consume_once()
+                consumer_state.mark_disconnected()
+            except pika.exceptions.AMQPConnectionError as rabitmq_exception:
+                logger.info("Connection error: %s", rabitmq_exception)
+                consumer_state.mark_disconnected(rabitmq_exception)
+            except Exception as swr:
+                logger.info("An error occurred: %s", swr)
+                consumer_state.mark_disconnected(swr)
+            if loop_behavior == "1" or self._stopping.is_set():
+                return
+            CONSUMER_RECONNECTS.inc()
+            delay = self.backoff.next_delay()
+            logger.info("Reconnecting to RabbitMQ in %.2f seconds...", delay)
+            self._stopping.wait(delay)
+
+    def stop(self) -> None:
+        """
+        Make `run` return; safe to call from any thread.
+
+        Consuming is cancelled on the connection thread, messages already
+        being sent finish and are acked, then the connection is closed.
+        Deliveries that were prefetched but not started are redelivered.
+        """
+        self._stopping.set()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.add_callback_threadsafe(self._stop_consuming)
+            except Exception:
+                # Already closed: `run` is on its way out
+                pass
+
+    def _stop_consuming(self) -> None:
+        if self._channel is not None:
+            self._channel.stop_consuming()
+
+    def consume_once(self) -> None:
+        """Open a connection and consume on it until it closes."""
+        connection = self._connection = self.connect()
+        dispatcher = None
+        try:
+            on_message_callback = rabitmq_consumer_callback
+            if consumer_batch_size > 1:
+                dispatcher = MicroBatcher(
+                    connection,
+                    rabitmq_consumer_batch_callback,
+                    batch_size=consumer_batch_size,
+                    max_wait=consumer_batch_wait_ms / 1000,
+                    workers=consumer_workers,
+                    urgent=is_priority_delivery,
+                )
+                on_message_callback = dispatcher.add
+            elif consumer_workers > 1:
+                dispatcher = ConcurrentDispatcher(
+                    connection,
+                    rabitmq_consumer_callback,
+                    consumer_workers,
+                    rank=lambda method: 0 if is_priority_delivery(method) else 1,
+                )
+                on_message_callback = dispatcher.dispatch
+            channel = self._channel = self._subscribe(connection, on_message_callback)
+            logger.info(
+                "AI Call Assistant Email Sending Consumer Service RabbitMQ Connection Channel: %s",
+                ", ".join(lane.queue for lane in LANES),
             )
-        )
-        channel = connection.channel()
+            logger.info(
+                "Consuming with prefetch %s, %s sender worker(s), batches of %s",
+                ", ".join(f"{lane.name} {lane.prefetch_count}" for lane in LANES),
+                consumer_workers,
+                consumer_batch_size,
+            )
+            consumer_state.mark_connected()
+            self.backoff.reset()
+            if not self._stopping.is_set():
+                channel.start_consuming()
+        finally:
+            self._channel = None
+            if dispatcher is not None:
+                dispatcher.shutdown()
+                if connection.is_open:
+                    # Deliver the acks the workers queued while finishing up
+                    try:
+                        connection.process_data_events(time_limit=0)
+                    except Exception:
+                        pass
+            self._connection = None
+            if connection.is_open:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def _declare_topology(self, channel) -> None:
         channel.exchange_declare(
             exchange=rabbitmq_exchange, exchange_type="direct"
         )
-        channel.queue_declare(queue=rabbitmq_quee)
-        channel.queue_bind(
-            exchange=rabbitmq_exchange,
-            queue=rabbitmq_quee,
-            routing_key=rabbitmq_routing_key,
-        )
-        logger.info("AI Call Assistant Email Sending Consumer Service RabbitMQ Connection Channel: %s", rabbitmq_quee)
-        channel.basic_consume(
-            queue=rabbitmq_quee,
-            on_message_callback=rabitmq_consumer_callback,
-            auto_ack=False,
-        )
-        channel.start_consuming()
+        for lane in LANES:
+            channel.queue_declare(queue=lane.queue)
+            channel.queue_bind(
+                exchange=rabbitmq_exchange,
+                queue=lane.queue,
+                routing_key=lane.routing_key,
+            )
+        declare_retry_topology(channel)
+        self.topology_declared = True
 
-    except pika.exceptions.AMQPConnectionError as rabitmq_exception:
-        logger.info("Connection error. Retrying in 5 seconds...")
-        time.sleep(sleep_time)
-        if loop_behavior != "1":
-            continous_consuming_rabitmq_messages(loop_behavior)
-    except Exception as swr:
-        logger.info("An error occurred: %s", swr)
-        time.sleep(sleep_time)
-        if loop_behavior != "1":
-            continous_consuming_rabitmq_messages(loop_behavior)
+    def _consume_lanes(self, channel, on_message_callback) -> None:
+        for lane in LANES:
+            # basic_qos applies per consumer started after it: every lane gets
+            # its own window. A batch can only fill if the broker lets us hold
+            # that many unacked.
+            channel.basic_qos(prefetch_count=max(lane.prefetch_count, consumer_batch_size))
+            channel.basic_consume(
+                queue=lane.queue, on_message_callback=on_message_callback, auto_ack=False
+            )
+
+    def _subscribe(self, connection, on_message_callback):
+        channel = connection.channel()
+        if self.topology_declared:
+            try:
+                self._prewarm()
+                self._consume_lanes(channel, on_message_callback)
+                return channel
+            except pika.exceptions.ChannelClosedByBroker as closed:
+                if closed.reply_code != 404:
+                    raise
+                logger.info("Email queues are gone after a broker restart, declaring them again")
+                channel = connection.channel()
+        if self.startup is not None and not self.startup.finished:
+            with self.startup.step("topology"):
+                self._declare_topology(channel)
+        else:
+            self._declare_topology(channel)
+        self._prewarm()
+        self._consume_lanes(channel, on_message_callback)
+        return channel
+
+    def _prewarm(self) -> None:
+        """Warm templates and SMTP sessions before the first `basic_consume`, once."""
+        if self.startup is not None and not self.startup.finished:
+            prewarm_consumer(self.startup, get_smtp_pool())
+
+
+
+def continous_consuming_rabitmq_messages(loop_behavior:str)->None:
+    """Consume messages from a RabbitMQ queue, reconnecting with backoff when the connection drops"""
+    RabbitMQConsumerSupervisor().run(loop_behavior)
 
 
 
 def rabitmq_consumer_callback(ch, method, properties, body)->bool:
-    # ch.basic_ack(delivery_tag=method.delivery_tag)
+    """Look the event up in the email event registry, send it and ack the delivery"""
+    MESSAGES_IN_FLIGHT.inc()
+    try:
+        with traced(method, properties):
+            return _process_message(ch, method, properties, body)
+    finally:
+        MESSAGES_IN_FLIGHT.dec()
+
+
 
+def _process_message(ch, method, properties, body) -> bool:
+    idempotency_cache = get_idempotency_cache()
+    prepared = prepare(properties, body, idempotency_cache)
+    if prepared.action != SEND:
+        return settle_unsendable(ch, method, properties, body, prepared)
 
-    message = body.decode()
-    user_payload = json.loads(message)
-    print("user_payload=====>",user_payload)
-    logging.info("********* user_payload ------ >>>>  %s",user_payload)
+    if spool_emails([spooled_entry(properties, prepared)], idempotency_cache):
+        # On disk now: ack at once and let the spool senders deal with SMTP
+        settle(ch.basic_ack, "spooled", prepared.event, delivery_tag=method.delivery_tag)
+        return SUCCESS
+
+    try:
+        deliver_email(*prepared.email)
+    except Exception as send_error:
+        return settle_failed_send(ch, method, properties, body, prepared, send_error)
+    logger.info("Processed %s message %s", prepared.event, method.delivery_tag)
+    return settle_sent(ch, method, properties, prepared, idempotency_cache)
 
-    event = user_payload.get("event")
 
-    # for otp sending email
-    if event == "user_otp_request":
-        data = user_payload.get("data")
-        print("data is :::::::::::: \n ", data)
-        send_otp_email(data=data)
 
-    if event == "technician_create_by_hospital_admin":
-        data = user_payload.get("data")
-        print("data is :::::::::::: \n ", data)
-        send_technician_credentials_create_by_hospital_admin_email(data=data)    
+def rabitmq_consumer_batch_callback(ch, deliveries: List[Delivery]) -> List[bool]:
+    """Send a micro-batch in one SMTP session and ack each delivery on its own result"""
+    MESSAGES_IN_FLIGHT.inc(amount=len(deliveries))
+    try:
+        return _process_batch(ch, deliveries)
+    finally:
+        MESSAGES_IN_FLIGHT.dec(amount=len(deliveries))
 
-    if event == "doctor_reviewer_create_by_hospital_admin":
-        data = user_payload.get("data")
-        print("data is :::::::::::: \n ", data)
-        send_doctor_reviewer_credentials_create_by_hospital_admin_email(data=data)   
 
-    if event == "doctor_admin_create_by_hospital_admin":
-        data = user_payload.get("data")
-        print("data is :::::::::::: \n ", data)
-        send_doctor_admin_credentials_create_by_hospital_admin_email(data=data)   
 
-    if event == "user_credentials_updated_by_hospital_admin":
-        data = user_payload.get("data")
-        print("data is :::::::::::: \n ", data)
-        notify_user_credentials_updated_by_hospital_admin_email(data=data)   
+def _process_batch(ch, deliveries: List[Delivery]) -> List[bool]:
+    idempotency_cache = get_idempotency_cache()
+    accepted = []
+    results = []
+    traces = []
+    batch_keys = set()
+    for delivery in deliveries:
+        traces.append(MessageTrace(delivery.method, delivery.properties))
+        with active_trace(traces[-1]):
+            prepared = prepare(delivery.properties, delivery.body, idempotency_cache, batch_keys)
+            if prepared.action != SEND:
+                results.append(
+                    settle_unsendable(ch, delivery.method, delivery.properties, delivery.body, prepared)
+                )
+                continue
+        batch_keys.add(prepared.key)
+        accepted.append((len(results), delivery, prepared))
+        results.append(None)
 
+    entries = [spooled_entry(delivery.properties, prepared) for _, delivery, prepared in accepted]
+    if entries and spool_emails(entries, idempotency_cache):
+        for index, delivery, prepared in accepted:
+            with active_trace(traces[index]):
+                settle(ch.basic_ack, "spooled", prepared.event, delivery_tag=delivery.method.delivery_tag)
+            results[index] = SUCCESS
+        logger.info("Spooled batch of %s messages", len(accepted))
+        return results
 
-    else:
-        logger.info("Received invalid event: %s", event)
-        return FAILURE
+    # SMTP stages of a mixed batch are not attributable to a single event
+    events = {prepared.event for _, _, prepared in accepted}
+    current_event.set(events.pop() if len(events) == 1 else "mixed")
+    started = time.perf_counter()
+    errors = deliver_emails([prepared.email for _, _, prepared in accepted]) if accepted else []
+    sent = time.perf_counter()
+    for (index, delivery, prepared), error in zip(accepted, errors):
+        with active_trace(traces[index]):
+            # Every trace of the batch spans the whole shared SMTP session
+            traces[index].add_stage("smtp_batch", started, sent)
+            if error is None:
+                results[index] = settle_sent(ch, delivery.method, delivery.properties, prepared, idempotency_cache)
+            else:
+                results[index] = settle_failed_send(
+                    ch, delivery.method, delivery.properties, delivery.body, prepared, error
+                )
+    logger.info("Processed batch of %s messages, %s sent", len(deliveries), errors.count(None))
+    return results
 
-    logger.info("Processed message: %s", message)
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-    return SUCCESS
-    
 
 
 def consume_messages(loop_behavior:str="infinite_running")->None:
     """Continously run rabitmq consumer"""
-    while True:
-        if loop_behavior != "1":
-            continous_consuming_rabitmq_messages(loop_behavior)
-        else:
-            continous_consuming_rabitmq_messages(loop_behavior)
-            break
\ No newline at end of file
+    continous_consuming_rabitmq_messages(loop_behavior)
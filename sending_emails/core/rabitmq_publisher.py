@@ -2,10 +2,29 @@
 
 import logging
 import socket
+import threading
 import time
+import uuid
 from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
 from .constant import RetryConstants
 import pika
+from sending_emails.core.lanes import (
+    PUBLISHED_AT_HEADER,
+    is_priority,
+    message_priority,
+    priority_queue_name,
+    priority_routing_key,
+)
+from sending_emails.core.tracing import (
+    SPAN_KIND_PRODUCER,
+    STATUS_ERROR,
+    STATUS_OK,
+    TRACEPARENT_HEADER,
+    Span,
+    export_spans,
+    new_traceparent,
+)
 from sending_emails.core.config import (
     rabbitmq_username,
     rabbitmq_password,
@@ -14,10 +33,29 @@ from sending_emails.core.config import (
     rabbitmq_quee,
     rabbitmq_exchange,
     rabbitmq_routing_key,
+    rabbitmq_publisher_connect_timeout,
 )
 
 logger = logging.getLogger("collubi_email_service_logger")
 
+def select_async_confirms(channel, on_confirmation, on_selected) -> None:
+    """
+    Put a BlockingChannel in publisher-confirm mode with acks delivered to
+    `on_confirmation` instead of awaited by each `basic_publish`.
+
+    The public BlockingChannel.confirm_delivery() makes every publish wait
+    for its own Basic.Ack, one round trip per message. This goes through
+    the wrapped pika.channel.Channel (`BlockingChannel._impl`, whose
+    `confirm_delivery(ack_nack_callback, callback)` is public), which is
+    private to pika: written against pika 1.3.2 and pinned by
+    tests/test_rabitmq_publisher.py, re-check it when upgrading pika.
+    """
+    impl = getattr(channel, "_impl", None)
+    if impl is None:
+        raise TypeError(f"{type(channel).__name__} does not wrap a pika channel; pika internals changed")
+    impl.confirm_delivery(ack_nack_callback=on_confirmation, callback=on_selected)
+
+
 class MessageQueueClient(ABC):
     """
     Abstract base class for message queue clients.
@@ -39,7 +77,7 @@ class MessageQueueClient(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def publish_message(self, message: bytes, ttl: int):
+    def publish_message(self, message: bytes, ttl: int, priority: Optional[int] = None):
         """
         Publish a message to the message queue.
 
@@ -49,10 +87,33 @@ class MessageQueueClient(ABC):
         Args:
             message (str): The message to be published.
             ttl (int): Time-to-live for the message in milliseconds.
+            priority (int): Priority 0-9, which picks the lane; None to derive it from the message's event.
         raise NotImplementedError
 
         """
 
+    @abstractmethod
+    def publish_many(
+        self,
+        messages: Sequence[bytes],
+        ttl: int,
+        priorities: Optional[Sequence[int]] = None,
+        message_ids: Optional[Sequence[str]] = None,
+    ) -> List[bool]:
+        """
+        Publish several messages in one batch.
+
+        This method should be implemented by subclasses to publish all
+        messages and report, per message, whether the broker accepted it.
+
+        Args:
+            messages (Sequence[bytes]): The messages to be published.
+            ttl (int): Time-to-live for each message in seconds.
+            priorities (Sequence[int]): Per-message priority; None to derive them from the events.
+            message_ids (Sequence[str]): Per-message id (32 hex digits); None to generate them.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def close_connection(self):
         """
@@ -70,6 +131,24 @@ class RabbitMQPublisher(MessageQueueClient):
 
     This class implements the 'MessageQueueClient' interface for publishing messages
     to a RabbitMQ message queue.
+
+    The connection and channel stay open between publishes, the exchange,
+    queue and binding are declared only once per publisher, and the
+    channel runs in publisher-confirm mode. Confirms are tracked by
+    delivery tag and awaited once per batch rather than once per message.
+    A lock serialises access, since pika's BlockingConnection is not
+    thread-safe, so one instance can be shared by a whole process.
+
+    (Re)connecting happens outside that lock and within `connect_timeout`
+    seconds: while one caller connects, the others wait at most that long
+    for it and then report their messages as not published.
+
+    Messages whose event has a high priority are routed to the priority
+    lane (`<queue>.priority`), the rest to the original queue.
+
+    Every message carries its publish time and a W3C `traceparent` whose
+    trace id is the message id; the publish spans of sampled messages are
+    exported for the consumer's trace to hang off.
     """
 
     def __init__(
@@ -85,6 +164,8 @@ class RabbitMQPublisher(MessageQueueClient):
         retry_delay,
         connection_success,
         publish_status,
+        confirm_timeout=30,
+        connect_timeout=rabbitmq_publisher_connect_timeout,
     ):
         self.rabbitmq_username = username
         self.rabbitmq_password = password
@@ -97,10 +178,21 @@ class RabbitMQPublisher(MessageQueueClient):
         self.retry_delay = retry_delay
         self.connection_success = connection_success
         self.publish_status = publish_status
+        self.confirm_timeout = confirm_timeout
+        self.connect_timeout = connect_timeout
         self.connection = None
+        self.channel = None
+        self._lock = threading.RLock()
+        self._connect_lock = threading.Lock()
+        self._topology_declared = False
+        self._next_delivery_tag = 1
+        self._unconfirmed = set()
+        self._confirmations: Dict[int, bool] = {}
         self._connect()
 
     def _connect(self):
+        """Open a connection and a confirm-mode channel, then swap them in under the publish lock."""
+        self.connection_success = False
         try:
             credentials = pika.PlainCredentials(
                 self.rabbitmq_username, self.rabbitmq_password
@@ -109,79 +201,271 @@ class RabbitMQPublisher(MessageQueueClient):
                 host=self.rabbitmq_host,
                 port=self.rabbitmq_port,
                 credentials=credentials,
+                socket_timeout=self.connect_timeout,
+                stack_timeout=self.connect_timeout,
             )
         except pika.exceptions.AMQPError as amqp_error:
             logger.error("AMQP error in connection parameters: %s", amqp_error)
 
         for retry_attempt in range(self.max_retries):
+            connection = None
             try:
-                self.connection = pika.BlockingConnection(connection_params)
-                self.channel = self.connection.channel()
-                self.channel.exchange_declare(
-                    exchange=self.rabbitmq_exchange, exchange_type="direct"
-                )
-                self.channel.queue_declare(queue=self.rabbitmq_quee)
-                self.channel.queue_bind(
-                    exchange=self.rabbitmq_exchange,
-                    queue=self.rabbitmq_quee,
-                )
+                connection = pika.BlockingConnection(connection_params)
+                channel = connection.channel()
+                if not self._topology_declared:
+                    self._declare_topology(channel)
+                with self._lock:
+                    self._enable_confirms(connection, channel)
+                    self.connection, self.channel = connection, channel
                 logger.info("connection established")
                 self.connection_success = True  # If connection succeeds, exit the loop
                 break
 
-            except pika.exceptions.AMQPConnectionError as connection_error:
-                if retry_attempt < self.max_retries - 1:
-                    logger.error(
-                        "AMQP connection error (retry %d): %s while connecting rabbitmq. Retrying in %d seconds...",
-                        retry_attempt + 1,
-                        connection_error,
-                        self.retry_delay,
-                    )
-                    time.sleep(self.retry_delay)
-                else:
-                    logger.error("Max retries reached. Unable to connect to RabbitMQ")
-                    break
-
             except pika.exceptions.AMQPChannelError as channel_error:
                 logger.error(
                     "AMQP channel error: %s while connecting rabbitmq", channel_error
                 )
 
+            except pika.exceptions.AMQPConnectionError as connection_error:
+                logger.error(
+                    "AMQP connection error (retry %d): %s while connecting rabbitmq",
+                    retry_attempt + 1,
+                    connection_error,
+                )
+
             except socket.gaierror:
                 logger.error(
                     "DNS resolution error: Unable to resolve the host '%s",
                     self.rabbitmq_host,
                 )
 
-    def publish_message(self, message: bytes, ttl: int):
+            # Whatever failed, never keep the half-opened connection around
+            self._discard(connection)
+            if retry_attempt < self.max_retries - 1:
+                logger.info("Retrying RabbitMQ connection in %d seconds...", self.retry_delay)
+                time.sleep(self.retry_delay)
+            else:
+                logger.error("Max retries reached. Unable to connect to RabbitMQ")
+
+    @staticmethod
+    def _discard(connection):
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError as amqp_error:
+                logger.error("AMQP error while closing connection: %s", amqp_error)
+
+    def _declare_topology(self, channel):
+        channel.exchange_declare(
+            exchange=self.rabbitmq_exchange, exchange_type="direct"
+        )
+        channel.queue_declare(queue=self.rabbitmq_quee)
+        channel.queue_bind(
+            exchange=self.rabbitmq_exchange,
+            queue=self.rabbitmq_quee,
+            routing_key=self.rabbitmq_routing_key,
+        )
+        channel.queue_declare(queue=priority_queue_name(self.rabbitmq_quee))
+        channel.queue_bind(
+            exchange=self.rabbitmq_exchange,
+            queue=priority_queue_name(self.rabbitmq_quee),
+            routing_key=priority_routing_key(self.rabbitmq_routing_key),
+        )
+        self._topology_declared = True
+
+    def _enable_confirms(self, connection, channel):
+        """Put the channel in confirm mode without making each publish wait for its ack."""
+        self._next_delivery_tag = 1
+        self._unconfirmed.clear()
+        self._confirmations.clear()
+        selected = []
+        select_async_confirms(channel, self._on_confirmation, selected.append)
+        deadline = time.monotonic() + self.connect_timeout
+        while not selected and time.monotonic() < deadline:
+            connection.process_data_events(time_limit=0.1)
+        if not selected:
+            raise pika.exceptions.AMQPConnectionError("Timed out enabling publisher confirms")
+
+    def _on_confirmation(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._unconfirmed else []
+        for tag in tags:
+            self._unconfirmed.discard(tag)
+            self._confirmations[tag] = acked
+
+    def _ensure_connected(self) -> bool:
+        """Connect unless connected, waiting at most `connect_timeout` for a connect in progress."""
+        if self._is_connected():
+            return True
+        if not self._connect_lock.acquire(timeout=self.connect_timeout):
+            logger.error("Still connecting to RabbitMQ after %ss, not publishing", self.connect_timeout)
+            return False
         try:
+            # Whoever held the lock may have connected meanwhile
+            if not self._is_connected():
+                self._connect()
+        finally:
+            self._connect_lock.release()
+        return self._is_connected()
+
+    def _is_connected(self):
+        return (
+            self.connection is not None
+            and self.connection.is_open
+            and self.channel is not None
+            and self.channel.is_open
+        )
+
+    def _properties(self, ttl: int, message_id: str, traceparent: str) -> pika.BasicProperties:
+        # No AMQP `priority`: the lane queues are not priority queues (no
+        # x-max-priority, which cannot be added to an existing queue), the
+        # priority lane is what keeps urgent messages ahead
+        return pika.BasicProperties(
+            delivery_mode=2,
+            expiration=str(ttl * 1000),
+            message_id=message_id,
+            headers={PUBLISHED_AT_HEADER: time.time(), TRACEPARENT_HEADER: traceparent},
+        )
+
+    def _routing_key(self, priority: int) -> str:
+        if is_priority(priority):
+            return priority_routing_key(self.rabbitmq_routing_key)
+        return self.rabbitmq_routing_key
+
+    def _publish_confirmed(
+        self,
+        messages: Sequence[bytes],
+        message_ids: Sequence[str],
+        priorities: Sequence[int],
+        traceparents: Sequence[str],
+        ttl: int,
+    ) -> List[bool]:
+        # Service heartbeats and notice a dead connection before publishing
+        self.connection.process_data_events(time_limit=0)
+        tags = []
+        for message, message_id, priority, traceparent in zip(messages, message_ids, priorities, traceparents):
             self.channel.basic_publish(
                 exchange=self.rabbitmq_exchange,
-                routing_key=self.rabbitmq_routing_key,
+                routing_key=self._routing_key(priority),
                 body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=2, expiration=str(ttl * 1000)
-                ),
+                properties=self._properties(ttl, message_id, traceparent),
             )
-            logger.info("Message sent successfully")
-            self.close_connection()
-            self.publish_status = True
+            tag = self._next_delivery_tag
+            self._next_delivery_tag += 1
+            self._unconfirmed.add(tag)
+            tags.append(tag)
+
+        deadline = time.monotonic() + self.confirm_timeout
+        while self._unconfirmed.intersection(tags):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error("Timed out waiting for %d publisher confirms", len(self._unconfirmed.intersection(tags)))
+                self._unconfirmed.difference_update(tags)
+                break
+            self.connection.process_data_events(time_limit=min(remaining, 1))
+        return [self._confirmations.pop(tag, False) for tag in tags]
 
-        except pika.exceptions.ConnectionClosedByBroker as broker_closed_error:
-            logger.error(
-                "Connection closed by broker while publishing message : %s",
-                broker_closed_error,
+    def _trace_publishes(
+        self,
+        message_ids: Sequence[str],
+        traces: Sequence[Tuple[str, str, bool]],
+        priorities: Sequence[int],
+        results: Sequence[bool],
+        started_ns: int,
+    ) -> None:
+        """Export the publish span (first attempt to confirm) of each sampled message."""
+        ended_ns = time.time_ns()
+        spans = [
+            Span(
+                f"{self.rabbitmq_exchange} publish", message_id, span_id, None, SPAN_KIND_PRODUCER,
+                started_ns, ended_ns,
+                {
+                    "messaging.system": "rabbitmq",
+                    "messaging.operation": "publish",
+                    "messaging.message.id": message_id,
+                    "messaging.rabbitmq.destination.routing_key": self._routing_key(priority),
+                },
+                STATUS_OK if confirmed else STATUS_ERROR,
             )
-            self.close_connection()
+            for message_id, (_, span_id, sampled), priority, confirmed in zip(message_ids, traces, priorities, results)
+            if sampled
+        ]
+        if spans:
+            export_spans(spans, "sending_emails.publisher")
 
-        except pika.exceptions.AMQPError as amqp_error:
-            logger.error("AMQP error while publishing message: %s", amqp_error)
-            self.close_connection()
+    def publish_many(
+        self,
+        messages: Sequence[bytes],
+        ttl: int,
+        priorities: Optional[Sequence[int]] = None,
+        message_ids: Optional[Sequence[str]] = None,
+    ) -> List[bool]:
+        """Publish a batch and wait once for all of its confirms; one result per message."""
+        if not messages:
+            return []
+        if priorities is None:
+            priorities = [message_priority(message) for message in messages]
+        # Ids are fixed before the first attempt, so a message republished
+        # after a lost confirm is recognised as a duplicate by the consumer
+        if message_ids is None:
+            message_ids = [uuid.uuid4().hex for _ in messages]
+        traces = [new_traceparent(message_id) for message_id in message_ids]
+        traceparents = [traceparent for traceparent, _, _ in traces]
+        started_ns = time.time_ns()
+        results = [False] * len(messages)
+        for attempt in range(2):
+            if not self._ensure_connected():
+                break
+            with self._lock:
+                if not self._is_connected():
+                    # Closed by a failed publish while we waited for the lock
+                    continue
+                try:
+                    results = self._publish_confirmed(messages, message_ids, priorities, traceparents, ttl)
+                    logger.info("Published %d/%d messages", sum(results), len(results))
+                    break
+
+                except pika.exceptions.ChannelClosedByBroker as channel_closed_error:
+                    # e.g. the exchange vanished with a broker restart: declare again
+                    logger.error(
+                        "Channel closed by broker while publishing message : %s",
+                        channel_closed_error,
+                    )
+                    self._topology_declared = False
+                    self.close_connection()
+
+                except pika.exceptions.AMQPError as amqp_error:
+                    logger.error("AMQP error while publishing message: %s", amqp_error)
+                    self.close_connection()
+        self._trace_publishes(message_ids, traces, priorities, results, started_ns)
+        return results
+
+    def publish_message(self, message: bytes, ttl: int, priority: Optional[int] = None):
+        self.publish_status = self.publish_many(
+            [message], ttl, None if priority is None else [priority]
+        )[0]
+        if self.publish_status:
+            logger.info("Message sent successfully")
+        return self.publish_status
 
     def close_connection(self):
-        if self.connection is not None:
-            self.connection.close()
-            logger.info("connection closed")
+        with self._lock:
+            if self.connection is not None and self.connection.is_open:
+                try:
+                    self.connection.close()
+                except pika.exceptions.AMQPError as amqp_error:
+                    logger.error("AMQP error while closing connection: %s", amqp_error)
+                logger.info("connection closed")
+            self.connection = None
+            self.channel = None
+
+
+_publishers: Dict[tuple, RabbitMQPublisher] = {}
+_publishers_lock = threading.Lock()
 
 
 def get_rabbit_mq_publisher(
@@ -195,7 +479,13 @@ def get_rabbit_mq_publisher(
     max_retries: str = RetryConstants.MAX_RETRIES.value,
     retry_delay: str = RetryConstants.RETRY_DELAY.value,
 ) -> RabbitMQPublisher:
-    """Get a RabbitMQPublisher instance with the specified configuration"""
+    """
+    Get the shared RabbitMQPublisher for the specified configuration.
+
+    Publishers are long-lived: one per distinct configuration, reused by
+    every caller. One that could not connect stays in place and reconnects
+    on its next publish, so callers never queue here behind a connect.
+    """
     publisher_args = {
         "username": rabbitmq_username,
         "password": rabbitmq_password,
@@ -209,4 +499,24 @@ def get_rabbit_mq_publisher(
         "connection_success": False,
         "publish_status": False,
     }
-    return RabbitMQPublisher(**publisher_args)
+    key = tuple(publisher_args.values())
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+    if publisher is not None:
+        return publisher
+    # Connect outside the lock; if another caller got there first, keep theirs
+    candidate = RabbitMQPublisher(**publisher_args)
+    with _publishers_lock:
+        publisher = _publishers.setdefault(key, candidate)
+    if publisher is not candidate:
+        candidate.close_connection()
+    return publisher
+
+
+def close_rabbit_mq_publishers() -> None:
+    """Close every shared publisher connection (on shutdown)."""
+    with _publishers_lock:
+        publishers = list(_publishers.values())
+        _publishers.clear()
+    for publisher in publishers:
+        publisher.close_connection()
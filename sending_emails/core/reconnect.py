@@ -0,0 +1,66 @@
+"""Broker connection settings and reconnect pacing shared by both consumers"""
+import random
+from typing import Callable
+import pika
+from sending_emails.core.config import (
+    rabbitmq_username,
+    rabbitmq_password,
+    rabbitmq_host,
+    rabbitmq_port,
+    rabbitmq_heartbeat,
+    rabbitmq_blocked_connection_timeout,
+    reconnect_backoff_base,
+    reconnect_backoff_cap,
+)
+
+
+class ExponentialBackoff:
+    """
+    Capped exponential backoff with full jitter.
+
+    The n-th consecutive retry waits a uniformly random time in
+    `[0, min(cap, base * 2**n)]`, so replicas that lost the broker together
+    spread their reconnects out instead of arriving in lockstep, while the
+    first retry after a blip happens within `base` seconds.
+    """
+
+    def __init__(
+        self,
+        base: float = reconnect_backoff_base,
+        cap: float = reconnect_backoff_cap,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.base = base
+        self.cap = cap
+        self.rng = rng
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next attempt; each call doubles the ceiling."""
+        ceiling = min(self.cap, self.base * 2 ** self.attempt)
+        if ceiling < self.cap:
+            self.attempt += 1
+        return ceiling * self.rng()
+
+    def reset(self) -> None:
+        """Start over from `base` once a connection succeeded."""
+        self.attempt = 0
+
+
+def consumer_connection_parameters() -> pika.ConnectionParameters:
+    """
+    Connection parameters for the consumers.
+
+    Heartbeats let both sides notice a dead TCP connection, and the blocked
+    connection timeout tears down a connection the broker keeps blocked
+    (e.g. on a memory alarm) so the supervisor can reconnect.
+    """
+    return pika.ConnectionParameters(
+        rabbitmq_host,
+        rabbitmq_port,
+        "/",
+        pika.PlainCredentials(rabbitmq_username, rabbitmq_password),
+        heartbeat=rabbitmq_heartbeat,
+        blocked_connection_timeout=rabbitmq_blocked_connection_timeout,
+        connection_attempts=1,
+    )
@@ -0,0 +1,121 @@
+"""Delayed retries of failed sends through TTL queues, and a final dead-letter queue"""
+import smtplib
+import logging
+from typing import Dict, List, Optional, Tuple
+import aiosmtplib
+import pika
+from sending_emails.core.config import (
+    rabbitmq_quee,
+    rabbitmq_exchange,
+    retry_max_retries,
+    retry_delays,
+)
+from sending_emails.core.lanes import LANES, lane_of
+from sending_emails.emails.events import EmailEvent, RetryPolicy, email_events
+from sending_emails.emails.rate_limit import smtp_reply_codes
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+# Failed attempts so far, and why the last one failed
+ATTEMPT_HEADER = "x-email-attempt"
+ERROR_HEADER = "x-email-last-error"
+
+RETRIED = "retried"
+DEAD_LETTERED = "dead_lettered"
+
+DEFAULT_RETRY_POLICY = RetryPolicy(max_retries=retry_max_retries, delays=tuple(retry_delays))
+
+
+def retry_policy_for(email_event: Optional[EmailEvent]) -> RetryPolicy:
+    if email_event is None or email_event.retry_policy is None:
+        return DEFAULT_RETRY_POLICY
+    return email_event.retry_policy
+
+
+def retry_queue_name(delay: int, queue: str = rabbitmq_quee) -> str:
+    return f"{queue}.retry.{delay}s"
+
+
+def dead_letter_queue_name() -> str:
+    return f"{rabbitmq_quee}.dead"
+
+
+def retry_queue_declarations() -> List[Tuple[str, Dict[str, object]]]:
+    """
+    `(queue, arguments)` for every delay tier of every lane, plus the DLQ.
+
+    A tier queue has no consumer: messages sit there for its TTL and are
+    then dead-lettered back to their lane's routing key, so the wait costs
+    the consumer nothing and a retried OTP stays in the priority lane. One
+    queue per delay keeps every message in a queue at its head expiring first.
+    """
+    delays = set(DEFAULT_RETRY_POLICY.delays)
+    for email_event in email_events:
+        delays.update(retry_policy_for(email_event).delays)
+    declarations = [
+        (
+            retry_queue_name(delay, lane.queue),
+            {
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": rabbitmq_exchange,
+                "x-dead-letter-routing-key": lane.routing_key,
+            },
+        )
+        for lane in LANES
+        for delay in sorted(delays)
+    ]
+    declarations.append((dead_letter_queue_name(), {}))
+    return declarations
+
+
+def declare_retry_topology(channel) -> None:
+    """Declare the retry tiers and the DLQ on a blocking channel."""
+    for queue, arguments in retry_queue_declarations():
+        channel.queue_declare(queue=queue, durable=True, arguments=arguments)
+
+
+def is_permanent_failure(exc: BaseException) -> bool:
+    """
+    5xx replies about the message itself fail the same way on every retry.
+
+    Authentication failures are a configuration problem rather than a
+    property of the message, so they are retried like transient errors.
+    """
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, aiosmtplib.SMTPAuthenticationError)):
+        return False
+    codes = smtp_reply_codes(exc)
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+def retry_or_dead_letter(channel, method, properties, body: bytes, policy: RetryPolicy, error: BaseException) -> str:
+    """
+    Republish a failed delivery to its next delay tier (or the DLQ) and ack it.
+
+    The attempt count travels in the `x-email-attempt` header. The copy is
+    published before the original is acked on the same channel, so the
+    broker sees them in that order. Returns `RETRIED` or `DEAD_LETTERED`.
+    """
+    headers = dict(getattr(properties, "headers", None) or {})
+    attempt = int(headers.get(ATTEMPT_HEADER, 0)) + 1
+    delay = None if is_permanent_failure(error) else policy.delay_for(attempt)
+    headers[ATTEMPT_HEADER] = attempt
+    headers[ERROR_HEADER] = str(error)[:500]
+    if delay is None:
+        routing_key = dead_letter_queue_name()
+        logger.warning("Dead-lettering delivery after %s attempt(s): %s", attempt, error)
+    else:
+        routing_key = retry_queue_name(delay, lane_of(method).queue)
+        logger.info("Retrying delivery in %ss (attempt %s): %s", delay, attempt, error)
+    channel.basic_publish(
+        exchange="",
+        routing_key=routing_key,
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            headers=headers,
+            message_id=getattr(properties, "message_id", None),
+            content_type=getattr(properties, "content_type", None),
+        ),
+    )
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+    return DEAD_LETTERED if delay is None else RETRIED
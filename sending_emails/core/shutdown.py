@@ -0,0 +1,70 @@
+"""Coordinated consumer shutdown: stop consuming, drain in-flight sends, report"""
+import time
+import logging
+import threading
+from typing import Awaitable, Callable, NamedTuple
+from sending_emails.core.config import consumer_drain_timeout
+from sending_emails.core.health import consumer_state
+from sending_emails.core.metrics import Counter, Gauge
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+CONSUMER_DRAIN_SECONDS = Gauge(
+    "email_consumer_drain_seconds",
+    "Seconds the last shutdown took to stop consuming and settle in-flight messages",
+)
+CONSUMER_DRAINS = Counter(
+    "email_consumer_drains_total",
+    "Consumer shutdowns, by outcome (drained, timeout)",
+    ("outcome",),
+)
+
+
+class DrainReport(NamedTuple):
+    """How a consumer shutdown went."""
+
+    mode: str
+    seconds: float
+    # False when the deadline passed with messages still in flight
+    drained: bool
+
+
+async def drain_consumer(mode: str, stop: Callable[[], Awaitable[bool]]) -> DrainReport:
+    """
+    Shut a consumer down and report how long draining took.
+
+    Readiness fails first, so no new traffic is routed here; then `stop`
+    cancels consumption, waits for in-flight sends up to the drain
+    deadline, settles what is left and closes the broker and SMTP
+    connections, returning whether everything finished in time.
+    """
+    started = time.perf_counter()
+    consumer_state.mark_draining()
+    logger.info("Draining the %s email consumer", mode)
+    drained = await stop()
+    report = DrainReport(mode, time.perf_counter() - started, drained)
+    CONSUMER_DRAIN_SECONDS.set(value=report.seconds)
+    CONSUMER_DRAINS.inc(("drained" if drained else "timeout",))
+    if drained:
+        logger.info("Email consumer drained in %.2fs", report.seconds)
+    else:
+        logger.warning("Email consumer did not drain within the deadline (%.2fs)", report.seconds)
+    return report
+
+
+def stop_consumer_thread(
+    supervisor, thread: threading.Thread, smtp_pool, timeout: float = consumer_drain_timeout
+) -> bool:
+    """
+    Stop the threaded consumer and wait up to `timeout` seconds for it.
+
+    `supervisor.stop()` cancels the consumers on the connection thread;
+    the sends already running finish and are acked, deliveries not started
+    yet are nacked back to the queue and the connection is closed. A
+    thread still sending at the deadline is abandoned (it is a daemon), and
+    its deliveries are redelivered once the process exits.
+    """
+    supervisor.stop()
+    thread.join(timeout)
+    smtp_pool.close()
+    return not thread.is_alive()
@@ -0,0 +1,395 @@
+"""Durable local outbox: rendered emails are committed to disk, acked, and sent from there"""
+import time
+import sqlite3
+import logging
+import threading
+from typing import Callable, List, NamedTuple, Optional, Sequence
+from sending_emails.core.config import (
+    spool_path,
+    spool_senders,
+    spool_batch_size,
+    spool_lease_seconds,
+    spool_poll_interval,
+    spool_dead_retention_seconds,
+)
+from sending_emails.core.metrics import Counter, Gauge, record_stage
+from sending_emails.core.retry import is_permanent_failure, retry_policy_for
+from sending_emails.emails.helpers import OutgoingEmail, deliver_emails
+from sending_emails.emails.send_mails import get_email_event
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+SPOOL_DEPTH = Gauge(
+    "email_spool_depth",
+    "Emails waiting in the local spool at the last sender pass",
+)
+SPOOL_SENDS = Counter(
+    "email_spool_sends_total",
+    "Send attempts from the local spool, by outcome (sent, retried, dead, expired)",
+    ("outcome",),
+)
+
+
+class SpooledEmail(NamedTuple):
+    """
+    A rendered email accepted from the broker, identified by its delivery key.
+
+    `expires_at` is when a secret it carries (an OTP) stops being worth
+    sending; None for emails that never go stale.
+    """
+
+    key: str
+    event: str
+    email: OutgoingEmail
+    expires_at: Optional[float] = None
+
+
+class ClaimedEmail(NamedTuple):
+    id: int
+    key: str
+    event: str
+    email: OutgoingEmail
+    attempts: int
+
+
+class _PendingAppend:
+    __slots__ = ("entries", "done", "error")
+
+    def __init__(self, entries: Sequence[SpooledEmail]):
+        self.entries = entries
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class EmailSpool:
+    """
+    Append-only outbox in a SQLite file (WAL, synchronous=FULL).
+
+    `append` returns only once its emails are on disk, so the delivery can
+    be acked right after. Concurrent appends are group-committed: the
+    first caller to reach the writer commits everything queued meanwhile
+    in one transaction, paying one fsync for the whole group. A delivery
+    key is stored once, so a redelivery of an already spooled message is
+    absorbed.
+
+    Senders `claim` due emails under a lease; an email whose sender died
+    becomes due again once the lease runs out, which is how sends that
+    were in progress during a crash are recovered on restart.
+
+    Rendered bodies may hold plaintext secrets, so they are dropped as soon
+    as an email is buried or expires, and dead rows are purged after a
+    retention period.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = spool_lease_seconds,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._db_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._queued: List[_PendingAppend] = []
+        self._appended = threading.Condition()
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                event TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                html_content TEXT NOT NULL,
+                text_content TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                due_at REAL NOT NULL,
+                claimed_until REAL NOT NULL DEFAULT 0,
+                dead INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                expires_at REAL,
+                dead_at REAL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (dead, due_at)")
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Bring an outbox written by an older version up to the current schema."""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        if "expires_at" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN expires_at REAL")
+        if "dead_at" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN dead_at REAL")
+            # Older versions kept the bodies of dead rows: drop them and start their retention now
+            self._db.execute(
+                "UPDATE outbox SET dead_at = ?, html_content = '', text_content = NULL WHERE dead = 1",
+                (self.clock(),),
+            )
+
+    def append(self, entries: Sequence[SpooledEmail]) -> None:
+        """Durably store `entries`; returns once they are committed and fsynced."""
+        if not entries:
+            return
+        started = time.perf_counter()
+        pending = _PendingAppend(entries)
+        with self._queue_lock:
+            self._queued.append(pending)
+        with self._commit_lock:
+            if not pending.done:
+                with self._queue_lock:
+                    group, self._queued = self._queued, []
+                self._commit(group)
+        record_stage("spool_append", started)
+        if pending.error is not None:
+            raise pending.error
+        self.wake()
+
+    def _commit(self, group: List[_PendingAppend]) -> None:
+        now = self.clock()
+        rows = [
+            (entry.key, entry.event, entry.email.subject, entry.email.recipient,
+             entry.email.html_content, entry.email.text_content, now, entry.expires_at)
+            for pending in group
+            for entry in pending.entries
+        ]
+        error = None
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.executemany(
+                        "INSERT OR IGNORE INTO outbox "
+                        "(key, event, subject, recipient, html_content, text_content, due_at, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        except Exception as exc:
+            error = exc
+        for pending in group:
+            pending.error = error
+            pending.done = True
+
+    def wake(self) -> None:
+        """Wake the senders waiting in `wait_for_work`."""
+        with self._appended:
+            self._appended.notify_all()
+
+    def wait_for_work(self, timeout: float) -> None:
+        """Block until something is appended or `timeout` seconds passed."""
+        with self._appended:
+            self._appended.wait(timeout)
+
+    def claim(self, limit: int) -> List[ClaimedEmail]:
+        """Lease up to `limit` due emails, oldest first."""
+        now = self.clock()
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, key, event, subject, recipient, html_content, text_content, attempts "
+                    "FROM outbox WHERE dead = 0 AND due_at <= ? AND claimed_until <= ? "
+                    "AND (expires_at IS NULL OR expires_at > ?) "
+                    "ORDER BY id LIMIT ?",
+                    (now, now, now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [
+            ClaimedEmail(row[0], row[1], row[2], OutgoingEmail(row[3], row[4], row[5], row[6]), row[7])
+            for row in rows
+        ]
+
+    def complete(self, ids: Sequence[int]) -> None:
+        with self._db_lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(id_,) for id_ in ids])
+
+    def retry(self, id_: int, delay: float, error: BaseException) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, due_at = ?, claimed_until = 0, last_error = ? "
+                "WHERE id = ?",
+                (self.clock() + delay, str(error)[:500], id_),
+            )
+
+    def bury(self, id_: int, error: BaseException) -> None:
+        """Keep a hopeless email's envelope for inspection, without its body, instead of sending it again."""
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, dead = 1, dead_at = ?, claimed_until = 0, "
+                "last_error = ?, html_content = '', text_content = NULL WHERE id = ?",
+                (self.clock(), str(error)[:500], id_),
+            )
+
+    def expire(self) -> int:
+        """Bury the unsent emails whose secrets expired; returns how many."""
+        now = self.clock()
+        with self._db_lock:
+            return self._db.execute(
+                "UPDATE outbox SET dead = 1, dead_at = ?, claimed_until = 0, "
+                "last_error = 'expired before it was sent', html_content = '', text_content = NULL "
+                "WHERE dead = 0 AND expires_at <= ?",
+                (now, now),
+            ).rowcount
+
+    def purge(self, retention_seconds: float) -> int:
+        """Delete dead rows buried more than `retention_seconds` ago; returns how many."""
+        with self._db_lock:
+            return self._db.execute(
+                "DELETE FROM outbox WHERE dead = 1 AND dead_at <= ?",
+                (self.clock() - retention_seconds,),
+            ).rowcount
+
+    def depth(self) -> int:
+        """Emails still to be sent (excluding dead ones)."""
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0").fetchone()[0]
+
+    def dead_count(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1").fetchone()[0]
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._db.close()
+
+
+class SpoolSender:
+    """
+    Threads that drain an `EmailSpool` through the SMTP pool.
+
+    Each pass claims up to `batch_size` due emails and sends them in one
+    SMTP session. Sent emails are deleted; failures are rescheduled after
+    the event's retry delays, and permanent failures, exhausted retries and
+    expired secrets are kept as dead rows for `dead_retention` seconds.
+    """
+
+    def __init__(
+        self,
+        spool: EmailSpool,
+        senders: int = spool_senders,
+        batch_size: int = spool_batch_size,
+        poll_interval: float = spool_poll_interval,
+        send: Callable[[List[OutgoingEmail]], List[Optional[Exception]]] = deliver_emails,
+        dead_retention: float = spool_dead_retention_seconds,
+    ):
+        self.spool = spool
+        self.senders = senders
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.send = send
+        self.dead_retention = dead_retention
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        pending = self.spool.depth()
+        if pending:
+            logger.info("Resuming %s spooled emails left by a previous run", pending)
+        for index in range(self.senders):
+            thread = threading.Thread(target=self._run, name=f"email-spool-sender-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                sent = self.send_due()
+            except Exception as exc:
+                logger.error("Spool sender pass failed: %s", exc)
+                sent = 0
+            if not sent and not self._stopping.is_set():
+                self.spool.wait_for_work(self.poll_interval)
+
+    def send_due(self) -> int:
+        """Send one batch of due emails; returns how many were claimed."""
+        expired = self.spool.expire()
+        if expired:
+            logger.warning("Dropped %s spooled emails whose secrets expired before they were sent", expired)
+            SPOOL_SENDS.inc(("expired",), expired)
+        claimed = self.spool.claim(self.batch_size)
+        if not claimed:
+            # Idle: a good moment to forget old dead rows
+            self.spool.purge(self.dead_retention)
+            SPOOL_DEPTH.set(value=self.spool.depth())
+            return 0
+        errors = self._send_claimed(claimed)
+        sent = []
+        for entry, error in zip(claimed, errors):
+            if error is None:
+                sent.append(entry.id)
+                SPOOL_SENDS.inc(("sent",))
+                continue
+            delay = None
+            if not is_permanent_failure(error):
+                delay = retry_policy_for(get_email_event(entry.event)).delay_for(entry.attempts + 1)
+            if delay is None:
+                logger.warning("Giving up on spooled %s email after %s attempt(s): %s",
+                               entry.event, entry.attempts + 1, error)
+                self.spool.bury(entry.id, error)
+                SPOOL_SENDS.inc(("dead",))
+            else:
+                self.spool.retry(entry.id, delay, error)
+                SPOOL_SENDS.inc(("retried",))
+        self.spool.complete(sent)
+        return len(claimed)
+
+    def _send_claimed(self, claimed: List[ClaimedEmail]) -> List[Optional[Exception]]:
+        """Per-email errors of a claimed batch; a raising batch is retried one email at a time."""
+        try:
+            return self.send([entry.email for entry in claimed])
+        except Exception as exc:
+            logger.error("Spooled batch of %s emails failed, sending them one by one: %s", len(claimed), exc)
+        errors: List[Optional[Exception]] = []
+        for entry in claimed:
+            try:
+                errors.extend(self.send([entry.email]))
+            except Exception as exc:
+                # Counts as an attempt, so a poison row ends up buried
+                errors.append(exc)
+        return errors
+
+    def stop(self, timeout: float = 10) -> bool:
+        """
+        Stop claiming; sends in progress get `timeout` seconds, the rest stays
+        spooled. Returns whether every sender thread exited, i.e. whether the
+        spool may be closed.
+        """
+        self._stopping.set()
+        self.spool.wake()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        if self._threads:
+            logger.warning("%s spool sender(s) still sending after %ss", len(self._threads), timeout)
+        return not self._threads
+
+
+_spool: Optional[EmailSpool] = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> Optional[EmailSpool]:
+    """Return the process-wide spool, or None when SPOOL_PATH is not set."""
+    global _spool
+    if _spool is None and spool_path:
+        with _spool_lock:
+            if _spool is None:
+                _spool = EmailSpool(spool_path)
+    return _spool
@@ -0,0 +1,288 @@
+"""
+Per-message tracing from publish to SMTP acceptance.
+
+The publisher stamps a W3C `traceparent` header (its trace id is the
+message id) next to the publish time. The consumer turns every delivery
+into a trace: a queue-wait span from the publish time to pickup, then one
+span per pipeline stage (decode, decrypt, render, SMTP, ack) as recorded
+by `record_stage`. Queue waits feed a histogram for every message; sampled
+traces are also appended to TRACE_EXPORT_PATH as OTLP/JSON lines, which
+an OpenTelemetry collector's file receiver (or any jq script) can read.
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from sending_emails.core.config import trace_export_path, trace_sample_rate, trace_service_name
+from sending_emails.core.lanes import lane_of, published_at
+from sending_emails.core.metrics import Histogram, current_event, current_trace
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+STATUS_OK = 1
+STATUS_ERROR = 2
+# Outcomes after which the email did not go out
+FAILED_OUTCOMES = frozenset(("rejected", "nacked", "retried", "dead_lettered", "unsettled"))
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "email_queue_wait_seconds",
+    "Time from publish until a consumer picked the delivery up, by lane and event",
+    ("lane", "event"),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+class Span(NamedTuple):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    kind: int
+    start_ns: int
+    end_ns: int
+    attributes: Dict[str, Any]
+    status: int = STATUS_OK
+
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64) or 1:016x}"
+
+
+def new_traceparent(trace_id: str, sampled: Optional[bool] = None) -> Tuple[str, str, bool]:
+    """A fresh `traceparent` for a message; returns it with its span id and sampling decision."""
+    if sampled is None:
+        sampled = random.random() < trace_sample_rate
+    span_id = new_span_id()
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}", span_id, sampled
+
+
+def is_trace_id(value) -> bool:
+    """Whether `value` is usable as a W3C trace id (32 lowercase hex digits, not all zero)."""
+    return isinstance(value, str) and _TRACE_ID.match(value) is not None and value.strip("0") != ""
+
+
+def parse_traceparent(value) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) of a `traceparent` header, or None when malformed."""
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    match = _TRACEPARENT.match(value.strip()) if isinstance(value, str) else None
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if not trace_id.strip("0") or not span_id.strip("0"):
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_record(spans: List[Span], scope: str) -> dict:
+    """An OTLP/JSON `ExportTraceServiceRequest` carrying `spans`."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", trace_service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": scope},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        **({"parentSpanId": span.parent_span_id} if span.parent_span_id else {}),
+                        "name": span.name,
+                        "kind": span.kind,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+                        "status": {"code": span.status},
+                    }
+                    for span in spans
+                ],
+            }],
+        }],
+    }
+
+
+class TraceExporter:
+    """
+    Appends sampled traces to a file, one OTLP/JSON request per line.
+
+    Each record is a single `write` on an O_APPEND descriptor, so several
+    processes can share the file without interleaving lines.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span], scope: str) -> None:
+        line = json.dumps(otlp_record(spans, scope), separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            if self._fd is not None:
+                os.write(self._fd, line)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_trace_exporter() -> Optional[TraceExporter]:
+    """Return the process-wide exporter, or None when TRACE_EXPORT_PATH is not set."""
+    global _exporter
+    if _exporter is None and trace_export_path:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = TraceExporter(trace_export_path)
+    return _exporter
+
+
+def export_spans(spans: List[Span], scope: str) -> None:
+    """Hand sampled spans to the exporter; tracing never fails the caller."""
+    exporter = get_trace_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.export(spans, scope)
+    except Exception as exc:
+        logger.warning("Could not export %s trace spans: %s", len(spans), exc)
+
+
+class MessageTrace:
+    """
+    Timeline of one delivery, from its publish time to its settle.
+
+    Stages arrive as perf_counter intervals through `record_stage` and are
+    placed on the wall clock relative to the moment the delivery was
+    picked up.
+    """
+
+    __slots__ = (
+        "trace_id", "parent_span_id", "sampled", "lane", "message_id", "published_at",
+        "received_ns", "received_perf", "stages", "finished",
+    )
+
+    def __init__(self, method, properties):
+        self.received_ns = time.time_ns()
+        self.received_perf = time.perf_counter()
+        headers = getattr(properties, "headers", None) or {}
+        self.message_id = getattr(properties, "message_id", None)
+        self.lane = lane_of(method).name
+        self.published_at = published_at(properties)
+        parent = parse_traceparent(headers.get(TRACEPARENT_HEADER))
+        if parent is None:
+            # Published without a traceparent (or by an older publisher): trace it on our own
+            trace_id = self.message_id if is_trace_id(self.message_id) else f"{random.getrandbits(128) or 1:032x}"
+            parent = (trace_id, None, random.random() < trace_sample_rate)
+        self.trace_id, self.parent_span_id, self.sampled = parent
+        self.stages: List[Tuple[str, float, float]] = []
+        self.finished = False
+
+    def add_stage(self, stage: str, started: float, ended: float) -> None:
+        self.stages.append((stage, started, ended))
+
+    def queue_wait(self) -> Optional[float]:
+        if self.published_at is None:
+            return None
+        return max(0.0, self.received_ns / 1e9 - self.published_at)
+
+    def _wall_ns(self, perf: float) -> int:
+        return self.received_ns + int((perf - self.received_perf) * 1e9)
+
+    def spans(self, event: str, outcome: str, ended: float) -> List[Span]:
+        """The root `process` span, its queue-wait span and one span per recorded stage."""
+        root_id = new_span_id()
+        status = STATUS_ERROR if outcome in FAILED_OUTCOMES else STATUS_OK
+        spans = [
+            Span(
+                f"{self.lane} process", self.trace_id, root_id, self.parent_span_id, SPAN_KIND_CONSUMER,
+                self.received_ns, self._wall_ns(ended),
+                {
+                    "messaging.system": "rabbitmq",
+                    "messaging.operation": "process",
+                    "messaging.message.id": self.message_id or "",
+                    "email.event": event,
+                    "email.lane": self.lane,
+                    "email.outcome": outcome,
+                },
+                status,
+            )
+        ]
+        if self.published_at is not None:
+            spans.append(Span(
+                "queue_wait", self.trace_id, new_span_id(), root_id, SPAN_KIND_INTERNAL,
+                min(int(self.published_at * 1e9), self.received_ns), self.received_ns, {"email.event": event},
+            ))
+        for stage, started, stage_ended in self.stages:
+            spans.append(Span(
+                stage, self.trace_id, new_span_id(), root_id, SPAN_KIND_INTERNAL,
+                self._wall_ns(started), self._wall_ns(stage_ended), {"email.event": event},
+            ))
+        return spans
+
+    def finish(self, event: str, outcome: str) -> None:
+        """Record the queue wait and export the trace if it was sampled; only the first call counts."""
+        if self.finished:
+            return
+        self.finished = True
+        ended = time.perf_counter()
+        waited = self.queue_wait()
+        if waited is not None:
+            QUEUE_WAIT_SECONDS.observe((self.lane, event), waited)
+        if self.sampled:
+            export_spans(self.spans(event, outcome, ended), "sending_emails.consumer")
+
+
+@contextmanager
+def traced(method, properties) -> Iterator[MessageTrace]:
+    """Trace the enclosed handling of a delivery; stages recorded inside become its spans."""
+    trace = MessageTrace(method, properties)
+    with active_trace(trace):
+        try:
+            yield trace
+        finally:
+            # Left without a settle (e.g. cancelled at shutdown)
+            trace.finish(current_event.get(), "unsettled")
+
+
+@contextmanager
+def active_trace(trace: Optional[MessageTrace]) -> Iterator[Optional[MessageTrace]]:
+    """Make `trace` the current one for the enclosed block (None for no trace)."""
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+
+def finish_trace(event: str, outcome: str) -> None:
+    """Finish the current delivery's trace once it was settled with `outcome`."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.finish(event, outcome)
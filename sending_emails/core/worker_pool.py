@@ -0,0 +1,113 @@
+"""Bounded thread pool that runs RabbitMQ deliveries off the pika connection thread"""
+import time
+import queue
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from sending_emails.core.metrics import current_event, record_stage
+
+logger = logging.getLogger("ai_call_assistant_saas_email_service_logger")
+
+
+class ThreadSafeChannel:
+    """
+    Channel stand-in handed to callbacks running on worker threads.
+
+    pika's BlockingConnection is not thread-safe, so acks and nacks are
+    marshalled back onto the connection thread with
+    `add_callback_threadsafe` instead of touching the channel directly.
+    """
+
+    def __init__(self, connection, channel):
+        self._connection = connection
+        self._channel = channel
+
+    def _on_connection_thread(self, func, *args, **kwargs) -> None:
+        # Time spent waiting for the connection thread to pick the call up
+        event, scheduled = current_event.get(), time.perf_counter()
+
+        def run():
+            record_stage("ack_queue", scheduled, event)
+            func(*args, **kwargs)
+
+        try:
+            self._connection.add_callback_threadsafe(run)
+        except Exception as exc:
+            # Connection already gone: the broker redelivers the message
+            logger.warning("Could not schedule %s on closed connection: %s", func.__name__, exc)
+
+    def basic_ack(self, delivery_tag=0, multiple=False) -> None:
+        self._on_connection_thread(self._channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True) -> None:
+        self._on_connection_thread(
+            self._channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue
+        )
+
+    def basic_reject(self, delivery_tag=0, requeue=True) -> None:
+        self._on_connection_thread(self._channel.basic_reject, delivery_tag=delivery_tag, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None) -> None:
+        self._on_connection_thread(
+            self._channel.basic_publish,
+            exchange=exchange, routing_key=routing_key, body=body, properties=properties,
+        )
+
+
+class ConcurrentDispatcher:
+    """
+    Dispatch each delivery to a bounded pool of sender threads.
+
+    The executor queue itself is unbounded, but the channel's prefetch
+    count caps how many unacked deliveries the broker hands us, so memory
+    stays bounded by the prefetch window.
+
+    Waiting deliveries are picked lowest `rank(method)` first (FIFO within
+    a rank): every submitted job takes the most urgent pending delivery
+    rather than the one it was submitted for, so a priority-lane message
+    overtakes bulk messages that are still queued.
+    """
+
+    def __init__(self, connection, callback: Callable, workers: int, rank: Callable[[object], int] = lambda method: 0):
+        self.connection = connection
+        self.callback = callback
+        self.rank = rank
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-sender")
+        self._pending = queue.PriorityQueue()
+        self._sequence = itertools.count()
+
+    def dispatch(self, ch, method, properties, body) -> None:
+        """pika `on_message_callback`: hand the delivery to a worker and return at once."""
+        delivery = (ThreadSafeChannel(self.connection, ch), method, properties, body)
+        self._pending.put((self.rank(method), next(self._sequence), delivery))
+        self.executor.submit(self._process_next)
+
+    def _process_next(self) -> None:
+        _, _, delivery = self._pending.get_nowait()
+        self._process(*delivery)
+
+    def _process(self, ch, method, properties, body) -> None:
+        try:
+            self.callback(ch, method, properties, body)
+        except Exception as exc:
+            # Retry a failing message once via redelivery, then drop it
+            logger.exception("Error while processing delivery %s: %s", method.delivery_tag, exc)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+
+    def shutdown(self) -> int:
+        """Finish running sends and nack queued ones back to the broker; returns how many were nacked."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        requeued = 0
+        while True:
+            try:
+                _, _, (ch, method, _, _) = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if self.connection.is_open:
+                # A closed connection already returned them to the queue
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            requeued += 1
+        if requeued:
+            logger.info("Requeued %s deliveries that had not started sending", requeued)
+        return requeued
@@ -0,0 +1,273 @@
+"""Bounded pool of persistent SMTP sessions for the asyncio consumer"""
+import ssl
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Sequence, Union
+import aiosmtplib
+from sending_emails.core.metrics import record_stage
+from sending_emails.emails.config import (
+    EMAIL_HOST_USER,
+    EMAIL_HOST_PASSWORD,
+    EMAIL_HOST,
+    EMAIL_PORT,
+    EMAIL_USE_SSL,
+    SMTP_TIMEOUT,
+    SMTP_ASYNC_POOL_SIZE,
+    SMTP_POOL_IDLE_TIMEOUT,
+    SMTP_POOL_MAX_MESSAGES,
+    SMTP_POOL_HEALTH_CHECK_AFTER,
+    SMTP_POOL_ACQUIRE_TIMEOUT,
+    SMTP_POOL_UNHEALTHY_AFTER,
+    SMTP_RELAYS,
+)
+from sending_emails.emails.rate_limit import SMTPRateLimiter, get_rate_limiter
+from sending_emails.emails.smtp_pool import SMTPPoolExhausted
+from sending_emails.emails.smtp_router import AsyncSMTPRelayRouter, parse_relays
+
+logger = logging.getLogger("ai_call_assistant_service_logger")
+
+
+def is_broken_async_session(exc: BaseException) -> bool:
+    """Tell whether an aiosmtplib exception leaves the session unusable."""
+    if isinstance(exc, (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError)):
+        return True
+    if isinstance(exc, aiosmtplib.SMTPResponseException):
+        return exc.code == 421
+    return not isinstance(exc, aiosmtplib.SMTPException)
+
+
+class AsyncPooledSMTPConnection:
+    """An authenticated aiosmtplib client plus pool bookkeeping."""
+
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    async def close(self) -> None:
+        try:
+            await self.client.quit()
+        except Exception:
+            self.client.close()
+
+
+class AsyncSMTPConnectionPool:
+    """
+    asyncio counterpart of `SMTPConnectionPool`.
+
+    Same reuse rules (LIFO, NOOP health check, idle timeout, max messages
+    per session) but sessions are aiosmtplib clients, so hundreds of
+    in-flight messages can share a few connections without a thread each.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        use_ssl: bool = True,
+        size: int = 20,
+        idle_timeout: float = 60,
+        max_messages: int = 100,
+        health_check_after: float = 5,
+        acquire_timeout: float = 30,
+        timeout: float = 30,
+        unhealthy_after: int = 3,
+        rate_limiter: Optional[SMTPRateLimiter] = None,
+    ):
+        self.host = host
+        self.port = int(port)
+        self.relay = f"{host}:{self.port}"
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.unhealthy_after = unhealthy_after
+        self.rate_limiter = rate_limiter
+        self._tls_context = ssl.create_default_context() if use_ssl else None
+        self._slots = asyncio.Semaphore(size)
+        self._idle = deque()
+        self._closed = False
+        self.connections_opened = 0
+        self.reconnects = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+
+    async def _open(self) -> AsyncPooledSMTPConnection:
+        client = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            use_tls=self.use_ssl,
+            start_tls=False,
+            tls_context=self._tls_context,
+            timeout=self.timeout,
+        )
+        try:
+            started = time.perf_counter()
+            await client.connect()
+            record_stage("smtp_connect", started)
+            started = time.perf_counter()
+            try:
+                await client.login(self.username, self.password)
+            except BaseException:
+                client.close()
+                raise
+            record_stage("smtp_login", started)
+        except Exception as exc:
+            self.consecutive_failures += 1
+            self.last_error = repr(exc)
+            raise
+        self.connections_opened += 1
+        self.consecutive_failures = 0
+        logger.info(f"Opened async SMTP connection to {self.host}:{self.port}")
+        return AsyncPooledSMTPConnection(client)
+
+    async def _is_reusable(self, conn: AsyncPooledSMTPConnection) -> bool:
+        idle_for = time.monotonic() - conn.last_used
+        if idle_for > self.idle_timeout or conn.messages_sent >= self.max_messages:
+            return False
+        if not conn.client.is_connected:
+            return False
+        if idle_for > self.health_check_after:
+            try:
+                response = await conn.client.noop()
+            except (aiosmtplib.SMTPException, OSError):
+                return False
+            return response.code == 250
+        return True
+
+    async def acquire(self) -> AsyncPooledSMTPConnection:
+        """Borrow a healthy session, opening a new one if none is idle."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise SMTPPoolExhausted(
+                f"No SMTP connection available after {self.acquire_timeout}s"
+            ) from None
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if await self._is_reusable(conn):
+                    return conn
+                await conn.close()
+            return await self._open()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conn: AsyncPooledSMTPConnection, discard: bool = False) -> None:
+        """Return a borrowed session; broken or worn-out sessions are closed."""
+        self._slots.release()
+        if discard or self._closed or conn.messages_sent >= self.max_messages:
+            await conn.close()
+            return
+        conn.last_used = time.monotonic()
+        self._idle.append(conn)
+
+    async def prewarm(self, count: int) -> int:
+        """Open up to `count` sessions concurrently and park them idle; returns how many were opened."""
+        results = await asyncio.gather(
+            *(self.acquire() for _ in range(min(count, self.size))), return_exceptions=True
+        )
+        opened = [conn for conn in results if isinstance(conn, AsyncPooledSMTPConnection)]
+        for conn in opened:
+            await self.release(conn)
+        failures = [error for error in results if isinstance(error, BaseException)]
+        if failures:
+            raise failures[0]
+        return len(opened)
+
+    async def sendmail(
+        self, from_addr: str, to_addrs: Union[str, Sequence[str]], msg: Union[str, bytes]
+    ) -> dict:
+        """Send one message, reopening the session once if the server dropped it."""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.wait_async(self.relay, to_addrs)
+        conn = await self.acquire()
+        try:
+            started = time.perf_counter()
+            try:
+                refused, _ = await conn.client.sendmail(from_addr, to_addrs, msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                logger.warning(f"SMTP session to {self.host} dropped, reconnecting")
+                conn.client.close()
+                self.reconnects += 1
+                conn = await self._open()
+                started = time.perf_counter()
+                refused, _ = await conn.client.sendmail(from_addr, to_addrs, msg)
+            if self.rate_limiter is not None:
+                self.rate_limiter.record(self.relay, to_addrs)
+            record_stage("smtp_send", started)
+            conn.messages_sent += 1
+        except BaseException as exc:
+            if self.rate_limiter is not None and isinstance(exc, aiosmtplib.SMTPException):
+                self.rate_limiter.record(self.relay, to_addrs, exc)
+            await self.release(conn, discard=is_broken_async_session(exc))
+            raise
+        await self.release(conn)
+        return refused
+
+    def health(self) -> dict:
+        """Snapshot for the health endpoints; unhealthy after repeated connect failures."""
+        return {
+            "healthy": not self._closed and self.consecutive_failures < self.unhealthy_after,
+            "relay": self.relay,
+            "idle_connections": len(self._idle),
+            "connections_opened": self.connections_opened,
+            "reconnects": self.reconnects,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+    async def close(self) -> None:
+        """Close every idle session; borrowed ones are closed on release."""
+        self._closed = True
+        idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            await conn.close()
+
+
+_async_smtp_pool: Optional[Union[AsyncSMTPConnectionPool, AsyncSMTPRelayRouter]] = None
+
+
+def build_async_smtp_pool(host: str, port: Union[str, int]) -> AsyncSMTPConnectionPool:
+    """An async SMTP pool to one relay, configured from the email settings."""
+    return AsyncSMTPConnectionPool(
+        host=host,
+        port=port,
+        username=EMAIL_HOST_USER,
+        password=EMAIL_HOST_PASSWORD,
+        use_ssl=EMAIL_USE_SSL,
+        size=SMTP_ASYNC_POOL_SIZE,
+        idle_timeout=SMTP_POOL_IDLE_TIMEOUT,
+        max_messages=SMTP_POOL_MAX_MESSAGES,
+        health_check_after=SMTP_POOL_HEALTH_CHECK_AFTER,
+        acquire_timeout=SMTP_POOL_ACQUIRE_TIMEOUT,
+        timeout=SMTP_TIMEOUT,
+        unhealthy_after=SMTP_POOL_UNHEALTHY_AFTER,
+        rate_limiter=get_rate_limiter(),
+    )
+
+
+def get_async_smtp_pool() -> Union[AsyncSMTPConnectionPool, AsyncSMTPRelayRouter]:
+    """Return the event loop's SMTP pool (a router with SMTP_RELAYS) built from the email settings."""
+    global _async_smtp_pool
+    if _async_smtp_pool is None or _async_smtp_pool._closed:
+        if SMTP_RELAYS:
+            relays = parse_relays(SMTP_RELAYS, EMAIL_PORT)
+            _async_smtp_pool = AsyncSMTPRelayRouter(
+                [build_async_smtp_pool(relay.host, relay.port) for relay in relays],
+                [relay.weight for relay in relays],
+            )
+        else:
+            _async_smtp_pool = build_async_smtp_pool(EMAIL_HOST, EMAIL_PORT)
+    return _async_smtp_pool
@@ -1,7 +1,63 @@
-from decouple import config
+from decouple import Csv, config
 
 
 EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 EMAIL_HOST = config("EMAIL_HOST")
-EMAIL_PORT = config("EMAIL_PORT")
\ No newline at end of file
+EMAIL_PORT = config("EMAIL_PORT")
+EMAIL_USE_SSL = config("EMAIL_USE_SSL", default=True, cast=bool)
+
+# SMTP connection pool
+SMTP_TIMEOUT = config("SMTP_TIMEOUT", default=30, cast=float)
+SMTP_POOL_SIZE = config("SMTP_POOL_SIZE", default=4, cast=int)
+SMTP_POOL_IDLE_TIMEOUT = config("SMTP_POOL_IDLE_TIMEOUT", default=60, cast=float)
+SMTP_POOL_MAX_MESSAGES = config("SMTP_POOL_MAX_MESSAGES", default=100, cast=int)
+SMTP_POOL_HEALTH_CHECK_AFTER = config("SMTP_POOL_HEALTH_CHECK_AFTER", default=5, cast=float)
+SMTP_POOL_ACQUIRE_TIMEOUT = config("SMTP_POOL_ACQUIRE_TIMEOUT", default=30, cast=float)
+
+# SMTP sessions each pool opens at startup, before the first message
+SMTP_POOL_PREWARM = config("SMTP_POOL_PREWARM", default=2, cast=int)
+
+# Compiled template cache: seconds between mtime checks (0 = check every render)
+TEMPLATE_CHECK_INTERVAL = config("TEMPLATE_CHECK_INTERVAL", default=2, cast=float)
+
+# SMTP sessions kept by the asyncio consumer's pool
+SMTP_ASYNC_POOL_SIZE = config("SMTP_ASYNC_POOL_SIZE", default=20, cast=int)
+
+# Consecutive connect/login failures after which a pool reports itself unhealthy
+SMTP_POOL_UNHEALTHY_AFTER = config("SMTP_POOL_UNHEALTHY_AFTER", default=3, cast=int)
+
+# Token-bucket rate limits in messages/second (0 = unlimited) and bucket sizes,
+# per SMTP relay and per recipient domain; SMTP_DOMAIN_RATE_LIMITS overrides
+# single domains as "gmail.com=20:40,hospital.org=2"
+SMTP_RELAY_RATE = config("SMTP_RELAY_RATE", default=0, cast=float)
+SMTP_RELAY_BURST = config("SMTP_RELAY_BURST", default=20, cast=int)
+SMTP_DOMAIN_RATE = config("SMTP_DOMAIN_RATE", default=0, cast=float)
+SMTP_DOMAIN_BURST = config("SMTP_DOMAIN_BURST", default=10, cast=int)
+SMTP_DOMAIN_RATE_LIMITS = config("SMTP_DOMAIN_RATE_LIMITS", default="", cast=Csv())
+
+# Adaptive throttling on 4xx replies: an unlimited relay/domain drops to
+# START_RATE * DECREASE on its first 4xx, every 4xx multiplies the rate by
+# DECREASE (down to MIN_RATE) and every success adds RECOVERY back
+SMTP_THROTTLE_START_RATE = config("SMTP_THROTTLE_START_RATE", default=10, cast=float)
+SMTP_THROTTLE_DECREASE = config("SMTP_THROTTLE_DECREASE", default=0.5, cast=float)
+SMTP_THROTTLE_MIN_RATE = config("SMTP_THROTTLE_MIN_RATE", default=0.2, cast=float)
+SMTP_THROTTLE_RECOVERY = config("SMTP_THROTTLE_RECOVERY", default=0.1, cast=float)
+
+# Longest a send waits for its rate limit before it is retried later instead
+SMTP_RATE_LIMIT_MAX_WAIT = config("SMTP_RATE_LIMIT_MAX_WAIT", default=10, cast=float)
+
+# Several SMTP relays as "host[:port][=weight]" entries, e.g.
+# "smtp1.example.com:465=2,smtp2.example.com" (empty = EMAIL_HOST alone).
+# Sends go to the relay with the lowest expected wait (smoothed latency x
+# in-flight sends / weight). SMTP_RELAY_BREAKER_FAILURES consecutive
+# failures take a relay out for SMTP_RELAY_BREAKER_COOLDOWN seconds, after
+# which one send probes it again; every failed probe doubles the cooldown
+# up to SMTP_RELAY_BREAKER_MAX_COOLDOWN. SMTP_RELAY_EXPLORE_RATE of the
+# sends go to a random healthy relay, so a recovered relay's latency is seen.
+SMTP_RELAYS = config("SMTP_RELAYS", default="", cast=Csv())
+SMTP_RELAY_LATENCY_SMOOTHING = config("SMTP_RELAY_LATENCY_SMOOTHING", default=0.2, cast=float)
+SMTP_RELAY_BREAKER_FAILURES = config("SMTP_RELAY_BREAKER_FAILURES", default=3, cast=int)
+SMTP_RELAY_BREAKER_COOLDOWN = config("SMTP_RELAY_BREAKER_COOLDOWN", default=15, cast=float)
+SMTP_RELAY_BREAKER_MAX_COOLDOWN = config("SMTP_RELAY_BREAKER_MAX_COOLDOWN", default=300, cast=float)
+SMTP_RELAY_EXPLORE_RATE = config("SMTP_RELAY_EXPLORE_RATE", default=0.05, cast=float)
@@ -1,15 +1,73 @@
-from cryptography.fernet import Fernet
-from decouple import config
+import base64
+import time
+from typing import Iterable, Optional, Union
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from decouple import Csv, config
 
 # Load encryption key from .env (must be 32 url-safe base64 bytes)
 FERNET_KEY = config("OTP_FERNET_KEY").encode()
-fernet = Fernet(FERNET_KEY)
+# Keys being rotated out, newest first; tokens made with them still decrypt
+FERNET_PREVIOUS_KEYS = [
+    key.encode() for key in config("OTP_FERNET_PREVIOUS_KEYS", default="", cast=Csv())
+]
+
+
+class ExpiredToken(InvalidToken):
+    """Raised when a token is older than the TTL it is checked against."""
+
+
+def build_keyring(current_key: bytes, previous_keys: Iterable[bytes] = ()) -> MultiFernet:
+    """Encrypt with `current_key`; decrypt with it or any of `previous_keys`."""
+    return MultiFernet([Fernet(current_key), *(Fernet(key) for key in previous_keys)])
+
+
+fernet = build_keyring(FERNET_KEY, FERNET_PREVIOUS_KEYS)
+
+
+def token_timestamp(token: Union[str, bytes]) -> int:
+    """
+    Creation time embedded in a Fernet token, read without verifying it.
+
+    Only the first 12 base64 characters (version byte + 64-bit timestamp)
+    are decoded, so checking freshness costs nothing next to the HMAC.
+    """
+    if isinstance(token, str):
+        token = token.encode()
+    try:
+        header = base64.urlsafe_b64decode(token[:12])
+    except (ValueError, TypeError):
+        raise InvalidToken from None
+    if len(header) < 9:
+        raise InvalidToken
+    return int.from_bytes(header[1:9], "big")
+
 
 def encrypt_data(data: str) -> str:
     """Encrypt sensitive data like OTP before sending through MQ."""
     return fernet.encrypt(data.encode()).decode()
 
-def decrypt_data(encrypted_data: str) -> str:
+
+def decrypt_bytes(
+    token: Union[str, bytes],
+    ttl: Optional[int] = None,
+    keyring: MultiFernet = fernet,
+) -> bytes:
+    """
+    Decrypt a token as it came off the wire, without str/bytes round trips.
+
+    With `ttl`, tokens older than `ttl` seconds raise `ExpiredToken` before
+    any HMAC or AES work is spent on them.
+    """
+    if ttl is not None and time.time() - token_timestamp(token) > ttl:
+        raise ExpiredToken
+    return keyring.decrypt(token)
+
+
+def decrypt_data(encrypted_data: str, ttl: Optional[int] = None) -> str:
     """Decrypt data when consuming from MQ."""
-    return fernet.decrypt(encrypted_data.encode()).decode()
+    return decrypt_bytes(encrypted_data, ttl=ttl).decode()
+
 
+def rotate_token(token: Union[str, bytes]) -> str:
+    """Re-encrypt a token made with a previous key under the current key."""
+    return fernet.rotate(token).decode()
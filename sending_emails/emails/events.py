@@ -0,0 +1,193 @@
+"""Registry of email events consumed from RabbitMQ"""
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Mapping, NamedTuple, Optional, Tuple
+from cryptography.fernet import InvalidToken
+from pydantic import validate_model
+from sending_emails.core.metrics import observe_stage
+from sending_emails.emails.encryption_utils import ExpiredToken, decrypt_data
+from sending_emails.emails.helpers import OutgoingEmail
+from sending_emails.emails.payloads import build_payload_schema, describe_validation_error
+from sending_emails.emails.template_engine import get_template
+
+
+class InvalidEmailPayload(ValueError):
+    """Raised when a message can never be turned into an email."""
+
+
+class UnknownEmailEvent(InvalidEmailPayload):
+    """Raised for events that have no registered handler."""
+
+
+class ExpiredEmailPayload(InvalidEmailPayload):
+    """Raised when a secret (e.g. an OTP) is older than its event allows."""
+
+
+class RetryPolicy(NamedTuple):
+    """How often, and after which delays (seconds), a failed send is retried."""
+
+    max_retries: int
+    delays: Tuple[int, ...]
+
+    def delay_for(self, attempt: int) -> Optional[int]:
+        """Delay before retry number `attempt` (1-based), or None once retries are used up."""
+        if attempt > self.max_retries or not self.delays:
+            return None
+        return self.delays[min(attempt, len(self.delays)) - 1]
+
+
+class EmailEvent:
+    """
+    Everything needed to turn one event's `data` into an email.
+
+    All per-event metadata (template path, copied and secret fields, static
+    replacements, the pydantic schema of `data`) is resolved once when the
+    event is declared, so handling a message is a dict lookup, one schema
+    check and the render itself.
+    """
+
+    __slots__ = (
+        "name",
+        "template_path",
+        "subject",
+        "fields",
+        "secret_fields",
+        "required_fields",
+        "recipient_field",
+        "static_replacements",
+        "enrich",
+        "secret_ttl",
+        "retry_policy",
+        "priority",
+        "schema",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        template_path: str,
+        subject: Callable[[Dict[str, Any]], str],
+        fields: Iterable[str] = (),
+        secret_fields: Iterable[str] = (),
+        required_fields: Iterable[str] = ("user_email",),
+        recipient_field: str = "user_email",
+        static_replacements: Optional[Mapping[str, str]] = None,
+        enrich: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        secret_ttl: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        priority: int = 0,
+    ):
+        self.name = name
+        self.template_path = template_path
+        self.subject = subject
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self.secret_fields: Tuple[str, ...] = tuple(secret_fields)
+        self.required_fields: Tuple[str, ...] = tuple(
+            dict.fromkeys((*required_fields, *self.secret_fields))
+        )
+        self.recipient_field = recipient_field
+        self.static_replacements: Dict[str, str] = dict(static_replacements or {})
+        self.enrich = enrich
+        self.secret_ttl = secret_ttl
+        # None: the consumer's default policy (RETRY_MAX_RETRIES / RETRY_DELAYS)
+        self.retry_policy = retry_policy
+        # AMQP priority 0-9; high enough and the event travels in the priority lane
+        self.priority = priority
+        self.schema = build_payload_schema(
+            name, self.fields, self.required_fields, self.secret_fields, recipient_field
+        )
+
+    def validate(self, data: Any) -> Dict[str, Any]:
+        """Check the payload against the declared schema before any crypto or SMTP work."""
+        if not isinstance(data, dict):
+            raise InvalidEmailPayload(f"{self.name}: data must be an object")
+        # validate_model skips building (and re-dumping) a model instance
+        values, _, error = validate_model(self.schema, data)
+        if error is not None:
+            raise InvalidEmailPayload(f"{self.name}: {describe_validation_error(error)}")
+        return values
+
+    def build_replacements(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Template replacements: static values, copied fields, decrypted secrets."""
+        replacements = dict(self.static_replacements)
+        replacements["current_year"] = str(datetime.now().year)
+        for field in self.fields:
+            replacements[field] = data.get(field)
+        for field in self.secret_fields:
+            try:
+                with observe_stage("decrypt", self.name):
+                    replacements[field] = decrypt_data(encrypted_data=data[field], ttl=self.secret_ttl)
+            except ExpiredToken:
+                raise ExpiredEmailPayload(f"{self.name}: {field} expired") from None
+            except InvalidToken:
+                raise InvalidEmailPayload(f"{self.name}: {field} cannot be decrypted") from None
+        if self.enrich is not None:
+            replacements.update(self.enrich(data))
+        return replacements
+
+    def build(self, data: Any) -> OutgoingEmail:
+        """Validate `data`, render the template and return the email to send."""
+        data = self.validate(data)
+        replacements = self.build_replacements(data)
+        subject = self.subject(replacements)
+        if "\r" in subject or "\n" in subject:
+            # A line break in a header would let the payload inject headers
+            raise InvalidEmailPayload(f"{self.name} subject must be a single line")
+        template = get_template(self.template_path)
+        with observe_stage("render", self.name):
+            html_content = template.render(replacements)
+            text_content = template.text.render(replacements)
+        return OutgoingEmail(subject, data.get(self.recipient_field), html_content, text_content)
+
+
+class EmailEventRegistry:
+    """O(1) lookup from event name to its `EmailEvent`."""
+
+    def __init__(self):
+        self._events: Dict[str, EmailEvent] = {}
+
+    def register(self, event: EmailEvent) -> EmailEvent:
+        if event.name in self._events:
+            raise ValueError(f"Email event already registered: {event.name}")
+        self._events[event.name] = event
+        return event
+
+    def get(self, name: Optional[str]) -> Optional[EmailEvent]:
+        return self._events.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._events
+
+    def __iter__(self):
+        return iter(self._events.values())
+
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self._events)
+
+
+email_events = EmailEventRegistry()
+
+
+def register_email_event(event: EmailEvent) -> EmailEvent:
+    """Declare a new event type; the consumers pick it up without changes."""
+    return email_events.register(event)
+
+
+def get_email_event(name: Optional[str]) -> Optional[EmailEvent]:
+    """Return the registered event called `name`, or None for unknown events."""
+    return email_events.get(name)
+
+
+def resolve_email(user_payload: Any) -> Tuple[EmailEvent, OutgoingEmail]:
+    """
+    Map a decoded `{event, data}` message to its event and rendered email.
+
+    Raises `UnknownEmailEvent` or `InvalidEmailPayload` for messages that
+    should be rejected rather than retried.
+    """
+    if not isinstance(user_payload, dict):
+        raise InvalidEmailPayload("message must be an object")
+    event = user_payload.get("event")
+    email_event = email_events.get(event)
+    if email_event is None:
+        raise UnknownEmailEvent(f"Received invalid event: {event}")
+    return email_event, email_event.build(user_payload.get("data"))
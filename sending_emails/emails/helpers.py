@@ -1,21 +1,26 @@
 import os
-import ssl
-import smtplib
-from typing import Optional, Dict
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from sending_emails.emails.config import (
-    EMAIL_HOST_USER,
-    EMAIL_HOST_PASSWORD,
-    EMAIL_HOST,
-    EMAIL_PORT
-)
+from typing import Dict, List, NamedTuple, Optional, Sequence
+from sending_emails.emails.config import EMAIL_HOST_USER
+from sending_emails.emails.mime import build_mime_message
+from sending_emails.emails.smtp_pool import SMTPConnectionPool, get_smtp_pool
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool, get_async_smtp_pool
+from sending_emails.emails.template_engine import get_template
 import logging
 logger = logging.getLogger("ai_call_assistant_service_logger")
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+class OutgoingEmail(NamedTuple):
+    """A rendered email ready to hand to SMTP."""
+
+    subject: str
+    recipient: str
+    html_content: str
+    # Plain-text alternative; derived from the HTML when not given
+    text_content: Optional[str] = None
+
+
 def safe_replace(content: str, tag: str, value: Optional[str], default="N/A") -> str:
     """Safely replace a tag with value (or default if None)."""
     return content.replace(tag, str(value) if value else default)
@@ -31,33 +36,107 @@ def read_template(template_path: str) -> str:
 
 
 def render_template(template_path: str, replacements: Dict[str, str]) -> str:
-    """Render template by replacing placeholders with actual values."""
-    html = read_template(template_path)
-    for key, value in replacements.items():
-        html = safe_replace(html, f"[{key}]", value)
-    return html
+    """Render the cached, precompiled template in a single pass."""
+    return get_template(template_path).render(replacements)
 
 
-def send_email(subject: str, recipient: str, html_content: str) -> bool:
-    """Send an HTML email using SMTP over SSL."""
+def deliver_email(
+    subject: str,
+    recipient: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+    pool: Optional[SMTPConnectionPool] = None,
+) -> None:
+    """Send an HTML email over a pooled SMTP session, raising whatever SMTP raised."""
     sender_email = EMAIL_HOST_USER
+    message = build_mime_message(subject, sender_email, recipient, html_content, text_content)
+    (pool or get_smtp_pool()).sendmail(sender_email, recipient, message)
+    logger.info(f"✅ Email sent successfully to {recipient}")
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = sender_email
-    msg["To"] = recipient
 
-    part = MIMEText(html_content, "html")
-    msg.attach(part)
-
-    context = ssl.create_default_context()
+def send_email(
+    subject: str,
+    recipient: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+    pool: Optional[SMTPConnectionPool] = None,
+) -> bool:
+    """Send an HTML email over a pooled, already authenticated SMTP session."""
     try:
-        with smtplib.SMTP_SSL(EMAIL_HOST, EMAIL_PORT, context=context) as server:
-            server.login(sender_email, EMAIL_HOST_PASSWORD)
-            server.sendmail(sender_email, recipient, msg.as_string())
-        logger.info(f"✅ Email sent successfully to {recipient}")
+        deliver_email(subject, recipient, html_content, text_content, pool=pool)
         return True
     except Exception as e:
         logger.error(f"❌ Failed to send email: {e}")
         return False
 
+
+def deliver_emails(
+    emails: Sequence[OutgoingEmail],
+    pool: Optional[SMTPConnectionPool] = None,
+) -> List[Optional[Exception]]:
+    """Send several emails in one SMTP session; None or the exception, per email."""
+    sender_email = EMAIL_HOST_USER
+    errors: List[Optional[Exception]] = [None] * len(emails)
+    messages = []
+    for index, email in enumerate(emails):
+        try:
+            message = build_mime_message(
+                email.subject, sender_email, email.recipient, email.html_content, email.text_content
+            )
+        except Exception as e:
+            # Only this email fails; the rest of the batch still goes out
+            errors[index] = e
+            continue
+        messages.append((index, (email.recipient, message)))
+    if messages:
+        try:
+            sent = (pool or get_smtp_pool()).send_many(sender_email, [message for _, message in messages])
+        except Exception as e:
+            logger.error(f"❌ Failed to send {len(messages)} emails: {e}")
+            sent = [e] * len(messages)
+        for (index, _), error in zip(messages, sent):
+            errors[index] = error
+    for email, error in zip(emails, errors):
+        if error is None:
+            logger.info(f"✅ Email sent successfully to {email.recipient}")
+        else:
+            logger.error(f"❌ Failed to send email to {email.recipient}: {error}")
+    return errors
+
+
+def send_emails(
+    emails: Sequence[OutgoingEmail],
+    pool: Optional[SMTPConnectionPool] = None,
+) -> List[bool]:
+    """Send several emails in one authenticated SMTP session; one result per email."""
+    return [error is None for error in deliver_emails(emails, pool=pool)]
+
+
+async def deliver_email_async(
+    subject: str,
+    recipient: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+    pool: Optional[AsyncSMTPConnectionPool] = None,
+) -> None:
+    """Send an HTML email from the event loop, raising whatever SMTP raised."""
+    sender_email = EMAIL_HOST_USER
+    message = build_mime_message(subject, sender_email, recipient, html_content, text_content)
+    await (pool or get_async_smtp_pool()).sendmail(sender_email, recipient, message)
+    logger.info(f"✅ Email sent successfully to {recipient}")
+
+
+async def send_email_async(
+    subject: str,
+    recipient: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+    pool: Optional[AsyncSMTPConnectionPool] = None,
+) -> bool:
+    """Send an HTML email from the event loop over a pooled aiosmtplib session."""
+    try:
+        await deliver_email_async(subject, recipient, html_content, text_content, pool=pool)
+        return True
+    except Exception as e:
+        logger.error(f"❌ Failed to send email: {e}")
+        return False
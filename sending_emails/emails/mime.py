@@ -0,0 +1,148 @@
+"""Byte-level assembly of multipart/alternative emails from cached skeletons"""
+import re
+import base64
+import threading
+from email.header import Header
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+CRLF = b"\r\n"
+# Tags whose end starts a new line of plain text
+BLOCK_TAGS = frozenset(
+    ("p", "div", "tr", "table", "h1", "h2", "h3", "h4", "h5", "h6", "li", "ul", "ol", "hr", "blockquote")
+)
+SKIPPED_TAGS = frozenset(("head", "style", "script", "title"))
+_BLANK_LINES = re.compile(r"\n{3,}")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skipping = 0
+        self._links: List[Optional[str]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag == "br":
+            self.chunks.append("\n")
+        elif tag == "td":
+            self.chunks.append(" ")
+        elif tag == "a":
+            href = dict(attrs).get("href") or ""
+            self._links.append(href if href.startswith(("http:", "https:", "[")) else None)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.chunks.append("\n\n" if tag in ("p", "h1", "h2", "h3", "h4", "h5", "h6", "table") else "\n")
+        elif tag == "a" and self._links:
+            href = self._links.pop()
+            if href:
+                self.chunks.append(f" ({href})")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.chunks.append(data)
+
+
+def html_to_text(markup: str) -> str:
+    """Readable plain text of an HTML email: no markup, one block per line, links kept."""
+    extractor = _TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    lines = (_SPACES.sub(" ", line).strip() for line in "".join(extractor.chunks).split("\n"))
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip() + "\n"
+
+
+def encode_header(name: str, value: str) -> bytes:
+    """One `Name: value` header line, RFC 2047-encoded and folded only when needed."""
+    if "\r" in value or "\n" in value:
+        raise ValueError(f"{name} header must be a single line")
+    if value.isascii() and len(name) + len(value) < 77:
+        return f"{name}: {value}\r\n".encode("ascii")
+    charset = "us-ascii" if value.isascii() else "utf-8"
+    encoded = Header(value, charset, header_name=name).encode(linesep="\r\n")
+    return f"{name}: {encoded}\r\n".encode("ascii")
+
+
+def encode_body(content: str) -> bytes:
+    """UTF-8, base64 body in 76-character CRLF lines."""
+    return base64.encodebytes(content.encode("utf-8")).replace(b"\n", CRLF)
+
+
+class MessageSkeleton:
+    """
+    The constant bytes of every message from one sender.
+
+    The multipart headers, the part headers and the closing delimiter are
+    serialized once; a message is then its Subject and To lines plus the
+    two base64 bodies joined in between. The boundary starts with `=_`,
+    which can occur neither in base64 nor in quoted-printable text, so it
+    never needs checking against the content.
+    """
+
+    __slots__ = ("boundary", "head", "text_head", "html_head", "tail")
+
+    def __init__(self, sender: str, boundary: Optional[str] = None):
+        self.boundary = boundary or f"=_{uuid4().hex}"
+        delimiter = f"--{self.boundary}\r\n".encode("ascii")
+        self.head = (
+            f'Content-Type: multipart/alternative;\r\n boundary="{self.boundary}"\r\n'.encode("ascii")
+            + b"MIME-Version: 1.0\r\n"
+            + encode_header("From", sender)
+        )
+        part_head = 'Content-Type: text/{}; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        # The blank line ending the message headers, then the first part
+        self.text_head = CRLF + delimiter + part_head.format("plain").encode("ascii")
+        self.html_head = delimiter + part_head.format("html").encode("ascii")
+        self.tail = f"--{self.boundary}--\r\n".encode("ascii")
+
+    def build(self, subject: str, recipient: str, html_content: str, text_content: str) -> bytes:
+        return b"".join(
+            (
+                self.head,
+                encode_header("Subject", subject),
+                encode_header("To", recipient),
+                self.text_head,
+                encode_body(text_content),
+                self.html_head,
+                encode_body(html_content),
+                self.tail,
+            )
+        )
+
+
+_skeletons: Dict[str, MessageSkeleton] = {}
+_skeletons_lock = threading.Lock()
+
+
+def get_skeleton(sender: str) -> MessageSkeleton:
+    """Return the cached skeleton for `sender`."""
+    skeleton = _skeletons.get(sender)
+    if skeleton is None:
+        with _skeletons_lock:
+            skeleton = _skeletons.setdefault(sender, MessageSkeleton(sender))
+    return skeleton
+
+
+def build_mime_message(
+    subject: str,
+    sender: str,
+    recipient: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+) -> bytes:
+    """
+    Serialize an email with plain-text and HTML alternatives into the wire format handed to SMTP.
+
+    Without `text_content` the plain text is derived from the HTML; the
+    email events pass the one precompiled from their template instead.
+    """
+    if text_content is None:
+        text_content = html_to_text(html_content)
+    return get_skeleton(sender).build(subject, recipient, html_content, text_content)
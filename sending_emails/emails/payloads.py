@@ -0,0 +1,79 @@
+"""Fast decoding of queue bodies and precompiled per-event payload schemas"""
+import json
+from typing import Any, Dict, Iterable, Optional, Type
+from pydantic import BaseModel, Extra, ValidationError, constr, create_model
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library decoder is used instead
+    orjson = None
+
+RECIPIENT_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+# Fernet tokens are urlsafe base64 of at least 73 bytes
+SECRET_PATTERN = r"^[A-Za-z0-9_-]{96,}={0,2}$"
+
+RequiredText = constr(strip_whitespace=True, min_length=1)
+Recipient = constr(strip_whitespace=True, regex=RECIPIENT_PATTERN)
+Secret = constr(strip_whitespace=True, regex=SECRET_PATTERN)
+
+
+def decode_payload(body: bytes) -> Any:
+    """Parse a message body straight from bytes; raises ValueError on malformed JSON."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def encode_payload(payload: Any) -> bytes:
+    """Serialize a message body straight to bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class _PayloadModel(BaseModel):
+    class Config:
+        # Extra keys are passed through for `enrich` hooks
+        extra = Extra.allow
+        anystr_strip_whitespace = True
+
+
+def build_payload_schema(
+    name: str,
+    fields: Iterable[str],
+    required_fields: Iterable[str],
+    secret_fields: Iterable[str],
+    recipient_field: str,
+) -> Type[BaseModel]:
+    """
+    Compile the pydantic model of one event's `data`.
+
+    Required fields must be non-empty text, the recipient a plausible
+    address and secrets Fernet-shaped, so broken payloads are rejected
+    before any decryption or SMTP work. Other declared fields are optional text.
+    """
+    required = set(required_fields)
+    secrets = set(secret_fields)
+    definitions: Dict[str, Any] = {}
+    for field in (*fields, *required, *secrets, recipient_field):
+        if field in definitions:
+            continue
+        if field in secrets:
+            field_type = Secret
+        elif field == recipient_field:
+            field_type = Recipient
+        elif field in required:
+            field_type = RequiredText
+        else:
+            field_type = str
+        definitions[field] = (field_type, ...) if field in required or field in secrets else (Optional[field_type], None)
+    return create_model(f"{name}_payload", __base__=_PayloadModel, **definitions)
+
+
+def describe_validation_error(error: ValidationError) -> str:
+    """One-line summary of a schema failure, without echoing any values."""
+    problems = []
+    for detail in error.errors():
+        field = ".".join(str(part) for part in detail["loc"])
+        problems.append(f"missing {field}" if detail["type"] == "value_error.missing" else f"invalid {field}")
+    return ", ".join(problems)
@@ -0,0 +1,254 @@
+"""Token-bucket rate limits per recipient domain and per SMTP relay, adapted to 4xx throttling"""
+import time
+import asyncio
+import smtplib
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import aiosmtplib
+from sending_emails.core.metrics import Counter, record_stage
+from sending_emails.emails.config import (
+    SMTP_RELAY_RATE,
+    SMTP_RELAY_BURST,
+    SMTP_DOMAIN_RATE,
+    SMTP_DOMAIN_BURST,
+    SMTP_DOMAIN_RATE_LIMITS,
+    SMTP_THROTTLE_START_RATE,
+    SMTP_THROTTLE_DECREASE,
+    SMTP_THROTTLE_MIN_RATE,
+    SMTP_THROTTLE_RECOVERY,
+    SMTP_RATE_LIMIT_MAX_WAIT,
+)
+
+logger = logging.getLogger("ai_call_assistant_service_logger")
+
+SMTP_THROTTLED = Counter(
+    "email_smtp_throttled_total",
+    "4xx replies that slowed down a relay or recipient domain, by scope (relay, domain)",
+    ("scope",),
+)
+
+
+class SMTPRateLimited(smtplib.SMTPException):
+    """Raised when a send would have to wait longer than the limiter's `max_wait`."""
+
+
+def smtp_reply_codes(exc: BaseException) -> List[int]:
+    """SMTP reply codes carried by an smtplib or aiosmtplib exception (empty if none)."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return [code for code, _ in exc.recipients.values()]
+    if isinstance(exc, aiosmtplib.SMTPRecipientsRefused):
+        return [refused.code for refused in exc.recipients]
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return [exc.smtp_code]
+    if isinstance(exc, aiosmtplib.SMTPResponseException):
+        return [exc.code]
+    return []
+
+
+def parse_domain_limits(entries: Iterable[str]) -> Dict[str, Tuple[float, int]]:
+    """Parse `domain=rate[:burst]` entries, e.g. `gmail.com=20:40`, into `{domain: (rate, burst)}`."""
+    limits = {}
+    for entry in entries:
+        domain, _, limit = entry.strip().partition("=")
+        if not domain or not limit:
+            raise ValueError(f"Invalid SMTP domain rate limit {entry!r}, expected domain=rate[:burst]")
+        rate, _, burst = limit.partition(":")
+        limits[domain.lower()] = (float(rate), int(burst) if burst else SMTP_DOMAIN_BURST)
+    return limits
+
+
+def recipient_domains(to_addrs: Union[str, Sequence[str]]) -> List[str]:
+    addresses = [to_addrs] if isinstance(to_addrs, str) else to_addrs
+    return list(dict.fromkeys(address.rpartition("@")[2].strip(" >").lower() for address in addresses))
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to throttling (AIMD).
+
+    `limit` is the configured rate in messages per second, 0 for none. A
+    throttle reply multiplies the current rate by `decrease` (an unlimited
+    bucket starts from `start_rate`) and empties the bucket; every success
+    adds `recovery` back until the configured rate, or unlimited, is
+    reached again. Tokens may go negative: each one is a send already
+    promised a slot further in the future.
+    """
+
+    def __init__(
+        self,
+        limit: float,
+        burst: int,
+        start_rate: float,
+        decrease: float,
+        min_rate: float,
+        recovery: float,
+        now: float,
+    ):
+        self.limit = limit
+        self.burst = max(1, burst)
+        self.start_rate = start_rate
+        self.decrease = decrease
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.rate: Optional[float] = limit or None
+        self.tokens = float(self.burst)
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        if self.rate is None or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate is not None:
+            self.tokens -= 1
+
+    def throttled(self, now: float) -> None:
+        self._refill(now)
+        self.rate = max(self.min_rate, (self.rate or self.start_rate) * self.decrease)
+        self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self, now: float) -> None:
+        if self.rate is None:
+            return
+        self._refill(now)
+        ceiling = self.limit or self.start_rate
+        self.rate = min(ceiling, self.rate + self.recovery)
+        if not self.limit and self.rate >= ceiling:
+            self.rate = None
+
+
+class SMTPRateLimiter:
+    """
+    Pace sends per SMTP relay and per recipient domain.
+
+    `reserve` books a token in the relay bucket and in the bucket of every
+    recipient domain, and returns how long the caller has to wait before
+    sending; a wait above `max_wait` raises `SMTPRateLimited` instead, so
+    the message goes to a retry queue rather than pinning a worker.
+
+    `record` feeds the outcome back: a 4xx to RCPT slows down the
+    recipient's domain, any other 4xx (MAIL, DATA, 421) also slows down
+    the relay, and successes let both recover.
+    """
+
+    def __init__(
+        self,
+        relay_rate: float = SMTP_RELAY_RATE,
+        relay_burst: int = SMTP_RELAY_BURST,
+        domain_rate: float = SMTP_DOMAIN_RATE,
+        domain_burst: int = SMTP_DOMAIN_BURST,
+        domain_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+        start_rate: float = SMTP_THROTTLE_START_RATE,
+        decrease: float = SMTP_THROTTLE_DECREASE,
+        min_rate: float = SMTP_THROTTLE_MIN_RATE,
+        recovery: float = SMTP_THROTTLE_RECOVERY,
+        max_wait: float = SMTP_RATE_LIMIT_MAX_WAIT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.relay_limit = (relay_rate, relay_burst)
+        self.domain_limit = (domain_rate, domain_burst)
+        self.domain_limits = dict(domain_limits or {})
+        self.start_rate = start_rate
+        self.decrease = decrease
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.max_wait = max_wait
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def _bucket(self, scope: str, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            if scope == "relay":
+                limit, burst = self.relay_limit
+            else:
+                limit, burst = self.domain_limits.get(key, self.domain_limit)
+            bucket = self._buckets[(scope, key)] = TokenBucket(
+                limit, burst, self.start_rate, self.decrease, self.min_rate, self.recovery, now
+            )
+        return bucket
+
+    def _buckets_for(self, relay: str, to_addrs, now: float) -> List[TokenBucket]:
+        return [self._bucket("relay", relay, now)] + [
+            self._bucket("domain", domain, now) for domain in recipient_domains(to_addrs)
+        ]
+
+    def reserve(self, relay: str, to_addrs: Union[str, Sequence[str]]) -> float:
+        """Book a send to `to_addrs` through `relay`; returns the seconds to wait first."""
+        with self._lock:
+            now = self.clock()
+            buckets = self._buckets_for(relay, to_addrs, now)
+            delay = max(bucket.delay(now) for bucket in buckets)
+            if delay > self.max_wait:
+                raise SMTPRateLimited(
+                    f"Rate limit for {relay} / {', '.join(recipient_domains(to_addrs))} "
+                    f"needs a {delay:.1f}s wait"
+                )
+            for bucket in buckets:
+                bucket.take()
+        return delay
+
+    def wait(self, relay: str, to_addrs: Union[str, Sequence[str]]) -> None:
+        started = time.perf_counter()
+        delay = self.reserve(relay, to_addrs)
+        if delay:
+            time.sleep(delay)
+            record_stage("smtp_throttle", started)
+
+    async def wait_async(self, relay: str, to_addrs: Union[str, Sequence[str]]) -> None:
+        started = time.perf_counter()
+        delay = self.reserve(relay, to_addrs)
+        if delay:
+            await asyncio.sleep(delay)
+            record_stage("smtp_throttle", started)
+
+    def record(self, relay: str, to_addrs: Union[str, Sequence[str]], error: Optional[BaseException] = None) -> None:
+        """Adapt the relay and domain rates to the outcome of a send."""
+        throttled = error is not None and any(400 <= code < 500 for code in smtp_reply_codes(error))
+        if error is not None and not throttled:
+            return
+        with self._lock:
+            now = self.clock()
+            domains = [self._bucket("domain", domain, now) for domain in recipient_domains(to_addrs)]
+            relay_bucket = self._bucket("relay", relay, now)
+            if not throttled:
+                for bucket in [relay_bucket, *domains]:
+                    bucket.succeeded(now)
+                return
+            slowed = domains
+            SMTP_THROTTLED.inc(("domain",), len(domains))
+            if not isinstance(error, (smtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientsRefused)):
+                slowed = [relay_bucket, *domains]
+                SMTP_THROTTLED.inc(("relay",))
+            for bucket in slowed:
+                bucket.throttled(now)
+        logger.warning(f"SMTP throttled by {relay} for {', '.join(recipient_domains(to_addrs))}: {error}")
+
+    def rates(self) -> Dict[str, Optional[float]]:
+        """Current rate per `scope:key` (None while unlimited)."""
+        with self._lock:
+            return {f"{scope}:{key}": bucket.rate for (scope, key), bucket in self._buckets.items()}
+
+
+_rate_limiter: Optional[SMTPRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> SMTPRateLimiter:
+    """Return the process-wide limiter built from the email settings."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = SMTPRateLimiter(domain_limits=parse_domain_limits(SMTP_DOMAIN_RATE_LIMITS))
+    return _rate_limiter
@@ -1,185 +1,144 @@
 import os
 from decouple import config
-from datetime import datetime
 from typing import Dict
 import logging
-from sending_emails.emails.encryption_utils import decrypt_data
-from .helpers import (
-    render_template,
-    send_email
+from .events import (
+    EmailEvent,
+    ExpiredEmailPayload,
+    InvalidEmailPayload,
+    RetryPolicy,
+    get_email_event,
+    register_email_event,
+    resolve_email,
 )
+from .helpers import send_email
 
 logger = logging.getLogger("ai_call_assistant_service_logger")
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 COMPANY_NAME = config("COMPANY_NAME")
 COMPANY_LOGO = config("COMPANY_LOGO")
+# OTPs older than this are dropped instead of mailed (0 = never expire)
+OTP_MAX_AGE_SECONDS = config("OTP_MAX_AGE_SECONDS", default=600, cast=int)
 
 TEMPLATE_FOLDER_PATH="sending_emails/emails/template"
 
+COMPANY_REPLACEMENTS = {
+    "company_name": COMPANY_NAME,
+    "company_logo_url": COMPANY_LOGO,
+}
+CREDENTIALS_FIELDS = (
+    "user_fullname",
+    "user_email",
+    "hospital_name",
+    "account_created",
+)
+ROLE_LABEL_MAP = {
+    "DOCTOR_ADMIN": "Doctor Administrator",
+    "DOCTOR_REVIEWER": "Doctor Reviewer",
+    "TECHNICIAN": "Technician"
+}
+
+
+# OTP verification email
+OTP_EMAIL = register_email_event(EmailEvent(
+    name="user_otp_request",
+    template_path=f"{TEMPLATE_FOLDER_PATH}/send_otp.html",
+    subject=lambda replacements: replacements["otp_reason"] or "OTP Verification",
+    fields=(
+        "user_fullname",
+        "otp_reason",
+        "otp_expiry_time",
+        "otp_request_at",
+        "new_otp_request_time",
+        "dynamic_info_1",
+        "dynamic_info_2",
+    ),
+    secret_fields=("otp",),
+    secret_ttl=OTP_MAX_AGE_SECONDS or None,
+    static_replacements=COMPANY_REPLACEMENTS,
+    # Retry fast and give up early: a late OTP is useless to the user
+    retry_policy=RetryPolicy(max_retries=3, delays=(5, 30)),
+    # OTPs expire: never queue them behind bulk credential emails
+    priority=9,
+))
+
+# Technician credentials email created by hospital admin
+TECHNICIAN_CREDENTIALS_EMAIL = register_email_event(EmailEvent(
+    name="technician_create_by_hospital_admin",
+    template_path=f"{TEMPLATE_FOLDER_PATH}/technician_credentials.html",
+    subject=lambda replacements: "Your Technician Account Credentials",
+    fields=CREDENTIALS_FIELDS,
+    secret_fields=("password",),
+    static_replacements=COMPANY_REPLACEMENTS,
+))
+
+# Doctor reviewer credentials email created by hospital admin
+DOCTOR_REVIEWER_CREDENTIALS_EMAIL = register_email_event(EmailEvent(
+    name="doctor_reviewer_create_by_hospital_admin",
+    template_path=f"{TEMPLATE_FOLDER_PATH}/doctor_reviewer_credentials.html",
+    subject=lambda replacements: "Your Doctor Account Credentials",
+    fields=CREDENTIALS_FIELDS,
+    secret_fields=("password",),
+    static_replacements=COMPANY_REPLACEMENTS,
+))
+
+# Doctor admin credentials email created by hospital admin
+DOCTOR_ADMIN_CREDENTIALS_EMAIL = register_email_event(EmailEvent(
+    name="doctor_admin_create_by_hospital_admin",
+    template_path=f"{TEMPLATE_FOLDER_PATH}/doctor_admin_credentials.html",
+    subject=lambda replacements: "Your Doctor Account Credentials",
+    fields=CREDENTIALS_FIELDS,
+    secret_fields=("password",),
+    static_replacements=COMPANY_REPLACEMENTS,
+))
+
+# Credentials updated by hospital admin notification email
+CREDENTIALS_UPDATED_EMAIL = register_email_event(EmailEvent(
+    name="user_credentials_updated_by_hospital_admin",
+    template_path=f"{TEMPLATE_FOLDER_PATH}/credentials_updated_by_admin.html",
+    subject=lambda replacements: f"Your {replacements['role']} Account Credentials",
+    fields=(
+        "user_fullname",
+        "user_email",
+        "hospital_name",
+        "access_from",
+        "credentials_updated_at",
+    ),
+    secret_fields=("password",),
+    static_replacements=COMPANY_REPLACEMENTS,
+    enrich=lambda data: {"role": ROLE_LABEL_MAP.get(data.get("role"), data.get("role"))},
+))
 
 
 def send_otp_email(data: Dict[str, str]) -> bool:
     """Send OTP verification email."""
-    template = f"{TEMPLATE_FOLDER_PATH}/send_otp.html"
-    current_year = str(datetime.now().year)
-
-    replacements = {
-        "user_fullname": data.get("user_fullname"),
-        "otp_reason": data.get("otp_reason"),
-        "otp": decrypt_data(encrypted_data=data.get("otp")),
-        "otp_expiry_time": data.get("otp_expiry_time"),
-        "otp_request_at": data.get("otp_request_at"),
-        "new_otp_request_time": data.get("new_otp_request_time"),
-        "current_year": current_year,
-        "company_name": COMPANY_NAME,
-        "company_logo_url": COMPANY_LOGO,
-        "dynamic_info_1": data.get("dynamic_info_1"),
-        "dynamic_info_2": data.get("dynamic_info_2")
-    }
-
-    html_content = render_template(template, replacements)
-    subject = data.get("otp_reason", "OTP Verification")
-    return send_email(subject, data.get("user_email"), html_content)
+    return send_email(*OTP_EMAIL.build(data))
 
 
 def send_technician_credentials_create_by_hospital_admin_email(
     data: Dict[str, str]
 ) -> bool:
-    """
-    Send technician credentials email created by hospital admin
-    """
-
-    template = f"{TEMPLATE_FOLDER_PATH}/technician_credentials.html"
-    current_year = str(datetime.now().year)
-
-    replacements = {
-        "user_fullname": data.get("user_fullname"),
-        "user_email": data.get("user_email"),
-        "hospital_name": data.get("hospital_name"),
-        "account_created": data.get("account_created"),
-        "password": decrypt_data(encrypted_data=data.get("password")),
-        "current_year": current_year,
-        "company_name": COMPANY_NAME,
-        "company_logo_url": COMPANY_LOGO,
-    }
-
-    html_content = render_template(template, replacements)
-
-    subject = "Your Technician Account Credentials"
-
-    return send_email(
-        subject=subject,
-        recipient=data.get("user_email"),
-        html_content=html_content
-    )
+    """Send technician credentials email created by hospital admin"""
+    return send_email(*TECHNICIAN_CREDENTIALS_EMAIL.build(data))
 
 
 def send_doctor_reviewer_credentials_create_by_hospital_admin_email(
     data: Dict[str, str]
 ) -> bool:
-    """
-    Send doctor credentials email created by hospital admin
-    """
-
-    template = f"{TEMPLATE_FOLDER_PATH}/doctor_reviewer_credentials.html"
-    current_year = str(datetime.now().year)
-
-    replacements = {
-        "user_fullname": data.get("user_fullname"),
-        "user_email": data.get("user_email"),
-        "hospital_name": data.get("hospital_name"),
-        "account_created": data.get("account_created"),
-        "password": decrypt_data(encrypted_data=data.get("password")),
-        "current_year": current_year,
-        "company_name": COMPANY_NAME,
-        "company_logo_url": COMPANY_LOGO,
-    }
-
-    html_content = render_template(template, replacements)
-
-    subject = "Your Doctor Account Credentials"
-
-    return send_email(
-        subject=subject,
-        recipient=data.get("user_email"),
-        html_content=html_content
-    )
-
-
+    """Send doctor reviewer credentials email created by hospital admin"""
+    return send_email(*DOCTOR_REVIEWER_CREDENTIALS_EMAIL.build(data))
 
 
 def send_doctor_admin_credentials_create_by_hospital_admin_email(
     data: Dict[str, str]
 ) -> bool:
-    """
-    Send doctor credentials email created by hospital admin
-    """
-
-    template = f"{TEMPLATE_FOLDER_PATH}/doctor_admin_credentials.html"
-    current_year = str(datetime.now().year)
-
-    replacements = {
-        "user_fullname": data.get("user_fullname"),
-        "user_email": data.get("user_email"),
-        "hospital_name": data.get("hospital_name"),
-        "account_created": data.get("account_created"),
-        "password": decrypt_data(encrypted_data=data.get("password")),
-        "current_year": current_year,
-        "company_name": COMPANY_NAME,
-        "company_logo_url": COMPANY_LOGO,
-    }
-
-    html_content = render_template(template, replacements)
-
-    subject = "Your Doctor Account Credentials"
-
-    return send_email(
-        subject=subject,
-        recipient=data.get("user_email"),
-        html_content=html_content
-    )
-
+    """Send doctor admin credentials email created by hospital admin"""
+    return send_email(*DOCTOR_ADMIN_CREDENTIALS_EMAIL.build(data))
 
 
 def notify_user_credentials_updated_by_hospital_admin_email(
     data: Dict[str, str]
 ) -> bool:
-    """
-    Send doctor credentials email created by hospital admin
-    """
-
-    template = f"{TEMPLATE_FOLDER_PATH}/credentials_updated_by_admin.html"
-    current_year = str(datetime.now().year)
-
-    ROLE_LABEL_MAP = {
-        "DOCTOR_ADMIN": "Doctor Administrator",
-        "DOCTOR_REVIEWER": "Doctor Reviewer",
-        "TECHNICIAN": "Technician"
-    }
-    user_role = ROLE_LABEL_MAP.get(data.get("role"), data.get("role"))
-
-    replacements = {
-        "user_fullname": data.get("user_fullname"),
-        "user_email": data.get("user_email"),
-        "hospital_name": data.get("hospital_name"),
-        "role": user_role,
-        "access_from": data.get("access_from"),
-        "credentials_updated_at": data.get("credentials_updated_at"),
-        "password": decrypt_data(encrypted_data=data.get("password")),
-        "current_year": current_year,
-        "company_name": COMPANY_NAME,
-        "company_logo_url": COMPANY_LOGO,
-    }
-
-    html_content = render_template(template, replacements)
-
-    subject = f"Your {user_role} Account Credentials"
-
-    return send_email(
-        subject=subject,
-        recipient=data.get("user_email"),
-        html_content=html_content
-    )
-
-
+    """Notify a user that the hospital admin updated their credentials"""
+    return send_email(*CREDENTIALS_UPDATED_EMAIL.build(data))
@@ -0,0 +1,399 @@
+"""Bounded pool of persistent, authenticated SMTP connections"""
+import ssl
+import time
+import smtplib
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from sending_emails.core.metrics import record_stage
+from sending_emails.emails.config import (
+    EMAIL_HOST_USER,
+    EMAIL_HOST_PASSWORD,
+    EMAIL_HOST,
+    EMAIL_PORT,
+    EMAIL_USE_SSL,
+    SMTP_TIMEOUT,
+    SMTP_POOL_SIZE,
+    SMTP_POOL_IDLE_TIMEOUT,
+    SMTP_POOL_MAX_MESSAGES,
+    SMTP_POOL_HEALTH_CHECK_AFTER,
+    SMTP_POOL_ACQUIRE_TIMEOUT,
+    SMTP_POOL_UNHEALTHY_AFTER,
+    SMTP_RELAYS,
+)
+from sending_emails.emails.rate_limit import SMTPRateLimiter, get_rate_limiter
+from sending_emails.emails.smtp_router import SMTPRelayRouter, parse_relays
+
+logger = logging.getLogger("ai_call_assistant_service_logger")
+
+
+class SMTPPoolExhausted(Exception):
+    """Raised when no SMTP connection frees up within the acquire timeout."""
+
+
+def is_broken_session(exc: BaseException) -> bool:
+    """Tell whether an exception leaves the SMTP session unusable."""
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(exc, smtplib.SMTPResponseException):
+        # 421: the server is closing the transmission channel
+        return exc.smtp_code == 421
+    if isinstance(exc, smtplib.SMTPException):
+        # Refused recipients/sender leave the session intact
+        return False
+    return True
+
+
+class PooledSMTPConnection:
+    """An authenticated SMTP session plus the bookkeeping the pool needs."""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.reset(server)
+
+    def reset(self, server: smtplib.SMTP) -> None:
+        """Point this pool slot at a freshly opened session."""
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    def close(self) -> None:
+        """Politely end the session, falling back to dropping the socket."""
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """
+    Thread-safe, bounded pool of logged-in SMTP sessions.
+
+    At most `size` sessions exist at once. Idle sessions are reused LIFO so
+    the warmest one is picked first; a session idle for longer than
+    `health_check_after` seconds is probed with NOOP before reuse, one idle
+    for longer than `idle_timeout` is closed, and a session that has carried
+    `max_messages` messages is retired.
+
+    With a `rate_limiter`, every message waits for its relay and recipient
+    domain tokens first and reports back whether the server throttled it.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        use_ssl: bool = True,
+        size: int = 4,
+        idle_timeout: float = 60,
+        max_messages: int = 100,
+        health_check_after: float = 5,
+        acquire_timeout: float = 30,
+        timeout: float = 30,
+        unhealthy_after: int = 3,
+        rate_limiter: Optional[SMTPRateLimiter] = None,
+    ):
+        self.host = host
+        self.port = int(port)
+        self.relay = f"{host}:{self.port}"
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.unhealthy_after = unhealthy_after
+        self.rate_limiter = rate_limiter
+        self._ssl_context = ssl.create_default_context() if use_ssl else None
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.connections_opened = 0
+        self.reconnects = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+
+    def _connect_server(self) -> smtplib.SMTP:
+        try:
+            started = time.perf_counter()
+            if self.use_ssl:
+                server = smtplib.SMTP_SSL(
+                    self.host, self.port, timeout=self.timeout, context=self._ssl_context
+                )
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            record_stage("smtp_connect", started)
+            started = time.perf_counter()
+            try:
+                server.login(self.username, self.password)
+            except BaseException:
+                server.close()
+                raise
+            record_stage("smtp_login", started)
+        except Exception as exc:
+            with self._lock:
+                self.consecutive_failures += 1
+                self.last_error = repr(exc)
+            raise
+        with self._lock:
+            self.connections_opened += 1
+            self.consecutive_failures = 0
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return server
+
+    def _open(self) -> PooledSMTPConnection:
+        return PooledSMTPConnection(self._connect_server())
+
+    def _is_reusable(self, conn: PooledSMTPConnection, now: float) -> bool:
+        idle_for = now - conn.last_used
+        if idle_for > self.idle_timeout or conn.messages_sent >= self.max_messages:
+            return False
+        if idle_for > self.health_check_after:
+            try:
+                code, _ = conn.server.noop()
+            except (smtplib.SMTPException, OSError):
+                return False
+            return code == 250
+        return True
+
+    def acquire(self) -> PooledSMTPConnection:
+        """Borrow a healthy session, opening a new one if none is idle."""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise SMTPPoolExhausted(
+                f"No SMTP connection available after {self.acquire_timeout}s"
+            )
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._open()
+                if self._is_reusable(conn, time.monotonic()):
+                    return conn
+                conn.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: PooledSMTPConnection, discard: bool = False) -> None:
+        """Return a borrowed session; broken or worn-out sessions are closed."""
+        expired = []
+        try:
+            if discard or self._closed or conn.messages_sent >= self.max_messages:
+                expired.append(conn)
+            else:
+                now = time.monotonic()
+                conn.last_used = now
+                with self._lock:
+                    self._idle.append(conn)
+                    while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+                        expired.append(self._idle.popleft())
+        finally:
+            self._slots.release()
+        for stale in expired:
+            stale.close()
+
+    def prewarm(self, count: int) -> int:
+        """Open up to `count` sessions now and park them idle; returns how many were opened."""
+        opened = []
+        try:
+            for _ in range(min(count, self.size)):
+                opened.append(self.acquire())
+        finally:
+            for conn in opened:
+                self.release(conn)
+        return len(opened)
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledSMTPConnection]:
+        """Borrow a session for the duration of a `with` block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException as exc:
+            self.release(conn, discard=is_broken_session(exc))
+            raise
+        self.release(conn)
+
+    def _reconnect(self, conn: PooledSMTPConnection) -> None:
+        logger.warning(f"SMTP session to {self.host} dropped, reconnecting")
+        conn.close()
+        with self._lock:
+            self.reconnects += 1
+        conn.reset(self._connect_server())
+
+    def _sendmail_on(
+        self,
+        conn: PooledSMTPConnection,
+        from_addr: str,
+        to_addrs: Union[str, List[str]],
+        msg: Union[str, bytes],
+    ) -> Dict[str, tuple]:
+        if conn.messages_sent >= self.max_messages:
+            conn.close()
+            conn.reset(self._connect_server())
+        started = time.perf_counter()
+        try:
+            try:
+                refused = conn.server.sendmail(from_addr, to_addrs, msg)
+            except smtplib.SMTPServerDisconnected:
+                self._reconnect(conn)
+                started = time.perf_counter()
+                refused = conn.server.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPException as exc:
+            if self.rate_limiter is not None:
+                self.rate_limiter.record(self.relay, to_addrs, exc)
+            raise
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(self.relay, to_addrs)
+        record_stage("smtp_send", started)
+        conn.messages_sent += 1
+        return refused
+
+    def sendmail(
+        self, from_addr: str, to_addrs: Union[str, List[str]], msg: Union[str, bytes]
+    ) -> Dict[str, tuple]:
+        """
+        Send one message over a pooled session.
+
+        If the server silently dropped the session, it is reopened once and
+        the message resent. Returns the refused-recipients dict of smtplib.
+        Raises `SMTPRateLimited` if the rate limit would need too long a wait.
+        """
+        if self.rate_limiter is not None:
+            # Wait before borrowing, so a throttled domain does not hold a session
+            self.rate_limiter.wait(self.relay, to_addrs)
+        conn = self.acquire()
+        try:
+            refused = self._sendmail_on(conn, from_addr, to_addrs, msg)
+        except BaseException as exc:
+            self.release(conn, discard=is_broken_session(exc))
+            raise
+        self.release(conn)
+        return refused
+
+    def send_many(
+        self,
+        from_addr: str,
+        messages: Sequence[Tuple[Union[str, List[str]], Union[str, bytes]]],
+    ) -> List[Optional[Exception]]:
+        """
+        Send several `(to_addrs, msg)` pairs over one borrowed session.
+
+        Returns one entry per message: None when the server accepted it, or
+        the exception it failed with. A failure only affects its own message;
+        if it broke the session, the session is reopened for the rest.
+        """
+        results: List[Optional[Exception]] = []
+        conn = self.acquire()
+        broken = False
+        try:
+            for index, (to_addrs, msg) in enumerate(messages):
+                if broken:
+                    try:
+                        self._reconnect(conn)
+                        broken = False
+                    except Exception as exc:
+                        results.extend([exc] * (len(messages) - index))
+                        break
+                try:
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.wait(self.relay, to_addrs)
+                    self._sendmail_on(conn, from_addr, to_addrs, msg)
+                    results.append(None)
+                except Exception as exc:
+                    results.append(exc)
+                    broken = is_broken_session(exc)
+        finally:
+            self.release(conn, discard=broken)
+        return results
+
+    def close(self) -> None:
+        """Close every idle session; borrowed ones are closed on release."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            conn.close()
+
+    def idle_count(self) -> int:
+        """Number of sessions currently parked in the pool."""
+        with self._lock:
+            return len(self._idle)
+
+    def health(self) -> dict:
+        """Snapshot for the health endpoints; unhealthy after repeated connect failures."""
+        with self._lock:
+            return {
+                "healthy": not self._closed and self.consecutive_failures < self.unhealthy_after,
+                "relay": self.relay,
+                "idle_connections": len(self._idle),
+                "connections_opened": self.connections_opened,
+                "reconnects": self.reconnects,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+            }
+
+
+_smtp_pool: Optional[Union[SMTPConnectionPool, SMTPRelayRouter]] = None
+_smtp_pool_lock = threading.Lock()
+
+
+def build_smtp_pool(host: str, port: Union[str, int]) -> SMTPConnectionPool:
+    """An SMTP pool to one relay, configured from the email settings."""
+    return SMTPConnectionPool(
+        host=host,
+        port=port,
+        username=EMAIL_HOST_USER,
+        password=EMAIL_HOST_PASSWORD,
+        use_ssl=EMAIL_USE_SSL,
+        size=SMTP_POOL_SIZE,
+        idle_timeout=SMTP_POOL_IDLE_TIMEOUT,
+        max_messages=SMTP_POOL_MAX_MESSAGES,
+        health_check_after=SMTP_POOL_HEALTH_CHECK_AFTER,
+        acquire_timeout=SMTP_POOL_ACQUIRE_TIMEOUT,
+        timeout=SMTP_TIMEOUT,
+        unhealthy_after=SMTP_POOL_UNHEALTHY_AFTER,
+        rate_limiter=get_rate_limiter(),
+    )
+
+
+def get_smtp_pool() -> Union[SMTPConnectionPool, SMTPRelayRouter]:
+    """
+    Return the process-wide SMTP pool built from the email settings.
+
+    With SMTP_RELAYS set, this is a router over one pool per relay.
+    """
+    global _smtp_pool
+    if _smtp_pool is None:
+        with _smtp_pool_lock:
+            if _smtp_pool is None:
+                if SMTP_RELAYS:
+                    relays = parse_relays(SMTP_RELAYS, EMAIL_PORT)
+                    _smtp_pool = SMTPRelayRouter(
+                        [build_smtp_pool(relay.host, relay.port) for relay in relays],
+                        [relay.weight for relay in relays],
+                    )
+                else:
+                    _smtp_pool = build_smtp_pool(EMAIL_HOST, EMAIL_PORT)
+    return _smtp_pool
+
+
+def close_smtp_pool() -> None:
+    """Close and forget the process-wide SMTP pool."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        pool, _smtp_pool = _smtp_pool, None
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,451 @@
+"""Spread SMTP sends over several relays by latency and health, failing over between them"""
+import time
+import random
+import asyncio
+import smtplib
+import logging
+import threading
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+import aiosmtplib
+from sending_emails.core.metrics import Counter, Gauge
+from sending_emails.emails.config import (
+    SMTP_RELAY_LATENCY_SMOOTHING,
+    SMTP_RELAY_BREAKER_FAILURES,
+    SMTP_RELAY_BREAKER_COOLDOWN,
+    SMTP_RELAY_BREAKER_MAX_COOLDOWN,
+    SMTP_RELAY_EXPLORE_RATE,
+)
+from sending_emails.emails.rate_limit import SMTPRateLimited, smtp_reply_codes
+
+logger = logging.getLogger("ai_call_assistant_service_logger")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_CIRCUIT_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+# Routing charges a relay's error rate as this many seconds of extra latency
+FAILURE_COST_SECONDS = 1.0
+
+SMTP_RELAY_CIRCUIT = Gauge(
+    "email_smtp_relay_circuit_state",
+    "Circuit breaker state per SMTP relay (0 closed, 1 half-open, 2 open)",
+    ("relay",),
+)
+SMTP_RELAY_LATENCY = Gauge(
+    "email_smtp_relay_latency_seconds",
+    "Smoothed time per accepted send, per SMTP relay",
+    ("relay",),
+)
+SMTP_RELAY_FAILURES = Counter(
+    "email_smtp_relay_failures_total",
+    "Sends that failed because of the relay and moved on to the next one, by relay",
+    ("relay",),
+)
+
+
+class SMTPRelaysUnavailable(Exception):
+    """Raised when every relay's circuit is open, so a send is retried later instead."""
+
+
+class RelayAddress(NamedTuple):
+    host: str
+    port: int
+    weight: float
+
+
+def parse_relays(entries: Iterable[str], default_port: Union[str, int]) -> List[RelayAddress]:
+    """Parse `host[:port][=weight]` entries, e.g. `smtp1.example.com:465=2`."""
+    relays = []
+    for entry in entries:
+        address, _, weight = entry.strip().partition("=")
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        try:
+            relay = RelayAddress(host.strip(), int(port or default_port), float(weight) if weight else 1.0)
+        except ValueError:
+            relay = None
+        if relay is None or not relay.host or relay.weight <= 0:
+            raise ValueError(f"Invalid SMTP relay {entry!r}, expected host[:port][=weight]")
+        relays.append(relay)
+    return relays
+
+
+def is_relay_failure(exc: BaseException) -> bool:
+    """
+    Tell whether a send failed because of the relay rather than the message.
+
+    Refused recipients and 5xx replies would fail the same way through any
+    relay; connection errors, timeouts, an exhausted pool or rate limit,
+    rejected credentials and 4xx replies (busy, 421) are worth another relay.
+    """
+    if isinstance(exc, (smtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientsRefused)):
+        return False
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, aiosmtplib.SMTPAuthenticationError)):
+        return True
+    codes = smtp_reply_codes(exc)
+    return not codes or any(400 <= code < 500 for code in codes)
+
+
+class RelayHealth:
+    """
+    Rolling latency and error rate of one relay, and its circuit breaker.
+
+    Both are exponentially smoothed, the newest send weighing `smoothing`.
+    After `breaker_failures` failures in a row the circuit opens for
+    `cooldown` seconds; then a single send probes the relay (half-open).
+    A successful probe closes the circuit, a failed one reopens it for
+    twice as long, up to `max_cooldown`. Callers hold the router's lock.
+    """
+
+    def __init__(
+        self,
+        relay: str,
+        weight: float,
+        smoothing: float,
+        breaker_failures: int,
+        cooldown: float,
+        max_cooldown: float,
+    ):
+        self.relay = relay
+        self.weight = weight
+        self.smoothing = smoothing
+        self.breaker_failures = breaker_failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.in_flight = 0
+        self.probing = False
+        self.sends = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        SMTP_RELAY_CIRCUIT.set(labels=(relay,), value=_CIRCUIT_VALUES[CLOSED])
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"SMTP relay {self.relay} circuit {self.state} -> {state}")
+            self.state = state
+            SMTP_RELAY_CIRCUIT.set(labels=(self.relay,), value=_CIRCUIT_VALUES[state])
+
+    def available(self, now: float) -> bool:
+        """Whether a send may go to this relay now; moves an expired open circuit to half-open."""
+        if self.state == OPEN and now >= self.open_until:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def expected_wait(self) -> float:
+        """Time a new send should take here: latency plus failures, queued behind the sends in flight."""
+        latency = (self.latency or 0.0) + self.error_rate * FAILURE_COST_SECONDS
+        return latency * (self.in_flight + 1) / self.weight
+
+    def begin(self) -> None:
+        self.in_flight += 1
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def succeeded(self, seconds: float) -> None:
+        """The relay answered (accepted, or refused the message itself)."""
+        self.in_flight -= 1
+        self.probing = False
+        self.sends += 1
+        self.latency = seconds if self.latency is None else self.latency + self.smoothing * (seconds - self.latency)
+        self.error_rate -= self.smoothing * self.error_rate
+        self.consecutive_failures = 0
+        SMTP_RELAY_LATENCY.set(labels=(self.relay,), value=self.latency)
+        if self.state != CLOSED:
+            self.cooldown = self.base_cooldown
+            self._set_state(CLOSED)
+
+    def abandoned(self) -> None:
+        """A send was cancelled before the relay answered: free its slot without judging the relay."""
+        self.in_flight -= 1
+        self.probing = False
+
+    def failed(self, error: BaseException, now: float) -> None:
+        """The relay failed a send; local rate limiting is not held against it."""
+        self.in_flight -= 1
+        self.probing = False
+        self.last_error = repr(error)
+        if isinstance(error, SMTPRateLimited):
+            return
+        self.sends += 1
+        self.failures += 1
+        self.error_rate += self.smoothing * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self._open(now)
+        elif self.state == CLOSED and self.consecutive_failures >= self.breaker_failures:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.open_until = now + self.cooldown
+        self._set_state(OPEN)
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "circuit": self.state,
+            "weight": self.weight,
+            "latency_seconds": self.latency,
+            "error_rate": round(self.error_rate, 3),
+            "in_flight": self.in_flight,
+            "sends": self.sends,
+            "failures": self.failures,
+            "probe_in_seconds": max(0.0, self.open_until - now) if self.state == OPEN else None,
+        }
+
+
+class _RelayRouter:
+    """Relay selection and bookkeeping shared by the blocking and asyncio routers."""
+
+    def __init__(
+        self,
+        pools: Sequence,
+        weights: Optional[Sequence[float]] = None,
+        smoothing: float = SMTP_RELAY_LATENCY_SMOOTHING,
+        breaker_failures: int = SMTP_RELAY_BREAKER_FAILURES,
+        cooldown: float = SMTP_RELAY_BREAKER_COOLDOWN,
+        max_cooldown: float = SMTP_RELAY_BREAKER_MAX_COOLDOWN,
+        explore_rate: float = SMTP_RELAY_EXPLORE_RATE,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Optional[random.Random] = None,
+    ):
+        if not pools:
+            raise ValueError("At least one SMTP relay is required")
+        self.pools = list(pools)
+        weights = weights or [1.0] * len(self.pools)
+        self.relays = [
+            RelayHealth(pool.relay, weight, smoothing, breaker_failures, cooldown, max_cooldown)
+            for pool, weight in zip(self.pools, weights)
+        ]
+        self.relay = ",".join(pool.relay for pool in self.pools)
+        self.size = sum(pool.size for pool in self.pools)
+        self.explore_rate = explore_rate
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def _choose(self, tried: Set[int]) -> int:
+        """
+        Pick the relay for the next send and count it in flight.
+
+        Usually the one with the lowest expected wait, so an idle fast relay
+        wins and busy relays share the load by speed and weight; now and then
+        (`explore_rate`) a random one, so a relay that recovered is noticed.
+        """
+        with self._lock:
+            now = self.clock()
+            candidates = [
+                index for index, health in enumerate(self.relays)
+                if index not in tried and health.available(now)
+            ]
+            if not candidates:
+                raise SMTPRelaysUnavailable(
+                    f"No SMTP relay available ({', '.join(f'{h.relay} {h.state}' for h in self.relays)})"
+                )
+            if len(candidates) > 1 and self.rng.random() < self.explore_rate:
+                index = self.rng.choices(candidates, weights=[self.relays[i].weight for i in candidates])[0]
+            else:
+                index = min(
+                    candidates,
+                    key=lambda i: (self.relays[i].expected_wait(), self.relays[i].in_flight, -self.relays[i].weight),
+                )
+            self.relays[index].begin()
+            return index
+
+    def _finished(self, index: int, started: float, errors: Sequence[Optional[BaseException]]) -> bool:
+        """Record a send (or batch) on relay `index`; True when the relay failed it."""
+        elapsed = time.perf_counter() - started
+        relay_error = next((error for error in errors if error is not None and is_relay_failure(error)), None)
+        health = self.relays[index]
+        with self._lock:
+            if relay_error is None:
+                health.succeeded(elapsed / max(1, len(errors)))
+            else:
+                health.failed(relay_error, self.clock())
+        if relay_error is not None:
+            SMTP_RELAY_FAILURES.inc((health.relay,))
+            logger.warning(f"SMTP relay {health.relay} failed, trying another one: {relay_error}")
+        return relay_error is not None
+
+    def _abandoned(self, index: int) -> None:
+        with self._lock:
+            self.relays[index].abandoned()
+
+    def _prewarm_failed(self, index: int, error: BaseException) -> None:
+        with self._lock:
+            health = self.relays[index]
+            health.begin()
+            health.failed(error, self.clock())
+
+    def health(self) -> dict:
+        """Pool health of every relay plus its circuit; healthy while any relay is usable."""
+        pool_reports = [pool.health() for pool in self.pools]
+        with self._lock:
+            now = self.clock()
+            relays = [
+                dict(
+                    report,
+                    **health.snapshot(now),
+                    healthy=report["healthy"] and health.state != OPEN,
+                    last_error=health.last_error or report["last_error"],
+                )
+                for report, health in zip(pool_reports, self.relays)
+            ]
+        return {
+            "healthy": any(relay["healthy"] for relay in relays),
+            "relay": self.relay,
+            "idle_connections": sum(relay["idle_connections"] for relay in relays),
+            "connections_opened": sum(relay["connections_opened"] for relay in relays),
+            "reconnects": sum(relay["reconnects"] for relay in relays),
+            "consecutive_failures": min(relay["consecutive_failures"] for relay in relays),
+            "last_error": next((relay["last_error"] for relay in relays if not relay["healthy"]), None),
+            "relays": relays,
+        }
+
+
+class SMTPRelayRouter(_RelayRouter):
+    """
+    Several `SMTPConnectionPool`s behind the interface of one.
+
+    Each send goes to the relay with the lowest expected wait. A send the
+    relay failed (see `is_relay_failure`) moves on to the next-best relay
+    not tried yet; one the message itself failed is raised at once.
+    """
+
+    def sendmail(self, from_addr: str, to_addrs: Union[str, List[str]], msg: Union[str, bytes]) -> dict:
+        tried: Set[int] = set()
+        error: Optional[BaseException] = None
+        while True:
+            try:
+                index = self._choose(tried)
+            except SMTPRelaysUnavailable:
+                if error is None:
+                    raise
+                raise error
+            started = time.perf_counter()
+            try:
+                refused = self.pools[index].sendmail(from_addr, to_addrs, msg)
+            except Exception as exc:
+                if not self._finished(index, started, [exc]):
+                    raise
+                tried.add(index)
+                error = exc
+                continue
+            except BaseException:
+                # Cancelled or interrupted mid-send: the relay must not stay busy (or probing)
+                self._abandoned(index)
+                raise
+            self._finished(index, started, [None])
+            return refused
+
+    def send_many(
+        self,
+        from_addr: str,
+        messages: Sequence[Tuple[Union[str, List[str]], Union[str, bytes]]],
+    ) -> List[Optional[Exception]]:
+        """Send a batch over one relay; the messages it failed move to the next one."""
+        results: List[Optional[Exception]] = [None] * len(messages)
+        pending = list(range(len(messages)))
+        tried: Set[int] = set()
+        while pending:
+            try:
+                index = self._choose(tried)
+            except SMTPRelaysUnavailable as exc:
+                if not tried:
+                    for position in pending:
+                        results[position] = exc
+                break
+            started = time.perf_counter()
+            try:
+                errors = self.pools[index].send_many(from_addr, [messages[position] for position in pending])
+            except Exception as exc:
+                errors = [exc] * len(pending)
+            except BaseException:
+                self._abandoned(index)
+                raise
+            self._finished(index, started, errors)
+            tried.add(index)
+            for position, error in zip(pending, errors):
+                results[position] = error
+            pending = [
+                position for position, error in zip(pending, errors)
+                if error is not None and is_relay_failure(error)
+            ]
+        return results
+
+    def prewarm(self, count: int) -> int:
+        """Open up to `count` sessions per relay; a relay that cannot be reached counts as a failure."""
+        opened, errors = 0, []
+        for index, pool in enumerate(self.pools):
+            try:
+                opened += pool.prewarm(count)
+            except Exception as exc:
+                errors.append(exc)
+                self._prewarm_failed(index, exc)
+        if len(errors) == len(self.pools):
+            raise errors[0]
+        return opened
+
+    def close(self) -> None:
+        for pool in self.pools:
+            pool.close()
+
+    def idle_count(self) -> int:
+        return sum(pool.idle_count() for pool in self.pools)
+
+
+class AsyncSMTPRelayRouter(_RelayRouter):
+    """`SMTPRelayRouter` over `AsyncSMTPConnectionPool`s, for the asyncio consumer."""
+
+    async def sendmail(
+        self, from_addr: str, to_addrs: Union[str, Sequence[str]], msg: Union[str, bytes]
+    ) -> dict:
+        tried: Set[int] = set()
+        error: Optional[BaseException] = None
+        while True:
+            try:
+                index = self._choose(tried)
+            except SMTPRelaysUnavailable:
+                if error is None:
+                    raise
+                raise error
+            started = time.perf_counter()
+            try:
+                refused = await self.pools[index].sendmail(from_addr, to_addrs, msg)
+            except Exception as exc:
+                if not self._finished(index, started, [exc]):
+                    raise
+                tried.add(index)
+                error = exc
+                continue
+            except BaseException:
+                # Cancelled or interrupted mid-send: the relay must not stay busy (or probing)
+                self._abandoned(index)
+                raise
+            self._finished(index, started, [None])
+            return refused
+
+    async def prewarm(self, count: int) -> int:
+        """Open up to `count` sessions per relay, all relays at once."""
+        results = await asyncio.gather(*(pool.prewarm(count) for pool in self.pools), return_exceptions=True)
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                self._prewarm_failed(index, result)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) == len(self.pools):
+            raise errors[0]
+        return sum(result for result in results if not isinstance(result, BaseException))
+
+    async def close(self) -> None:
+        for pool in self.pools:
+            await pool.close()
+
+    @property
+    def _closed(self) -> bool:
+        return all(pool._closed for pool in self.pools)
@@ -0,0 +1,116 @@
+"""Compiled, mtime-aware cache of the HTML email templates"""
+import os
+import re
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from sending_emails.emails.config import TEMPLATE_CHECK_INTERVAL
+from sending_emails.emails.mime import html_to_text
+
+logger = logging.getLogger("ai_call_assistant_service_logger")
+
+PLACEHOLDER_PATTERN = re.compile(r"\[([A-Za-z0-9_]+)\]")
+
+
+class CompiledTemplate:
+    """
+    A template split once into literal text and `[placeholder]` slots.
+
+    `parts` alternates literal, placeholder name, literal, ... so rendering
+    is a single pass over the slots followed by one join. `text` is the
+    plain-text alternative, itself compiled on first use.
+    """
+
+    __slots__ = ("path", "mtime_ns", "parts", "placeholders", "_text")
+
+    def __init__(self, path: str, source: str, mtime_ns: int = 0):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.parts: List[str] = PLACEHOLDER_PATTERN.split(source)
+        self.placeholders = frozenset(self.parts[1::2])
+        self._text: Optional["CompiledTemplate"] = None
+
+    @property
+    def text(self) -> "CompiledTemplate":
+        """The template converted to plain text, placeholders kept; converted once."""
+        if self._text is None:
+            # Rendering without replacements gives back the source
+            self._text = CompiledTemplate(self.path, html_to_text(self.render({})), self.mtime_ns)
+        return self._text
+
+    def render(self, replacements: Dict[str, Any], default: str = "N/A") -> str:
+        """Fill placeholders; falsy values become `default`, unknown ones stay as-is."""
+        out = self.parts[:]
+        for index in range(1, len(out), 2):
+            name = out[index]
+            if name in replacements:
+                value = replacements[name]
+                out[index] = str(value) if value else default
+            else:
+                out[index] = f"[{name}]"
+        return "".join(out)
+
+
+class _CacheEntry:
+    __slots__ = ("template", "checked_at")
+
+    def __init__(self, template: CompiledTemplate, checked_at: float):
+        self.template = template
+        self.checked_at = checked_at
+
+
+class TemplateCache:
+    """
+    Process-wide cache of compiled templates keyed by path.
+
+    The file is stat-ed at most once per `check_interval` seconds and only
+    re-read and recompiled when its mtime changed, so edits are picked up
+    without a restart.
+    """
+
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval = check_interval
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str) -> CompiledTemplate:
+        now = time.monotonic()
+        entry = self._entries.get(template_path)
+        if entry is not None and now - entry.checked_at < self.check_interval:
+            return entry.template
+        try:
+            mtime_ns = os.stat(template_path).st_mtime_ns
+        except FileNotFoundError:
+            logger.error(f"Template not found: {template_path}")
+            raise FileNotFoundError(f"Template not found at {template_path}")
+        if entry is not None and entry.template.mtime_ns == mtime_ns:
+            entry.checked_at = now
+            return entry.template
+        with open(template_path, "r", encoding="utf-8") as file:
+            template = CompiledTemplate(template_path, file.read(), mtime_ns)
+        with self._lock:
+            self._entries[template_path] = _CacheEntry(template, now)
+        if entry is not None:
+            logger.info(f"Reloaded changed template: {template_path}")
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_template_cache: Optional[TemplateCache] = None
+
+
+def get_template_cache() -> TemplateCache:
+    """Return the process-wide template cache."""
+    global _template_cache
+    if _template_cache is None:
+        _template_cache = TemplateCache(check_interval=TEMPLATE_CHECK_INTERVAL)
+    return _template_cache
+
+
+def get_template(template_path: str) -> CompiledTemplate:
+    """Return the compiled template for `template_path`, reloading it if edited."""
+    return get_template_cache().get(template_path)
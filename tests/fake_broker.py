@@ -0,0 +1,251 @@
+"""In-process stand-ins for the pika connection, channel and delivery objects"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+import pika
+
+
+@dataclass
+class FakeMethod:
+    delivery_tag: int
+    redelivered: bool = False
+    routing_key: str = ""
+
+
+@dataclass
+class FakeProperties:
+    message_id: Optional[str] = None
+    headers: dict = field(default_factory=dict)
+    priority: Optional[int] = None
+    timestamp: Optional[int] = None
+
+
+class FakeChannel:
+    """Records acks, nacks, rejects and publishes together with the thread that issued them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acks = []
+        self.nacks = []
+        self.rejects = []
+        self.published = []
+        self.threads = set()
+        self.is_open = True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        with self.lock:
+            self.acks.append(delivery_tag)
+            self.threads.add(threading.get_ident())
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        with self.lock:
+            self.nacks.append((delivery_tag, requeue))
+            self.threads.add(threading.get_ident())
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        with self.lock:
+            self.rejects.append((delivery_tag, requeue))
+            self.threads.add(threading.get_ident())
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        with self.lock:
+            self.published.append((exchange, routing_key, body, properties))
+            self.threads.add(threading.get_ident())
+
+
+class FakeConnection:
+    """Queues `add_callback_threadsafe` callbacks until the owner thread drains them."""
+
+    def __init__(self):
+        self.callbacks = queue.Queue()
+        self.timers = {}
+        self.is_open = True
+
+    def add_callback_threadsafe(self, callback):
+        if not self.is_open:
+            raise RuntimeError("connection closed")
+        self.callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        timer_id = object()
+        self.timers[timer_id] = (time.monotonic() + delay, callback)
+        return timer_id
+
+    def remove_timeout(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+    def fire_due_timers(self):
+        now = time.monotonic()
+        for timer_id, (deadline, callback) in list(self.timers.items()):
+            if deadline <= now and self.timers.pop(timer_id, None):
+                callback()
+
+    def process_data_events(self, time_limit=0.0):
+        self.fire_due_timers()
+        try:
+            callback = self.callbacks.get(timeout=time_limit) if time_limit else self.callbacks.get_nowait()
+        except queue.Empty:
+            return
+        callback()
+        while True:
+            try:
+                self.callbacks.get_nowait()()
+            except queue.Empty:
+                return
+
+
+@dataclass
+class FakeFrame:
+    method: object
+
+
+class FakeConfirmingChannel:
+    """BlockingChannel stand-in whose `_impl` supports async publisher confirms."""
+
+    def __init__(self):
+        self._impl = self
+        self.is_open = True
+        self.declarations = []
+        self.published = []
+        self.nack_tags = set()
+        self.confirmed = 0
+        self.message_count = 0
+        self._ack_nack_callback = None
+        self._select_ok_callback = None
+
+    # pika.channel.Channel API used through BlockingChannel._impl
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._ack_nack_callback = ack_nack_callback
+        self._select_ok_callback = callback
+
+    def exchange_declare(self, exchange, exchange_type="direct", **kwargs):
+        self.declarations.append(("exchange", exchange))
+
+    def queue_declare(self, queue, **kwargs):
+        self.declarations.append(("queue", queue))
+        return FakeFrame(
+            pika.spec.Queue.DeclareOk(queue=queue, message_count=self.message_count, consumer_count=1)
+        )
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        self.declarations.append(("bind", queue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append((routing_key, body, properties))
+
+    def deliver_confirms(self):
+        """Nack the tags in `nack_tags`, then ack everything else with one multiple-ack."""
+        if self._select_ok_callback is not None:
+            callback, self._select_ok_callback = self._select_ok_callback, None
+            callback(None)
+        total = len(self.published)
+        if self.confirmed >= total:
+            return
+        for tag in sorted(self.nack_tags):
+            if self.confirmed < tag <= total:
+                self._ack_nack_callback(FakeFrame(pika.spec.Basic.Nack(delivery_tag=tag)))
+        self._ack_nack_callback(FakeFrame(pika.spec.Basic.Ack(delivery_tag=total, multiple=True)))
+        self.confirmed = total
+
+
+class FakeBlockingConnection:
+    """pika.BlockingConnection stand-in; every instance is recorded in `opened`."""
+
+    opened = []
+
+    def __init__(self, parameters=None):
+        self.parameters = parameters
+        self.is_open = True
+        self.channel_obj = FakeConfirmingChannel()
+        FakeBlockingConnection.opened.append(self)
+
+    def channel(self):
+        return self.channel_obj
+
+    def process_data_events(self, time_limit=0):
+        self.channel_obj.deliver_confirms()
+
+    def close(self):
+        self.is_open = False
+        self.channel_obj.is_open = False
+
+
+class FakeConsumingChannel:
+    """BlockingChannel stand-in for the consumer: records declarations and subscriptions."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.prefetch_count = None
+        self.consuming = False
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def exchange_declare(self, exchange, exchange_type="direct", **kwargs):
+        self.broker.declarations.append(("exchange", exchange))
+
+    def queue_declare(self, queue, **kwargs):
+        self.broker.declarations.append(("queue", queue))
+        self.broker.queues.add(queue)
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        self.broker.declarations.append(("bind", queue))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        if queue not in self.broker.queues:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+        self.broker.subscriptions.append(queue)
+        self.broker.prefetch_counts[queue] = self.prefetch_count
+
+    def start_consuming(self):
+        self.consuming = True
+        self.broker.on_consume(self)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+
+class FakeBroker:
+    """
+    Hands out consumer connections according to a script.
+
+    `outages` connection attempts fail first; every successful connection
+    then runs `on_consume(channel)` in place of `start_consuming`.
+    """
+
+    def __init__(self, outages=0, on_consume=None):
+        self.outages = outages
+        self.on_consume = on_consume or (lambda channel: None)
+        self.attempts = 0
+        self.connections = []
+        self.declarations = []
+        self.subscriptions = []
+        self.prefetch_counts = {}
+        self.queues = set()
+
+    def restart(self):
+        """Lose every non-durable queue, as a broker restart does."""
+        self.queues.clear()
+
+    def connect(self):
+        self.attempts += 1
+        if self.outages:
+            self.outages -= 1
+            raise pika.exceptions.AMQPConnectionError("connection refused")
+        connection = FakeConsumingConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+class FakeConsumingConnection(FakeConnection):
+    def __init__(self, broker):
+        super().__init__()
+        self.broker = broker
+
+    def channel(self):
+        return FakeConsumingChannel(self.broker)
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,133 @@
+"""Minimal in-process SMTP server used as a local stand-in for the relay"""
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Speak just enough SMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, NOOP, RSET, QUIT."""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write((line + "\r\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        session_messages = 0
+        with server.lock:
+            server.connections += 1
+        self.reply("220 fake.smtp ESMTP ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode().rstrip("\r\n")
+            verb = line.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-fake.smtp\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 fake.smtp")
+            elif verb == "AUTH":
+                if server.login_delay:
+                    time.sleep(server.login_delay)
+                with server.lock:
+                    server.logins += 1
+                self.reply("235 Authentication successful")
+            elif verb == "NOOP":
+                with server.lock:
+                    server.noops += 1
+                self.reply("250 OK")
+            elif verb == "RSET":
+                self.reply("250 OK")
+            elif verb == "MAIL":
+                override = server.next_response("MAIL")
+                self.reply(override or "250 OK")
+            elif verb == "RCPT":
+                override = server.next_response("RCPT")
+                self.reply(override or "250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data_line)
+                if server.delay:
+                    time.sleep(server.delay)
+                override = server.next_response("DATA")
+                if override:
+                    self.reply(override)
+                    continue
+                with server.lock:
+                    server.messages.append(b"".join(lines))
+                session_messages += 1
+                self.reply("250 OK queued")
+                if server.disconnect_after and session_messages >= server.disconnect_after:
+                    return
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded fake relay bound to an ephemeral localhost port.
+
+    Counters (`connections`, `logins`, `noops`, `messages`) let tests assert
+    how many handshakes and deliveries happened. `delay` slows every DATA
+    reply, `login_delay` models the TLS handshake and login, `disconnect_after` drops the socket after that many messages in a
+    session, and `queue_response` injects a reply for the next MAIL/RCPT/DATA.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, delay: float = 0.0, disconnect_after: int = 0, login_delay: float = 0.0):
+        super().__init__(("127.0.0.1", 0), FakeSMTPHandler)
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.login_delay = login_delay
+        self.disconnect_after = disconnect_after
+        self.connections = 0
+        self.logins = 0
+        self.noops = 0
+        self.messages = []
+        self._responses = {}
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def queue_response(self, verb: str, line: str) -> None:
+        with self.lock:
+            self._responses.setdefault(verb, []).append(line)
+
+    def next_response(self, verb: str):
+        with self.lock:
+            queued = self._responses.get(verb)
+            return queued.pop(0) if queued else None
+
+    def html_body(self, index: int) -> str:
+        """Decoded text/html part of the index-th accepted message."""
+        message = message_from_bytes(self.messages[index])
+        for part in message.walk():
+            if part.get_content_type() == "text/html":
+                return part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8")
+        return ""
+
+    def start(self) -> "FakeSMTPServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
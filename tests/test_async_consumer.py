@@ -0,0 +1,84 @@
+import asyncio
+import json
+import unittest
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.reconnect import ExponentialBackoff
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool
+from sending_emails.emails.encryption_utils import encrypt_data
+from tests.fake_broker import FakeChannel, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+
+def otp_body(email="jane@example.com"):
+    return json.dumps({
+        "event": "user_otp_request",
+        "data": {
+            "user_email": email,
+            "user_fullname": "Jane",
+            "otp_reason": "Login",
+            "otp": encrypt_data("123456"),
+        },
+    }).encode()
+
+
+class TestAsyncRabbitMQConsumer(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer(delay=0.02).start()
+        self.channel = FakeChannel()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def make_pool(self, size):
+        return AsyncSMTPConnectionPool(
+            host="127.0.0.1",
+            port=self.server.port,
+            username="user",
+            password="secret",
+            use_ssl=False,
+            size=size,
+            timeout=5,
+        )
+
+    def test_many_messages_in_flight_share_few_connections(self):
+        async def scenario():
+            pool = self.make_pool(size=4)
+            consumer = AsyncRabbitMQConsumer(max_in_flight=50, smtp_pool=pool)
+            results = await asyncio.gather(*(
+                consumer.process_message(self.channel, FakeMethod(tag), None, otp_body())
+                for tag in range(1, 51)
+            ))
+            await pool.close()
+            return results, pool
+
+        results, pool = asyncio.run(scenario())
+        self.assertTrue(all(results))
+        self.assertEqual(sorted(self.channel.acks), list(range(1, 51)))
+        self.assertEqual(len(self.server.messages), 50)
+        self.assertLessEqual(self.server.logins, 4)
+        self.assertIn("123456", self.server.html_body(0))
+
+    def test_unknown_event_is_rejected(self):
+        async def scenario():
+            consumer = AsyncRabbitMQConsumer(smtp_pool=self.make_pool(size=1))
+            body = json.dumps({"event": "nope", "data": {}}).encode()
+            return await consumer.process_message(self.channel, FakeMethod(7), None, body)
+
+        self.assertFalse(asyncio.run(scenario()))
+        self.assertEqual(self.channel.rejects, [(7, False)])
+        self.assertEqual(self.server.messages, [])
+
+    def test_stop_while_broker_unreachable(self):
+        async def scenario():
+            consumer = AsyncRabbitMQConsumer(
+                smtp_pool=self.make_pool(size=1), backoff=ExponentialBackoff(base=60, cap=60)
+            )
+            await consumer.start()
+            await asyncio.sleep(0.2)
+            await asyncio.wait_for(consumer.stop(), timeout=5)
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import time
+import unittest
+from unittest import mock
+from sending_emails.core.batching import MicroBatcher
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback
+from sending_emails.core.retry import dead_letter_queue_name
+from sending_emails.emails.encryption_utils import encrypt_data
+from sending_emails.emails.helpers import OutgoingEmail, deliver_emails
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeConnection, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+
+def otp_body(index, otp_reason="Login"):
+    return json.dumps({
+        "event": "user_otp_request",
+        "data": {
+            "user_email": f"user{index}@example.com",
+            "user_fullname": "Jane",
+            "otp_reason": otp_reason,
+            "otp": encrypt_data("123456"),
+        },
+    }).encode()
+
+
+class TestMicroBatching(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, "user", "secret", use_ssl=False, size=4
+        )
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = FakeConnection()
+        self.channel = FakeChannel()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_full_batch_is_sent_in_one_session(self):
+        batcher = MicroBatcher(self.connection, rabitmq_consumer_batch_callback, batch_size=10, max_wait=60)
+        for tag in range(1, 11):
+            batcher.add(self.channel, FakeMethod(tag), None, otp_body(tag))
+        self.assertEqual(sorted(self.channel.acks), list(range(1, 11)))
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.connection.timers, {})
+
+    def test_partial_batch_flushed_after_max_wait(self):
+        batcher = MicroBatcher(self.connection, rabitmq_consumer_batch_callback, batch_size=50, max_wait=0.05)
+        for tag in range(1, 4):
+            batcher.add(self.channel, FakeMethod(tag), None, otp_body(tag))
+        self.assertEqual(self.channel.acks, [])
+        time.sleep(0.06)
+        self.connection.process_data_events()
+        self.assertEqual(sorted(self.channel.acks), [1, 2, 3])
+
+    def test_each_delivery_acked_on_its_own_result(self):
+        self.server.queue_response("RCPT", "550 No such user")
+        invalid = json.dumps({"event": "user_otp_request", "data": {}}).encode()
+        batcher = MicroBatcher(self.connection, rabitmq_consumer_batch_callback, batch_size=4, max_wait=60)
+        batcher.add(self.channel, FakeMethod(1), None, otp_body(1))
+        batcher.add(self.channel, FakeMethod(2), None, invalid)
+        batcher.add(self.channel, FakeMethod(3), None, otp_body(3))
+        batcher.add(self.channel, FakeMethod(4), None, otp_body(4))
+
+        # A 550 fails the same way on every retry: straight to the DLQ
+        self.assertEqual(
+            [routing_key for _, routing_key, _, _ in self.channel.published], [dead_letter_queue_name()]
+        )
+        self.assertEqual(self.channel.nacks, [])
+        self.assertEqual(self.channel.rejects, [(2, False)])
+        self.assertEqual(sorted(self.channel.acks), [1, 3, 4])
+        self.assertEqual(self.server.logins, 1)
+
+    def test_header_injection_only_rejects_its_own_delivery(self):
+        batcher = MicroBatcher(self.connection, rabitmq_consumer_batch_callback, batch_size=3, max_wait=60)
+        batcher.add(self.channel, FakeMethod(1), None, otp_body(1))
+        batcher.add(self.channel, FakeMethod(2), None, otp_body(2, "Login\nBcc: x@evil.com"))
+        batcher.add(self.channel, FakeMethod(3), None, otp_body(3))
+
+        self.assertEqual(self.channel.rejects, [(2, False)])
+        self.assertEqual(sorted(self.channel.acks), [1, 3])
+        self.assertEqual(self.channel.nacks, [])
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_unbuildable_message_fails_only_its_slot(self):
+        emails = [
+            OutgoingEmail("Hi", "user1@example.com", "<p>hi</p>"),
+            OutgoingEmail("Hi\r\nBcc: x@evil.com", "user2@example.com", "<p>hi</p>"),
+            OutgoingEmail("Hi", "user3@example.com", "<p>hi</p>"),
+        ]
+        errors = deliver_emails(emails, pool=self.pool)
+        self.assertEqual((errors[0], errors[2]), (None, None))
+        self.assertIsInstance(errors[1], ValueError)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_failed_batch_nacks_only_unsettled_deliveries(self):
+        invalid = json.dumps({"event": "user_otp_request", "data": {}}).encode()
+        batcher = MicroBatcher(self.connection, rabitmq_consumer_batch_callback, batch_size=3, max_wait=60)
+        with mock.patch(
+            "sending_emails.core.rabitmq_consumer.deliver_emails", side_effect=RuntimeError("boom")
+        ):
+            batcher.add(self.channel, FakeMethod(1), None, otp_body(1))
+            batcher.add(self.channel, FakeMethod(2), None, invalid)
+            batcher.add(self.channel, FakeMethod(3, redelivered=True), None, otp_body(3))
+
+        self.assertEqual(self.channel.rejects, [(2, False)])
+        self.assertEqual(self.channel.nacks, [(1, True), (3, False)])
+
+    def test_batches_on_worker_threads_ack_via_connection(self):
+        batcher = MicroBatcher(
+            self.connection, rabitmq_consumer_batch_callback, batch_size=5, max_wait=60, workers=2
+        )
+        for tag in range(1, 11):
+            batcher.add(self.channel, FakeMethod(tag), None, otp_body(tag))
+        deadline = time.monotonic() + 5
+        while len(self.channel.acks) < 10 and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.01)
+        batcher.shutdown()
+        self.assertEqual(sorted(self.channel.acks), list(range(1, 11)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_callback
+from sending_emails.emails.encryption_utils import encrypt_data
+from sending_emails.emails.events import EmailEvent, EmailEventRegistry
+from sending_emails.emails.send_mails import InvalidEmailPayload, get_email_event
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+CREDENTIALS_DATA = {
+    "user_fullname": "Jane Doe",
+    "user_email": "jane@example.com",
+    "hospital_name": "General Hospital",
+    "account_created": "2026-01-01",
+}
+
+EVENT_DATA = {
+    "user_otp_request": {
+        "user_email": "jane@example.com",
+        "user_fullname": "Jane Doe",
+        "otp_reason": "Login Verification",
+        "otp": "482913",
+    },
+    "technician_create_by_hospital_admin": {**CREDENTIALS_DATA, "password": "pw-tech"},
+    "doctor_reviewer_create_by_hospital_admin": {**CREDENTIALS_DATA, "password": "pw-rev"},
+    "doctor_admin_create_by_hospital_admin": {**CREDENTIALS_DATA, "password": "pw-admin"},
+    "user_credentials_updated_by_hospital_admin": {
+        **CREDENTIALS_DATA,
+        "role": "DOCTOR_ADMIN",
+        "password": "pw-updated",
+    },
+}
+
+
+def encrypted(data):
+    data = dict(data)
+    for field in ("otp", "password"):
+        if field in data:
+            data[field] = encrypt_data(data[field])
+    return data
+
+
+def delivery_body(event, data):
+    return json.dumps({"event": event, "data": data}).encode()
+
+
+class TestEmailEvents(unittest.TestCase):
+    def test_builds_every_registered_event(self):
+        for event, data in EVENT_DATA.items():
+            with self.subTest(event=event):
+                email = get_email_event(event).build(encrypted(data))
+                self.assertEqual(email.recipient, "jane@example.com")
+                self.assertIn(data.get("otp") or data.get("password"), email.html_content)
+
+    def test_credentials_updated_subject_uses_role_label(self):
+        data = encrypted(EVENT_DATA["user_credentials_updated_by_hospital_admin"])
+        email = get_email_event("user_credentials_updated_by_hospital_admin").build(data)
+        self.assertEqual(email.subject, "Your Doctor Administrator Account Credentials")
+
+    def test_missing_required_fields_rejected_before_decrypt(self):
+        with self.assertRaises(InvalidEmailPayload):
+            get_email_event("user_otp_request").build({"user_email": "jane@example.com"})
+        with self.assertRaises(InvalidEmailPayload):
+            get_email_event("user_otp_request").build(
+                {"user_email": "jane@example.com", "otp": "not-a-token"}
+            )
+
+    def test_invalid_recipient_rejected(self):
+        data = encrypted(EVENT_DATA["user_otp_request"])
+        data["user_email"] = "not an address"
+        with self.assertRaisesRegex(InvalidEmailPayload, "invalid user_email"):
+            get_email_event("user_otp_request").build(data)
+
+    def test_line_breaks_in_the_subject_are_rejected(self):
+        cases = (
+            ("user_otp_request", "otp_reason", "Login\nBcc: x@evil.com"),
+            ("user_credentials_updated_by_hospital_admin", "role", "Admin\r\nBcc: x@evil.com"),
+        )
+        for event, field, value in cases:
+            with self.subTest(field=field):
+                data = encrypted({**EVENT_DATA[event], field: value})
+                with self.assertRaisesRegex(InvalidEmailPayload, "single line"):
+                    get_email_event(event).build(data)
+
+    def test_schema_errors_do_not_echo_the_payload(self):
+        with self.assertRaises(InvalidEmailPayload) as caught:
+            get_email_event("user_otp_request").validate({"user_email": "jane@example.com", "otp": "482913"})
+        self.assertEqual(str(caught.exception), "user_otp_request: invalid otp")
+
+    def test_extra_fields_reach_enrich(self):
+        data = encrypted(EVENT_DATA["user_credentials_updated_by_hospital_admin"])
+        validated = get_email_event("user_credentials_updated_by_hospital_admin").validate(data)
+        self.assertEqual(validated["role"], "DOCTOR_ADMIN")
+
+    def test_duplicate_registration_rejected(self):
+        registry = EmailEventRegistry()
+        event = EmailEvent("custom", "unused.html", subject=lambda replacements: "Hi")
+        registry.register(event)
+        self.assertIs(registry.get("custom"), event)
+        with self.assertRaises(ValueError):
+            registry.register(event)
+
+
+class TestConsumerCallback(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, "user", "secret", use_ssl=False, size=1
+        )
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = FakeChannel()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_every_event_is_sent_and_acked(self):
+        stdout = io.StringIO()
+        for tag, (event, data) in enumerate(EVENT_DATA.items(), start=1):
+            body = delivery_body(event, encrypted(data))
+            with redirect_stdout(stdout):
+                self.assertTrue(rabitmq_consumer_callback(self.channel, FakeMethod(tag), None, body))
+        # Payloads carry secrets: nothing of them may reach stdout
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(self.channel.acks, [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.server.messages), 5)
+
+    def test_unknown_event_is_rejected_without_requeue(self):
+        result = rabitmq_consumer_callback(
+            self.channel, FakeMethod(9), None, delivery_body("collubi_paypal_send_mail", {})
+        )
+        self.assertFalse(result)
+        self.assertEqual(self.channel.rejects, [(9, False)])
+        self.assertEqual(self.server.messages, [])
+
+    def test_malformed_json_is_rejected_without_requeue(self):
+        self.assertFalse(rabitmq_consumer_callback(self.channel, FakeMethod(3), None, b'{"event": '))
+        self.assertEqual(self.channel.rejects, [(3, False)])
+        self.assertEqual(self.server.messages, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
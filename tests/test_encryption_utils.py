@@ -0,0 +1,60 @@
+import time
+import unittest
+from cryptography.fernet import Fernet, InvalidToken
+from sending_emails.emails import encryption_utils
+from sending_emails.emails.encryption_utils import (
+    ExpiredToken,
+    build_keyring,
+    decrypt_bytes,
+    decrypt_data,
+    encrypt_data,
+    rotate_token,
+    token_timestamp,
+)
+from sending_emails.emails.send_mails import ExpiredEmailPayload, get_email_event
+
+
+class TestKeyring(unittest.TestCase):
+    def setUp(self):
+        self.current, self.previous = Fernet.generate_key(), Fernet.generate_key()
+        self.keyring = build_keyring(self.current, [self.previous])
+
+    def test_tokens_from_previous_key_still_decrypt(self):
+        old_token = Fernet(self.previous).encrypt(b"482913")
+        self.assertEqual(decrypt_bytes(old_token, keyring=self.keyring), b"482913")
+        self.assertEqual(decrypt_bytes(old_token.decode(), keyring=self.keyring), b"482913")
+
+    def test_unknown_key_rejected(self):
+        foreign = Fernet(Fernet.generate_key()).encrypt(b"482913")
+        with self.assertRaises(InvalidToken):
+            decrypt_bytes(foreign, keyring=self.keyring)
+
+    def test_rotate_token_reencrypts_under_current_key(self):
+        old_token = Fernet(encryption_utils.FERNET_KEY).encrypt(b"secret")
+        rotated = rotate_token(old_token)
+        self.assertEqual(decrypt_data(rotated), "secret")
+
+
+class TestTokenTTL(unittest.TestCase):
+    def test_timestamp_read_without_verifying(self):
+        token = Fernet(encryption_utils.FERNET_KEY).encrypt_at_time(b"x", 1_700_000_000)
+        self.assertEqual(token_timestamp(token), 1_700_000_000)
+        with self.assertRaises(InvalidToken):
+            token_timestamp("not-a-token")
+
+    def test_stale_token_expires_fresh_token_passes(self):
+        stale = Fernet(encryption_utils.FERNET_KEY).encrypt_at_time(b"1", int(time.time()) - 900)
+        with self.assertRaises(ExpiredToken):
+            decrypt_data(stale.decode(), ttl=600)
+        self.assertEqual(decrypt_data(encrypt_data("1"), ttl=600), "1")
+
+    def test_stale_otp_dropped_before_rendering(self):
+        stale = Fernet(encryption_utils.FERNET_KEY).encrypt_at_time(b"482913", int(time.time()) - 3600)
+        with self.assertRaises(ExpiredEmailPayload):
+            get_email_event("user_otp_request").build(
+                {"user_email": "jane@example.com", "otp": stale.decode()}
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import unittest
+from unittest import mock
+from sending_emails.core.health import QUEUE_BACKLOG, ConsumerState, QueueBacklogProbe
+from sending_emails.core.lanes import BULK_LANE, PRIORITY_LANE
+from sending_emails.core.metrics import MESSAGES_IN_FLIGHT
+from sending_emails.core.monitoring import healthz, readyz
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeBlockingConnection
+from tests.fake_smtp import FakeSMTPServer
+
+
+class BrokerDown(Exception):
+    pass
+
+
+class TestQueueBacklogProbe(unittest.TestCase):
+    def test_reads_every_lane_and_caches_it(self):
+        connections = []
+
+        def connect():
+            connection = FakeBlockingConnection()
+            connection.channel_obj.message_count = 42
+            connections.append(connection)
+            return connection
+
+        probe = QueueBacklogProbe(cache_seconds=60, connect=connect)
+        reading = probe.read()
+        self.assertEqual(reading["messages"], 84)
+        self.assertEqual(set(reading["queues"]), {BULK_LANE.queue, PRIORITY_LANE.queue})
+        self.assertEqual(probe.read()["consumers"], 1)
+        self.assertEqual(len(connections), 1)
+        self.assertFalse(connections[0].is_open)
+        self.assertEqual(QUEUE_BACKLOG.values()[(PRIORITY_LANE.queue,)], 42)
+
+    def test_unreachable_broker_reports_unknown_backlog(self):
+        def connect():
+            raise BrokerDown("refused")
+
+        reading = QueueBacklogProbe(cache_seconds=0, connect=connect).read()
+        self.assertIsNone(reading["messages"])
+        self.assertIn("refused", reading["error"])
+
+
+class TestConsumerState(unittest.TestCase):
+    def setUp(self):
+        self.backlog = 0
+
+        def connect():
+            connection = FakeBlockingConnection()
+            connection.channel_obj.message_count = self.backlog
+            return connection
+
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False)
+        self.running = True
+        self.state = ConsumerState(
+            backlog_probe=QueueBacklogProbe(cache_seconds=0, connect=connect),
+            stall_seconds=60,
+        )
+        self.state.watch(lambda: self.running, self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_ready_once_connected(self):
+        self.assertFalse(self.state.readiness()[0])
+        self.state.mark_connected()
+        ready, report = self.state.readiness()
+        self.assertTrue(ready, report["problems"])
+        self.assertTrue(report["smtp"]["healthy"])
+
+    def test_dead_consumer_thread_fails_liveness(self):
+        self.state.mark_connected()
+        self.running = False
+        alive, report = self.state.liveness()
+        self.assertFalse(alive)
+        self.assertEqual(report["problems"], ["consumer is not running"])
+
+    def test_broker_outage_fails_readiness_only(self):
+        self.state.mark_connected()
+        self.state.mark_disconnected(BrokerDown("gone"))
+        self.state.changed_at -= 3600
+        alive, report = self.state.liveness()
+        self.assertTrue(alive, report["problems"])
+        self.assertIn("gone", report["broker"]["last_error"])
+        ready, report = self.state.readiness()
+        self.assertFalse(ready)
+        self.assertIn("broker not connected", report["problems"])
+
+    def test_backlog_without_progress_fails_readiness_only(self):
+        self.state.mark_connected()
+        self.state.mark_settled(acked=True)
+        self.backlog = 500
+        self.assertTrue(self.state.readiness()[0])
+        self.state.last_settled_at -= 61
+        self.state.changed_at -= 61
+        self.assertTrue(self.state.liveness()[0])
+        ready, report = self.state.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(report["backlog"]["messages"], 1000)
+        self.assertIsNotNone(report["last_ack_at"])
+
+    def test_deliveries_held_without_progress_are_a_stall(self):
+        self.state.mark_connected()
+        MESSAGES_IN_FLIGHT.inc()
+        self.addCleanup(MESSAGES_IN_FLIGHT.dec)
+        self.assertTrue(self.state.liveness()[0])
+        self.state.changed_at -= 61
+        alive, report = self.state.liveness()
+        self.assertFalse(alive)
+        self.assertEqual(report["problems"], ["1 in flight but nothing settled for 61s"])
+
+    def test_failing_smtp_relay_fails_readiness(self):
+        self.state.mark_connected()
+        self.server.stop()
+        for _ in range(self.pool.unhealthy_after):
+            with self.assertRaises(OSError):
+                self.pool.sendmail("a@example.com", ["b@example.com"], "hi")
+        ready, report = self.state.readiness()
+        self.assertFalse(ready)
+        self.assertFalse(report["smtp"]["healthy"])
+        self.assertTrue(self.state.liveness()[0])
+
+
+class TestProbeEndpoints(unittest.TestCase):
+    def test_endpoints_map_state_to_status_codes(self):
+        state = ConsumerState(backlog_probe=QueueBacklogProbe(cache_seconds=0, connect=FakeBlockingConnection))
+        patcher = mock.patch("sending_emails.core.monitoring.consumer_state", state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.assertEqual(healthz().status_code, 503)
+        state.watch(lambda: True, None)
+        self.assertEqual(healthz().status_code, 200)
+        response = readyz()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("SMTP pool not started", json.loads(response.body)["problems"])
+
+
+if __name__ == "__main__":
+    unittest.main()
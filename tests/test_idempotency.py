@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sending_emails.core.batching import Delivery
+from sending_emails.core.idempotency import IdempotencyCache, SQLiteIdempotencyBackend, delivery_key
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback, rabitmq_consumer_callback
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeMethod, FakeProperties
+from tests.fake_smtp import FakeSMTPServer
+from tests.test_batching import otp_body
+from tests.test_rate_limit import FakeClock
+
+
+class TestIdempotencyCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_delivery_key_prefers_the_message_id(self):
+        self.assertEqual(delivery_key(FakeProperties(message_id="abc"), b"{}"), "id:abc")
+        self.assertEqual(delivery_key(None, b"{}"), delivery_key(FakeProperties(), b"{}"))
+        self.assertNotEqual(delivery_key(None, b"{}"), delivery_key(None, b"[]"))
+
+    def test_keys_expire_after_the_ttl(self):
+        cache = IdempotencyCache(max_entries=10, ttl=60, clock=self.clock)
+        cache.remember("a")
+        self.clock.now += 59
+        self.assertTrue(cache.seen("a"))
+        self.clock.now += 2
+        self.assertFalse(cache.seen("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_seen_key_is_evicted(self):
+        cache = IdempotencyCache(max_entries=2, ttl=60, clock=self.clock)
+        cache.remember("a")
+        cache.remember("b")
+        cache.seen("a")
+        cache.remember("c")
+        self.assertTrue(cache.seen("a"))
+        self.assertFalse(cache.seen("b"))
+
+    def test_sqlite_backend_is_shared_between_caches(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "delivered.sqlite3")
+        first = IdempotencyCache(ttl=60, backend=SQLiteIdempotencyBackend(path), clock=self.clock)
+        second = IdempotencyCache(ttl=60, backend=SQLiteIdempotencyBackend(path), clock=self.clock)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+
+        first.remember("id:1")
+        self.assertTrue(second.seen("id:1"))
+        self.assertFalse(second.seen("id:2"))
+        self.clock.now += 61
+        self.assertFalse(second.seen("id:1"))
+
+
+class TestConsumerDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False)
+        self.cache = IdempotencyCache()
+        for target, value in (
+            ("sending_emails.emails.smtp_pool._smtp_pool", self.pool),
+            ("sending_emails.core.idempotency._idempotency_cache", self.cache),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.channel = FakeChannel()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_redelivery_is_acked_without_sending_again(self):
+        body = otp_body(1)
+        properties = FakeProperties(message_id="otp-1")
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), properties, body)
+        rabitmq_consumer_callback(self.channel, FakeMethod(2, redelivered=True), properties, body)
+
+        self.assertEqual(self.channel.acks, [1, 2])
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_failed_send_is_not_remembered(self):
+        self.server.queue_response("RCPT", "451 Mailbox busy")
+        properties = FakeProperties(message_id="otp-1")
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), properties, otp_body(1))
+        self.assertFalse(self.cache.seen("id:otp-1"))
+
+    def test_duplicates_within_a_batch_are_sent_once(self):
+        body = otp_body(1)
+        deliveries = [
+            Delivery(FakeMethod(tag), FakeProperties(message_id="otp-1"), body) for tag in (1, 2)
+        ]
+        results = rabitmq_consumer_batch_callback(self.channel, deliveries)
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(sorted(self.channel.acks), [1, 2])
+        self.assertEqual(len(self.server.messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import unittest
+from unittest import mock
+from sending_emails.core import rabitmq_publisher
+from sending_emails.core.ingestion import INGESTED_TOTAL, ingest_batch, publish_email_batch
+from sending_emails.core.lanes import PRIORITY_LANE
+from sending_emails.emails.payloads import decode_payload
+from tests.fake_broker import FakeBlockingConnection
+from tests.test_batching import otp_body
+
+
+AUTHORIZATION = "Bearer ingest-secret"
+
+
+def otp_item(index):
+    return json.loads(otp_body(index))
+
+
+def credentials_item(index):
+    return {
+        "event": "technician_create_by_hospital_admin",
+        "data": {"user_email": f"tech{index}@example.com", "password": otp_item(index)["data"]["otp"]},
+    }
+
+
+class TestBatchIngestion(unittest.TestCase):
+    def setUp(self):
+        FakeBlockingConnection.opened = []
+        for patcher in (
+            mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", FakeBlockingConnection),
+            mock.patch("sending_emails.core.ingestion.ingest_api_token", "ingest-secret"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(rabitmq_publisher.close_rabbit_mq_publishers)
+        INGESTED_TOTAL.reset()
+
+    def published(self):
+        return FakeBlockingConnection.opened[0].channel_obj.published
+
+    def test_batch_is_published_in_one_confirmed_round_trip(self):
+        items = [otp_item(index) for index in range(50)] + [credentials_item(1)]
+        response = publish_email_batch(items, AUTHORIZATION)
+        results = json.loads(response.body)["results"]
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(FakeBlockingConnection.opened), 1)
+        self.assertEqual(len(self.published()), 51)
+        self.assertEqual({result["status"] for result in results}, {"accepted"})
+        for result, (_, _, properties) in zip(results, self.published()):
+            self.assertEqual(properties.message_id, result["message_id"])
+        self.assertEqual(self.published()[0][0], PRIORITY_LANE.routing_key)
+        self.assertEqual(self.published()[-1][0], rabitmq_publisher.rabbitmq_routing_key)
+
+    def test_published_body_is_what_the_consumer_decodes(self):
+        item = otp_item(1)
+        ingest_batch([item])
+        self.assertEqual(decode_payload(self.published()[0][1]), item)
+
+    def test_invalid_items_are_reported_and_not_published(self):
+        bad_recipient = otp_item(2)
+        bad_recipient["data"]["user_email"] = "not-an-address"
+        items = [otp_item(1), "text", {"event": "no_such_event", "data": {}}, bad_recipient]
+        response = publish_email_batch(items, AUTHORIZATION)
+        results = json.loads(response.body)["results"]
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result["status"] for result in results], ["accepted", "invalid", "invalid", "invalid"])
+        self.assertIn("no_such_event", results[2]["error"])
+        self.assertIn("invalid user_email", results[3]["error"])
+        self.assertNotIn("not-an-address", results[3]["error"])
+        self.assertEqual(len(self.published()), 1)
+        self.assertEqual(INGESTED_TOTAL.values()[("invalid", "invalid")], 2)
+
+    def test_unconfirmed_items_are_failed(self):
+        rabitmq_publisher.get_rabbit_mq_publisher()
+        FakeBlockingConnection.opened[0].channel_obj.nack_tags = {2}
+        results = ingest_batch([otp_item(index) for index in range(3)])
+        self.assertEqual([result["status"] for result in results], ["accepted", "failed", "accepted"])
+        self.assertNotIn("message_id", results[1])
+
+    def test_batch_of_invalid_items_skips_the_broker(self):
+        publisher = mock.Mock()
+        results = ingest_batch([{"event": "user_otp_request", "data": {}}], publisher=publisher)
+        publisher.publish_many.assert_not_called()
+        self.assertEqual(results[0]["status"], "invalid")
+
+    def test_oversized_batch_is_refused(self):
+        with mock.patch("sending_emails.core.ingestion.ingest_max_batch_size", 2):
+            response = publish_email_batch([otp_item(index) for index in range(3)], AUTHORIZATION)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(FakeBlockingConnection.opened, [])
+
+    def test_requests_without_the_token_are_refused(self):
+        for authorization in (None, "", "Bearer wrong", "Basic ingest-secret", "ingest-secret"):
+            response = publish_email_batch([otp_item(1)], authorization)
+            self.assertEqual(response.status_code, 401, authorization)
+        with mock.patch("sending_emails.core.ingestion.ingest_api_token", ""):
+            self.assertEqual(publish_email_batch([otp_item(1)], "Bearer ").status_code, 401)
+        self.assertEqual(FakeBlockingConnection.opened, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
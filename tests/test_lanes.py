@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from sending_emails.core import rabitmq_publisher
+from sending_emails.core.batching import MicroBatcher
+from sending_emails.core.lanes import (
+    BULK_LANE,
+    DELIVERY_LATENCY,
+    PRIORITY_LANE,
+    PUBLISHED_AT_HEADER,
+    is_priority_delivery,
+    message_priority,
+    record_delivery_latency,
+)
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.core.rabitmq_publisher import get_rabbit_mq_publisher
+from sending_emails.core.retry import retry_or_dead_letter, retry_queue_name
+from sending_emails.core.worker_pool import ConcurrentDispatcher
+from sending_emails.emails.events import RetryPolicy
+from tests.fake_broker import FakeBlockingConnection, FakeBroker, FakeChannel, FakeConnection, FakeMethod, FakeProperties
+
+OTP = json.dumps({"event": "user_otp_request", "data": {}}).encode()
+CREDENTIALS = json.dumps({"event": "technician_create_by_hospital_admin", "data": {}}).encode()
+
+
+def priority_method(tag):
+    return FakeMethod(tag, routing_key=PRIORITY_LANE.routing_key)
+
+
+def bulk_method(tag):
+    return FakeMethod(tag, routing_key=BULK_LANE.routing_key)
+
+
+class TestPublisherLanes(unittest.TestCase):
+    def setUp(self):
+        FakeBlockingConnection.opened = []
+        patcher = mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", FakeBlockingConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rabitmq_publisher.close_rabbit_mq_publishers)
+
+    def test_event_priority_picks_the_lane(self):
+        self.assertEqual(message_priority(OTP), 9)
+        self.assertEqual(message_priority(CREDENTIALS), 0)
+        self.assertEqual(message_priority(b"not json"), 0)
+
+        publisher = get_rabbit_mq_publisher()
+        self.assertEqual(publisher.publish_many([OTP, CREDENTIALS], ttl=60), [True, True])
+        (otp_key, _, otp_properties), (bulk_key, _, bulk_properties) = FakeBlockingConnection.opened[0].channel_obj.published
+        self.assertEqual((otp_key, bulk_key), (PRIORITY_LANE.routing_key, BULK_LANE.routing_key))
+        # The lane does the prioritising; the queues take no AMQP priority
+        self.assertEqual((otp_properties.priority, bulk_properties.priority), (None, None))
+        self.assertIn(PUBLISHED_AT_HEADER, otp_properties.headers)
+
+    def test_explicit_priority_overrides_the_event(self):
+        publisher = get_rabbit_mq_publisher()
+        publisher.publish_message(CREDENTIALS, ttl=60, priority=7)
+        routing_key, _, _ = FakeBlockingConnection.opened[0].channel_obj.published[0]
+        self.assertEqual(routing_key, PRIORITY_LANE.routing_key)
+
+
+class TestConsumerLanes(unittest.TestCase):
+    def test_each_lane_is_consumed_with_its_own_prefetch(self):
+        broker = FakeBroker()
+        RabbitMQConsumerSupervisor(connect=broker.connect).run("1")
+        self.assertEqual(broker.subscriptions, [PRIORITY_LANE.queue, BULK_LANE.queue])
+        self.assertEqual(broker.prefetch_counts[PRIORITY_LANE.queue], PRIORITY_LANE.prefetch_count)
+        self.assertEqual(broker.prefetch_counts[BULK_LANE.queue], BULK_LANE.prefetch_count)
+
+    def test_waiting_priority_delivery_overtakes_queued_bulk(self):
+        order = []
+        release = threading.Event()
+
+        def callback(ch, method, properties, body):
+            if method.delivery_tag == 1:
+                release.wait(2)
+            order.append(method.delivery_tag)
+
+        dispatcher = ConcurrentDispatcher(
+            FakeConnection(), callback, workers=1,
+            rank=lambda method: 0 if is_priority_delivery(method) else 1,
+        )
+        dispatcher.dispatch(FakeChannel(), bulk_method(1), None, b"{}")
+        time.sleep(0.05)
+        for method in (bulk_method(2), bulk_method(3), priority_method(4)):
+            dispatcher.dispatch(FakeChannel(), method, None, b"{}")
+        release.set()
+        deadline = time.monotonic() + 2
+        while len(order) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        dispatcher.shutdown()
+        self.assertEqual(order, [1, 4, 2, 3])
+
+    def test_priority_delivery_skips_the_batch_wait(self):
+        batches = []
+        batcher = MicroBatcher(
+            FakeConnection(), lambda ch, batch: batches.append([d.method.delivery_tag for d in batch]),
+            batch_size=10, max_wait=60, urgent=is_priority_delivery,
+        )
+        batcher.add(FakeChannel(), bulk_method(1), None, b"{}")
+        batcher.add(FakeChannel(), priority_method(2), None, b"{}")
+        self.assertEqual(batches, [[2]])
+        batcher.flush()
+        self.assertEqual(batches, [[2], [1]])
+
+    def test_retried_priority_delivery_stays_in_its_lane(self):
+        channel = FakeChannel()
+        retry_or_dead_letter(
+            channel, priority_method(1), FakeProperties(), OTP,
+            RetryPolicy(max_retries=1, delays=(5,)), TimeoutError("relay timed out"),
+        )
+        self.assertEqual(channel.published[0][1], retry_queue_name(5, PRIORITY_LANE.queue))
+
+    def test_latency_is_recorded_per_lane(self):
+        DELIVERY_LATENCY.reset()
+        properties = FakeProperties(headers={PUBLISHED_AT_HEADER: time.time() - 2})
+        record_delivery_latency(priority_method(1), properties, "user_otp_request")
+        record_delivery_latency(bulk_method(2), FakeProperties(), "user_otp_request")
+        (labels, counts), = DELIVERY_LATENCY.values().items()
+        self.assertEqual(labels, ("priority", "user_otp_request"))
+        self.assertGreaterEqual(counts[-1], 2)
+
+    def test_malformed_publish_time_is_ignored(self):
+        DELIVERY_LATENCY.reset()
+        for published_at in ("yesterday", b"\xff", ["1"], "nan"):
+            properties = FakeProperties(headers={PUBLISHED_AT_HEADER: published_at})
+            record_delivery_latency(priority_method(1), properties, "user_otp_request")
+        self.assertEqual(DELIVERY_LATENCY.values(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
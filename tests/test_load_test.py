@@ -0,0 +1,44 @@
+import json
+import unittest
+from benchmarks.load_test import Scenario, regressions, run_scenario
+from benchmarks.workload import EVENT_MIX, generate
+from sending_emails.emails.send_mails import resolve_email
+from tests.fake_smtp import FakeSMTPServer
+
+
+class TestWorkload(unittest.TestCase):
+    def test_mix_covers_every_event_with_valid_payloads(self):
+        messages = generate(200)
+        self.assertEqual({message.event for message in messages}, set(EVENT_MIX))
+        # Same seed, same traffic (ciphertexts differ: Fernet uses a random IV)
+        self.assertEqual([message.event for message in generate(5)], [message.event for message in messages[:5]])
+        for message in messages[:20]:
+            email_event, email = resolve_email(json.loads(message.body))
+            self.assertEqual(email_event.name, message.event)
+            self.assertTrue(email.text_content)
+        self.assertTrue(any(message.priority for message in messages))
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_scenario_settles_everything_and_reports_latency_and_stages(self):
+        server = FakeSMTPServer().start()
+        self.addCleanup(server.stop)
+        result = run_scenario(Scenario("smoke", workers=2, batch_size=5), generate(30), server)
+
+        self.assertEqual(len(server.messages), 30)
+        self.assertGreater(result["msgs_per_sec"], 0)
+        self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+        self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+        self.assertIn("smtp_send", result["stages_ms"])
+        self.assertIn("decrypt", result["stages_ms"])
+
+    def test_regressions_beyond_the_tolerance_are_reported(self):
+        baselines = {"inline": {"msgs_per_sec": 100, "p95_ms": 10}}
+        self.assertEqual(regressions({"inline": {"msgs_per_sec": 80, "p95_ms": 12}}, baselines, 0.25), [])
+        problems = regressions({"inline": {"msgs_per_sec": 70, "p95_ms": 13}}, baselines, 0.25)
+        self.assertEqual(len(problems), 2)
+        self.assertEqual(regressions({"new": {"msgs_per_sec": 1, "p95_ms": 1}}, baselines, 0.25), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import gc
+import json
+import threading
+import unittest
+from unittest import mock
+from sending_emails.core import metrics
+from sending_emails.core.metrics import Counter, Gauge, Histogram, STAGE_SECONDS, MESSAGES_TOTAL
+from sending_emails.core.monitoring import metrics as metrics_endpoint
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_callback
+from sending_emails.emails.encryption_utils import encrypt_data
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeMethod
+from tests.fake_smtp import FakeSMTPServer
+
+
+class TestShardedMetrics(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, "REGISTRY", [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counter_sums_per_thread_shards(self):
+        counter = Counter("test_total", "Test counter", ("kind",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(("a",))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(("b",), 2)
+        self.assertEqual(counter.values(), {("a",): 8000, ("b",): 2})
+        self.assertIn('test_total{kind="a"} 8000', counter.collect())
+
+    def test_gauge_deltas_from_different_threads_cancel_out(self):
+        gauge = Gauge("test_in_flight", "Test gauge")
+        gauge.inc(amount=3)
+        thread = threading.Thread(target=gauge.dec, kwargs={"amount": 2})
+        thread.start()
+        thread.join()
+        self.assertEqual(gauge.values(), {(): 1})
+        gauge.set(value=10)
+        self.assertEqual(gauge.values(), {(): 10})
+
+    def test_histogram_exports_cumulative_buckets(self):
+        histogram = Histogram("test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(("render",), value)
+        self.assertEqual(
+            histogram.collect(),
+            [
+                'test_seconds_bucket{stage="render",le="0.1"} 1',
+                'test_seconds_bucket{stage="render",le="1.0"} 3',
+                'test_seconds_bucket{stage="render",le="+Inf"} 4',
+                'test_seconds_sum{stage="render"} 6.05',
+                'test_seconds_count{stage="render"} 4',
+            ],
+        )
+
+    def test_shards_of_finished_threads_are_folded_into_the_base(self):
+        counter = Counter("test_folded_total", "Test counter")
+        histogram = Histogram("test_folded_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0))
+
+        def work():
+            counter.inc()
+            histogram.observe(("send",), 0.5)
+
+        for _ in range(20):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        self.assertEqual((len(counter._shards), len(histogram._shards)), (1, 1))
+        self.assertEqual(counter.values(), {(): 20})
+        self.assertEqual(histogram.values(), {("send",): [0, 20, 0, 10.0]})
+        counter.reset()
+        self.assertEqual(counter.values(), {})
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("test_total", "Test counter", ("event",))
+        counter.inc(('say "hi"',))
+        self.assertEqual(counter.collect(), ['test_total{event="say \\"hi\\""} 1'])
+
+
+class TestConsumerMetrics(unittest.TestCase):
+    def setUp(self):
+        STAGE_SECONDS.reset()
+        MESSAGES_TOTAL.reset()
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, "user", "secret", use_ssl=False, size=1
+        )
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_every_stage_is_timed_under_the_event(self):
+        body = json.dumps({
+            "event": "user_otp_request",
+            "data": {
+                "user_email": "user@example.com",
+                "user_fullname": "Jane",
+                "otp_reason": "Login",
+                "otp": encrypt_data("123456"),
+            },
+        }).encode()
+        channel = FakeChannel()
+        rabitmq_consumer_callback(channel, FakeMethod(1), None, body)
+        rabitmq_consumer_callback(channel, FakeMethod(2), None, b'{"event": "nope"}')
+
+        stages = STAGE_SECONDS.values()
+        for stage in ("decode", "decrypt", "render", "smtp_connect", "smtp_login", "smtp_send", "ack"):
+            self.assertEqual(sum(stages[(stage, "user_otp_request")][:-1]), 1, stage)
+        self.assertEqual(
+            MESSAGES_TOTAL.values(),
+            {("user_otp_request", "acked"): 1, ("nope", "rejected"): 1},
+        )
+        self.assertEqual(metrics.MESSAGES_IN_FLIGHT.values(), {(): 0})
+
+    def test_endpoint_serves_prometheus_text(self):
+        MESSAGES_TOTAL.inc(("user_otp_request", "acked"))
+        response = metrics_endpoint()
+        text = response.body.decode()
+        self.assertTrue(response.media_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn("# TYPE email_stage_duration_seconds histogram", text)
+        self.assertIn('email_messages_total{event="user_otp_request",outcome="acked"} 1', text)
+        self.assertIn("# TYPE email_consumer_reconnects_total counter", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from email import policy
+from email.parser import BytesParser
+from benchmarks.bench_mime import legacy_build_mime_message
+from benchmarks.bench_templates import TEMPLATES, TEMPLATE_FOLDER_PATH
+from sending_emails.emails.events import EmailEvent
+from sending_emails.emails.mime import MessageSkeleton, build_mime_message, html_to_text
+from sending_emails.emails.template_engine import TemplateCache
+
+SENDER = "no-reply@example.com"
+
+
+def parse(message: bytes):
+    return BytesParser(policy=policy.SMTP).parsebytes(message)
+
+
+class TestBuildMimeMessage(unittest.TestCase):
+    def test_parses_like_the_email_package_output(self):
+        cache = TemplateCache()
+        for name, replacements in TEMPLATES.items():
+            template = cache.get(f"{TEMPLATE_FOLDER_PATH}/{name}")
+            html_content = template.render(replacements)
+            with self.subTest(template=name):
+                message = parse(
+                    build_mime_message(
+                        "Your credentials", SENDER, "jane@example.com", html_content,
+                        template.text.render(replacements),
+                    )
+                )
+                legacy = parse(
+                    legacy_build_mime_message("Your credentials", SENDER, "jane@example.com", html_content).encode()
+                )
+                self.assertEqual(message.defects, [])
+                for header in ("Subject", "From", "To", "MIME-Version"):
+                    self.assertEqual(message[header], legacy[header])
+                self.assertEqual(message.get_content_type(), "multipart/alternative")
+                plain, html = message.iter_parts()
+                self.assertEqual(plain.get_content_type(), "text/plain")
+                self.assertEqual(html.get_content(), legacy.get_body(("html",)).get_content())
+                self.assertIn(replacements["user_fullname"], plain.get_content())
+                self.assertNotIn("<", plain.get_content())
+
+    def test_lines_are_crlf_terminated_and_short(self):
+        message = build_mime_message("Hi", SENDER, "jane@example.com", "<p>" + "x" * 5000 + "</p>")
+        self.assertTrue(message.endswith(b"\r\n"))
+        for line in message.split(b"\r\n"):
+            self.assertNotIn(b"\n", line)
+            self.assertLessEqual(len(line), 78)
+
+    def test_non_ascii_and_long_headers_are_encoded(self):
+        subject = "Vos identifiants médecin — " * 4
+        message = build_mime_message(subject, SENDER, "jane@example.com", "<p>Café</p>")
+        self.assertTrue(message.isascii())
+        parsed = parse(message)
+        self.assertEqual(parsed["Subject"], subject)
+        self.assertEqual(parsed.get_body(("plain",)).get_content(), "Café\n")
+
+    def test_header_injection_is_refused(self):
+        with self.assertRaises(ValueError):
+            build_mime_message("Hi\r\nBcc: everyone@example.com", SENDER, "jane@example.com", "<p>x</p>")
+
+    def test_skeleton_is_reused_with_a_fixed_boundary(self):
+        skeleton = MessageSkeleton(SENDER, boundary="=_fixed")
+        message = skeleton.build("Hi", "jane@example.com", "<p>x</p>", "x\n")
+        self.assertEqual(parse(message).get_boundary(), "=_fixed")
+        self.assertEqual(message.count(b"--=_fixed\r\n"), 2)
+        self.assertTrue(message.endswith(b"--=_fixed--\r\n"))
+
+
+class TestPlainTextAlternative(unittest.TestCase):
+    def test_html_to_text_keeps_blocks_and_links(self):
+        text = html_to_text(
+            "<html><head><style>p {color: red}</style></head><body>"
+            "<h1>Hello&nbsp;Jane</h1><p>Your   code:<br>123</p>"
+            '<a href="https://example.com/login">Sign in</a></body></html>'
+        )
+        self.assertEqual(text, "Hello\xa0Jane\n\nYour code:\n123\n\nSign in (https://example.com/login)\n")
+
+    def test_template_text_is_converted_once(self):
+        template = TemplateCache().get(f"{TEMPLATE_FOLDER_PATH}/send_otp.html")
+        self.assertIs(template.text, template.text)
+        self.assertIn("otp", template.text.placeholders)
+
+    def test_events_build_a_text_alternative(self):
+        event = EmailEvent(
+            "inline", f"{TEMPLATE_FOLDER_PATH}/technician_credentials.html",
+            subject=lambda replacements: "Hi", fields=("user_fullname",),
+        )
+        email = event.build({"user_email": "jane@example.com", "user_fullname": "Jane Doe"})
+        self.assertIn("Jane Doe", email.text_content)
+        self.assertNotIn("<", email.text_content)
+
+
+if __name__ == "__main__":
+    unittest.main()
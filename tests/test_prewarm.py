@@ -0,0 +1,142 @@
+import asyncio
+import unittest
+from unittest import mock
+from sending_emails.core.health import ConsumerState
+from sending_emails.core.prewarm import (
+    STARTUP_SECONDS,
+    PrewarmError,
+    StartupReport,
+    begin_startup,
+    check_config,
+    check_startup,
+    compile_templates,
+)
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from sending_emails.emails.template_engine import TemplateCache
+from tests.fake_broker import FakeBroker
+from tests.fake_smtp import FakeSMTPServer
+
+
+class PrewarmTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state = ConsumerState(backlog_probe=mock.Mock(read=lambda: {"messages": 0}))
+        for target, value in (
+            ("sending_emails.core.prewarm.consumer_state", self.state),
+            ("sending_emails.emails.template_engine._template_cache", TemplateCache()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestStartupChecks(PrewarmTestCase):
+    def test_local_checks_are_timed(self):
+        report = begin_startup()
+        check_startup(report)
+        self.assertEqual(list(report.steps), ["config", "fernet_key", "templates"])
+        self.assertFalse(report.finished)
+        self.assertTrue(self.state.prewarming)
+
+    def test_every_event_template_is_compiled(self):
+        with mock.patch("sending_emails.emails.template_engine.get_template_cache") as cache:
+            self.assertEqual(compile_templates(), 5)
+        self.assertEqual(cache.return_value.get.call_count, 5)
+
+    def test_bad_settings_refuse_the_start(self):
+        with mock.patch("sending_emails.core.prewarm.consumer_mode", "threads"), \
+                mock.patch("sending_emails.core.prewarm.consumer_workers", 0):
+            with self.assertRaises(PrewarmError) as raised:
+                check_config()
+        self.assertIn("CONSUMER_MODE", str(raised.exception))
+        self.assertIn("CONSUMER_WORKERS", str(raised.exception))
+
+    def test_missing_template_is_fatal(self):
+        report = StartupReport()
+        with mock.patch("sending_emails.core.prewarm.get_template", side_effect=FileNotFoundError("gone.html")):
+            with self.assertRaises(PrewarmError):
+                check_startup(report)
+        self.assertIn("templates", report.steps)
+
+    def test_non_fatal_step_is_reported(self):
+        report = begin_startup()
+        with report.step("smtp", fatal=False):
+            raise OSError("relay unreachable")
+        summary = report.finish()
+
+        self.assertEqual(summary["problems"], ["smtp: relay unreachable"])
+        self.assertFalse(self.state.prewarming)
+        self.assertEqual(self.state.startup, summary)
+        self.assertEqual(STARTUP_SECONDS.values()[("total",)], report.total)
+
+
+class TestPrewarmedConsumer(PrewarmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False, size=4)
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_pool_prewarm_parks_logged_in_sessions(self):
+        self.assertEqual(self.pool.prewarm(2), 2)
+        self.assertEqual((self.pool.idle_count(), self.server.logins), (2, 2))
+        self.assertEqual(self.pool.prewarm(10), 4)
+
+    def test_async_pool_prewarm(self):
+        async def scenario():
+            pool = AsyncSMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False, size=4)
+            opened = await pool.prewarm(3)
+            idle = len(pool._idle)
+            await pool.close()
+            return opened, idle
+
+        self.assertEqual(asyncio.run(scenario()), (3, 3))
+        self.assertEqual(self.server.logins, 3)
+
+    def test_supervisor_prewarms_before_consuming(self):
+        at_consume = []
+        broker = FakeBroker(on_consume=lambda channel: at_consume.append(
+            (self.pool.idle_count(), self.state.prewarming, list(broker.subscriptions))
+        ))
+        startup = begin_startup()
+        RabbitMQConsumerSupervisor(connect=broker.connect, startup=startup).run("1")
+
+        idle, prewarming, subscriptions = at_consume[0]
+        self.assertEqual((idle, prewarming), (2, False))
+        self.assertTrue(subscriptions)
+        self.assertEqual(list(startup.steps), ["topology", "templates", "smtp"])
+        self.assertEqual(self.state.startup["problems"], [])
+
+    def test_unreachable_relay_does_not_block_consuming(self):
+        self.server.stop()
+        broker = FakeBroker()
+        startup = begin_startup()
+        RabbitMQConsumerSupervisor(connect=broker.connect, startup=startup).run("1")
+
+        self.assertTrue(broker.subscriptions)
+        self.assertTrue(startup.finished)
+        self.assertEqual(len(startup.problems), 1)
+
+    def test_readiness_waits_for_prewarming(self):
+        self.state.watch(lambda: True, self.pool)
+        self.state.mark_connected()
+        begin_startup()
+        ready, report = self.state.readiness()
+        self.assertFalse(ready)
+        self.assertIn("prewarming", report["problems"])
+
+        StartupReport().finish()
+        ready, report = self.state.readiness()
+        self.assertTrue(ready, report["problems"])
+        self.assertIsNotNone(report["startup"]["total_seconds"])
+
+
+if __name__ == "__main__":
+    unittest.main()
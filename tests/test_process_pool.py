@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import unittest
+from sending_emails.core.health import ConsumerState, QueueBacklogProbe, consumer_state
+from sending_emails.core.metrics import MESSAGES_TOTAL
+from sending_emails.core.process_pool import ConsumerProcessPool
+from sending_emails.core.reconnect import ExponentialBackoff
+from tests.fake_broker import FakeBlockingConnection
+
+
+class IdleConsumer:
+    """Connects, settles one message, then waits to be stopped."""
+
+    def __init__(self):
+        self._stopping = threading.Event()
+
+    def run(self, loop_behavior):
+        consumer_state.mark_connected()
+        consumer_state.mark_settled(acked=True)
+        MESSAGES_TOTAL.inc(("process_pool_test", "acked"))
+        self._stopping.wait()
+
+    def stop(self):
+        self._stopping.set()
+
+
+class CrashingConsumer(IdleConsumer):
+    def run(self, loop_behavior):
+        os._exit(3)
+
+
+def fast_restarts():
+    return ExponentialBackoff(base=0.05, cap=0.05, rng=lambda: 1.0)
+
+
+class TestConsumerProcessPool(unittest.TestCase):
+    def wait_for(self, predicate, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return predicate()
+
+    def make_pool(self, consumer_factory, processes=2):
+        pool = ConsumerProcessPool(
+            processes,
+            consumer_factory=consumer_factory,
+            report_interval=0.1,
+            drain_timeout=10,
+            backoff_factory=fast_restarts,
+        )
+        pool.start()
+        self.addCleanup(pool.stop)
+        return pool
+
+    def test_metrics_and_health_are_aggregated_across_processes(self):
+        pool = self.make_pool(IdleConsumer)
+        self.assertTrue(self.wait_for(
+            lambda: len(pool.reports()) == 2
+            and all(report["connected"] for report in pool.reports().values())
+        ))
+        self.assertTrue(self.wait_for(
+            lambda: MESSAGES_TOTAL.values().get(("process_pool_test", "acked")) == 2
+        ))
+
+        state = ConsumerState(backlog_probe=QueueBacklogProbe(cache_seconds=0, connect=FakeBlockingConnection))
+        state.watch(pool.is_running, remote_reports=pool.reports)
+        ready, report = state.readiness()
+        self.assertTrue(ready, report["problems"])
+        self.assertEqual(sorted(report["processes"]), ["consumer-0", "consumer-1"])
+        self.assertIsNotNone(report["last_ack_at"])
+
+    def test_sigterm_drains_each_process_cleanly(self):
+        pool = self.make_pool(IdleConsumer)
+        self.assertTrue(self.wait_for(lambda: len(pool._reports) == 2))
+        processes = [slot.process for slot in pool._slots]
+        pool.stop()
+        self.assertEqual([process.exitcode for process in processes], [0, 0])
+        self.assertFalse(pool.is_running())
+        self.assertNotIn(("process_pool_test", "acked"), MESSAGES_TOTAL.values())
+
+    def test_crashed_processes_are_restarted(self):
+        pool = self.make_pool(CrashingConsumer, processes=1)
+        self.assertTrue(self.wait_for(lambda: pool.restarts >= 2))
+        self.assertIn(pool._slots[0].process.exitcode, (None, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,35 +1,30 @@
 import unittest
-import uuid
 import json
-from sending_emails.core.rabitmq_publisher import get_rabbit_mq_publisher
-
-
-class UUIDEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, uuid.UUID):
-            return str(obj)
-        return super(UUIDEncoder, self).default(obj)
+from sending_emails.core.rabitmq_publisher import close_rabbit_mq_publishers, get_rabbit_mq_publisher
+from sending_emails.emails.encryption_utils import encrypt_data
 
 
 class TestRabbitMQPublisher(unittest.TestCase):
+    """Publishes to a live broker; the in-process equivalents live in the other tests."""
+
     def test_publish_message(self):
         publisher = get_rabbit_mq_publisher()
-        if publisher.connection_success:
-            doc_payload = {
-                "event": "collubi_paypal_send_mail",
-                "message": "my name is shakeeb"
-            }
-            # Publish data to fastapi service
-            encoded_message = json.dumps(doc_payload, cls=UUIDEncoder).encode("utf-8")
-            publisher.publish_message(encoded_message, ttl=5000)
-            if not publisher.publish_status:
-                print("Test case failed to publish")
-                self.assertEqual(False, publisher.publish_status)
-
-            else:
-                print("Test case successfully publish")
-                self.assertEqual(True, publisher.publish_status)
-            
+        # A publisher that could not connect is kept: do not leak it into the other tests
+        self.addCleanup(close_rabbit_mq_publishers)
+        if not publisher.connection_success:
+            self.skipTest("RabbitMQ is not reachable")
+        doc_payload = {
+            "event": "user_otp_request",
+            "data": {
+                "user_email": "jane@example.com",
+                "user_fullname": "Jane Doe",
+                "otp_reason": "Login Verification",
+                "otp": encrypt_data("482913"),
+            },
+        }
+        encoded_message = json.dumps(doc_payload).encode("utf-8")
+        publisher.publish_message(encoded_message, ttl=5000)
+        self.assertTrue(publisher.publish_status)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+import threading
+import time
+import unittest
+from unittest import mock
+import pika
+from pika.adapters.blocking_connection import BlockingChannel
+from sending_emails.core import rabitmq_publisher
+from sending_emails.core.rabitmq_publisher import get_rabbit_mq_publisher, select_async_confirms
+from tests.fake_broker import FakeBlockingConnection
+
+
+class TestLongLivedRabbitMQPublisher(unittest.TestCase):
+    def setUp(self):
+        FakeBlockingConnection.opened = []
+        patcher = mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", FakeBlockingConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rabitmq_publisher.close_rabbit_mq_publishers)
+
+    def test_publisher_is_shared_and_keeps_its_connection(self):
+        publisher = get_rabbit_mq_publisher()
+        self.assertIs(get_rabbit_mq_publisher(), publisher)
+        for index in range(5):
+            self.assertTrue(publisher.publish_message(f"message {index}".encode(), ttl=60))
+        self.assertEqual(len(FakeBlockingConnection.opened), 1)
+        channel = FakeBlockingConnection.opened[0].channel_obj
+        self.assertEqual(len(channel.published), 5)
+        self.assertEqual(len(channel.declarations), 5)
+
+    def test_publish_many_reports_per_message_confirms(self):
+        publisher = get_rabbit_mq_publisher()
+        channel = FakeBlockingConnection.opened[0].channel_obj
+        channel.nack_tags = {2}
+        results = publisher.publish_many([b"a", b"b", b"c", b"d"], ttl=60)
+        self.assertEqual(results, [True, False, True, True])
+        self.assertEqual(channel.published[0][2].expiration, "60000")
+
+    def test_reconnect_after_close_skips_redeclaring_topology(self):
+        publisher = get_rabbit_mq_publisher()
+        publisher.close_connection()
+        self.assertTrue(publisher.publish_message(b"again", ttl=60))
+        self.assertEqual(len(FakeBlockingConnection.opened), 2)
+        self.assertEqual(FakeBlockingConnection.opened[1].channel_obj.declarations, [])
+
+    def test_slow_reconnect_does_not_hold_up_other_publishes(self):
+        publisher = get_rabbit_mq_publisher()
+        publisher.close_connection()
+        publisher.connect_timeout = 0.1
+        connecting, release = threading.Event(), threading.Event()
+
+        def slow_connection(parameters):
+            connecting.set()
+            release.wait(5)
+            return FakeBlockingConnection(parameters)
+
+        results = []
+        with mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", slow_connection):
+            reconnecting = threading.Thread(target=lambda: results.append(publisher.publish_message(b"a", ttl=60)))
+            reconnecting.start()
+            self.assertTrue(connecting.wait(5))
+
+            # The publish lock is free while connecting; a second publish gives up after connect_timeout
+            self.assertTrue(publisher._lock.acquire(blocking=False))
+            publisher._lock.release()
+            started = time.monotonic()
+            self.assertEqual(publisher.publish_many([b"b"], ttl=60), [False])
+            self.assertLess(time.monotonic() - started, 1)
+
+            release.set()
+            reconnecting.join(5)
+        self.assertEqual(results, [True])
+        self.assertEqual(publisher.connection.parameters.socket_timeout, 0.1)
+
+    def test_publisher_that_failed_to_connect_is_kept_and_reconnects(self):
+        with mock.patch.object(
+            rabitmq_publisher.pika, "BlockingConnection",
+            side_effect=rabitmq_publisher.pika.exceptions.AMQPConnectionError("refused"),
+        ):
+            publisher = get_rabbit_mq_publisher()
+            self.assertFalse(publisher.connection_success)
+            self.assertIs(get_rabbit_mq_publisher(), publisher)
+        self.assertTrue(publisher.publish_message(b"a", ttl=60))
+
+    def test_channel_errors_close_the_connection_and_back_off(self):
+        def refusing_topology(parameters):
+            connection = FakeBlockingConnection(parameters)
+            connection.channel_obj.exchange_declare = mock.Mock(
+                side_effect=pika.exceptions.ChannelClosedByBroker(406, "PRECONDITION_FAILED")
+            )
+            return connection
+
+        with mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", refusing_topology), \
+                mock.patch.object(rabitmq_publisher.time, "sleep") as sleep:
+            publisher = get_rabbit_mq_publisher(max_retries=3, retry_delay=2)
+        self.assertFalse(publisher.connection_success)
+        self.assertEqual(len(FakeBlockingConnection.opened), 3)
+        self.assertEqual([connection.is_open for connection in FakeBlockingConnection.opened], [False] * 3)
+        self.assertEqual(sleep.call_args_list, [mock.call(2), mock.call(2)])
+
+    def test_connecting_publisher_does_not_hold_the_registry_lock(self):
+        connecting, release = threading.Event(), threading.Event()
+
+        def slow_connection(parameters):
+            connecting.set()
+            release.wait(5)
+            return FakeBlockingConnection(parameters)
+
+        with mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", slow_connection):
+            getting = threading.Thread(target=get_rabbit_mq_publisher)
+            getting.start()
+            self.assertTrue(connecting.wait(5))
+            self.assertTrue(rabitmq_publisher._publishers_lock.acquire(timeout=1))
+            rabitmq_publisher._publishers_lock.release()
+            release.set()
+            getting.join(5)
+        self.assertTrue(get_rabbit_mq_publisher().publish_message(b"a", ttl=60))
+        self.assertEqual(len(FakeBlockingConnection.opened), 1)
+
+
+class TestAsyncConfirmsOnPika(unittest.TestCase):
+    """Pins the pika internals `select_async_confirms` relies on."""
+
+    def test_real_blocking_channel_publishes_without_waiting_for_acks(self):
+        impl = mock.create_autospec(pika.channel.Channel, instance=True)
+        impl.channel_number = 1
+        connection = mock.Mock()
+        channel = BlockingChannel(impl, connection)
+        on_confirmation, on_selected = mock.Mock(), mock.Mock()
+
+        select_async_confirms(channel, on_confirmation, on_selected)
+        impl.confirm_delivery.assert_called_once_with(ack_nack_callback=on_confirmation, callback=on_selected)
+
+        # Confirms are off as far as the wrapper knows, so a publish returns at once
+        channel.basic_publish(exchange="x", routing_key="rk", body=b"hi")
+        impl.basic_publish.assert_called_once()
+        self.assertEqual(len(connection._flush_output.call_args_list), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import smtplib
+import unittest
+from sending_emails.emails.rate_limit import SMTPRateLimited, SMTPRateLimiter, parse_domain_limits
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_smtp import FakeSMTPServer
+
+RELAY = "smtp.example.net:465"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSMTPRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_limiter(self, **kwargs):
+        settings = dict(
+            relay_rate=0, relay_burst=20, domain_rate=0, domain_burst=2, start_rate=10,
+            decrease=0.5, min_rate=1, recovery=1, max_wait=10, clock=self.clock,
+        )
+        settings.update(kwargs)
+        return SMTPRateLimiter(**settings)
+
+    def test_domain_bucket_paces_after_the_burst(self):
+        limiter = self.make_limiter(domain_limits={"hospital.org": (2, 2)})
+        waits = [limiter.reserve(RELAY, f"user{index}@hospital.org") for index in range(4)]
+        self.assertEqual(waits, [0, 0, 0.5, 1.0])
+        # Other domains are not slowed down by hospital.org
+        self.assertEqual(limiter.reserve(RELAY, "someone@gmail.com"), 0)
+        self.clock.now += 1
+        self.assertEqual(limiter.reserve(RELAY, "late@hospital.org"), 0.5)
+
+    def test_wait_above_max_wait_is_refused_without_booking(self):
+        limiter = self.make_limiter(domain_limits={"hospital.org": (1, 1)}, max_wait=1.5)
+        limiter.reserve(RELAY, "a@hospital.org")
+        limiter.reserve(RELAY, "b@hospital.org")
+        with self.assertRaises(SMTPRateLimited):
+            limiter.reserve(RELAY, "c@hospital.org")
+        self.clock.now += 1
+        self.assertEqual(limiter.reserve(RELAY, "c@hospital.org"), 1.0)
+
+    def test_rcpt_throttle_slows_the_domain_and_recovers(self):
+        limiter = self.make_limiter()
+        throttle = smtplib.SMTPRecipientsRefused({"a@hospital.org": (451, b"slow down")})
+        limiter.record(RELAY, "a@hospital.org", throttle)
+        limiter.record(RELAY, "a@hospital.org", throttle)
+        self.assertEqual(limiter.rates()["domain:hospital.org"], 2.5)
+        self.assertIsNone(limiter.rates()[f"relay:{RELAY}"])
+        # The bucket was emptied: the next send waits a full token
+        self.assertEqual(limiter.reserve(RELAY, "a@hospital.org"), 0.4)
+
+        for _ in range(8):
+            limiter.record(RELAY, "a@hospital.org")
+        self.assertIsNone(limiter.rates()["domain:hospital.org"])
+
+    def test_relay_throttle_slows_every_domain_through_it(self):
+        limiter = self.make_limiter(min_rate=4)
+        limiter.record(RELAY, "a@hospital.org", smtplib.SMTPSenderRefused(421, b"too many messages", "me"))
+        self.assertEqual(limiter.rates()[f"relay:{RELAY}"], 5)
+        limiter.record(RELAY, "a@hospital.org", smtplib.SMTPSenderRefused(421, b"too many messages", "me"))
+        self.assertEqual(limiter.rates()[f"relay:{RELAY}"], 4)
+
+    def test_permanent_failures_do_not_throttle(self):
+        limiter = self.make_limiter()
+        limiter.record(RELAY, "a@hospital.org", smtplib.SMTPRecipientsRefused({"a@hospital.org": (550, b"")}))
+        self.assertEqual(limiter.rates(), {})
+
+    def test_parse_domain_limits(self):
+        self.assertEqual(
+            parse_domain_limits(["Gmail.com=20:40", " hospital.org=2"]),
+            {"gmail.com": (20.0, 40), "hospital.org": (2.0, 10)},
+        )
+        with self.assertRaises(ValueError):
+            parse_domain_limits(["gmail.com"])
+
+
+class TestPoolThrottling(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+        self.limiter = SMTPRateLimiter(relay_rate=0, domain_rate=0, start_rate=100, max_wait=1)
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, "user", "secret", use_ssl=False, rate_limiter=self.limiter
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_throttle_replies_from_the_relay_adapt_the_rates(self):
+        self.server.queue_response("RCPT", "451 4.7.1 Too many messages, slow down")
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.pool.sendmail("me@example.com", "a@hospital.org", "Subject: hi\r\n\r\nhello")
+        self.assertEqual(self.limiter.rates()["domain:hospital.org"], 50)
+
+        self.server.queue_response("MAIL", "421 4.7.0 Try again later")
+        with self.assertRaises(smtplib.SMTPSenderRefused):
+            self.pool.sendmail("me@example.com", "b@hospital.org", "Subject: hi\r\n\r\nhello")
+        self.assertEqual(self.limiter.rates()[f"relay:{self.pool.relay}"], 50)
+        self.assertEqual(self.limiter.rates()["domain:hospital.org"], 25)
+
+        self.pool.sendmail("me@example.com", "c@hospital.org", "Subject: hi\r\n\r\nhello")
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertGreater(self.limiter.rates()["domain:hospital.org"], 25)
+
+    def test_batch_marks_messages_over_the_limit_for_retry(self):
+        self.limiter.domain_limits["hospital.org"] = (1, 1)
+        self.limiter.max_wait = 0.5
+        results = self.pool.send_many(
+            "me@example.com",
+            [(f"user{index}@hospital.org", "Subject: hi\r\n\r\nhello") for index in range(3)],
+        )
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], SMTPRateLimited)
+        self.assertIsInstance(results[2], SMTPRateLimited)
+        self.assertEqual(len(self.server.messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
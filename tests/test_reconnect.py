@@ -0,0 +1,116 @@
+import threading
+import unittest
+import pika
+from sending_emails.core.config import rabbitmq_quee
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.core.reconnect import ExponentialBackoff
+from tests.fake_broker import FakeBroker
+
+
+class StopSupervisor(BaseException):
+    """Breaks out of the supervisor's endless loop in tests."""
+
+
+class TestExponentialBackoff(unittest.TestCase):
+    def test_ceiling_doubles_up_to_the_cap(self):
+        backoff = ExponentialBackoff(base=0.5, cap=4, rng=lambda: 1.0)
+        self.assertEqual([backoff.next_delay() for _ in range(6)], [0.5, 1, 2, 4, 4, 4])
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 0.5)
+
+    def test_full_jitter_spreads_delays_over_the_whole_window(self):
+        backoff = ExponentialBackoff(base=1, cap=8)
+        for _ in range(3):
+            backoff.next_delay()
+        delays = [backoff.next_delay() for _ in range(500)]
+        self.assertTrue(all(0 <= delay <= 8 for delay in delays))
+        self.assertLess(min(delays), 1)
+        self.assertGreater(max(delays), 7)
+
+
+class TestRabbitMQConsumerSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.delays = []
+
+    def make_supervisor(self, broker):
+        supervisor = RabbitMQConsumerSupervisor(
+            backoff=ExponentialBackoff(base=0.1, cap=1, rng=lambda: 1.0), connect=broker.connect
+        )
+        # Record the backoff delays instead of waiting them out
+        supervisor._stopping.wait = self.delays.append
+        return supervisor
+
+    def test_outage_is_retried_iteratively_with_growing_delays(self):
+        sessions = []
+
+        def on_consume(channel):
+            sessions.append(channel)
+            if len(sessions) == 1:
+                raise pika.exceptions.StreamLostError("broker went away")
+            raise StopSupervisor
+
+        broker = FakeBroker(outages=50, on_consume=on_consume)
+        with self.assertRaises(StopSupervisor):
+            self.make_supervisor(broker).run("infinite_running")
+
+        self.assertEqual(broker.attempts, 52)
+        # Growing delays during the outage, then a fresh start after consuming resumed
+        self.assertEqual(self.delays[:5], [0.1, 0.2, 0.4, 0.8, 1])
+        self.assertEqual(max(self.delays), 1)
+        self.assertEqual(self.delays[-1], 0.1)
+        self.assertTrue(all(not connection.is_open for connection in broker.connections))
+
+    def test_topology_declared_once_and_redeclared_after_queue_loss(self):
+        sessions = []
+
+        def on_consume(channel):
+            sessions.append(channel)
+            if len(sessions) == 1:
+                raise pika.exceptions.StreamLostError("dropped")
+            if len(sessions) == 2:
+                broker.restart()
+                raise pika.exceptions.StreamLostError("broker restarted")
+            raise StopSupervisor
+
+        broker = FakeBroker(on_consume=on_consume)
+        supervisor = self.make_supervisor(broker)
+        with self.assertRaises(StopSupervisor):
+            supervisor.run("infinite_running")
+
+        declared_queues = [
+            name for kind, name in broker.declarations if kind == "queue" and name == rabbitmq_quee
+        ]
+        self.assertEqual(len(declared_queues), 2)
+        self.assertEqual(broker.subscriptions.count(rabbitmq_quee), 3)
+        self.assertEqual(sessions[0].prefetch_count, sessions[2].prefetch_count)
+
+    def test_single_attempt_mode_returns_without_sleeping(self):
+        broker = FakeBroker(outages=1)
+        self.make_supervisor(broker).run("1")
+        self.assertEqual(broker.attempts, 1)
+        self.assertEqual(self.delays, [])
+
+    def test_stop_ends_consuming_and_returns(self):
+        started = threading.Event()
+
+        def on_consume(channel):
+            started.set()
+            # Stand-in for BlockingChannel.start_consuming servicing callbacks
+            connection = broker.connections[-1]
+            while channel.consuming:
+                connection.process_data_events(time_limit=0.01)
+
+        broker = FakeBroker(on_consume=on_consume)
+        supervisor = RabbitMQConsumerSupervisor(connect=broker.connect)
+        runner = threading.Thread(target=supervisor.run, args=("infinite_running",))
+        runner.start()
+        self.assertTrue(started.wait(2))
+        supervisor.stop()
+        runner.join(2)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(broker.attempts, 1)
+        self.assertFalse(broker.connections[0].is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
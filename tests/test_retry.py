@@ -0,0 +1,114 @@
+import asyncio
+import smtplib
+import unittest
+from unittest import mock
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.config import rabbitmq_exchange, rabbitmq_routing_key
+from sending_emails.core.batching import Delivery
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback, rabitmq_consumer_callback
+from sending_emails.core.retry import (
+    ATTEMPT_HEADER,
+    DEAD_LETTERED,
+    RETRIED,
+    dead_letter_queue_name,
+    retry_or_dead_letter,
+    retry_queue_declarations,
+    retry_queue_name,
+)
+from sending_emails.emails.events import RetryPolicy
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeMethod, FakeProperties
+from tests.fake_smtp import FakeSMTPServer
+from tests.test_batching import otp_body
+
+POLICY = RetryPolicy(max_retries=3, delays=(5, 30))
+TRANSIENT = smtplib.SMTPRecipientsRefused({"a@example.com": (451, b"try again later")})
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_last_delay_repeats_until_retries_run_out(self):
+        self.assertEqual([POLICY.delay_for(attempt) for attempt in range(1, 5)], [5, 30, 30, None])
+
+    def test_no_delays_means_no_retries(self):
+        self.assertIsNone(RetryPolicy(max_retries=3, delays=()).delay_for(1))
+
+
+class TestRetryTopology(unittest.TestCase):
+    def test_tiers_expire_back_into_the_main_queue(self):
+        declarations = dict(retry_queue_declarations())
+        tier = declarations[retry_queue_name(5)]
+        self.assertEqual(tier["x-message-ttl"], 5000)
+        self.assertEqual(tier["x-dead-letter-exchange"], rabbitmq_exchange)
+        self.assertEqual(tier["x-dead-letter-routing-key"], rabbitmq_routing_key)
+        self.assertEqual(declarations[dead_letter_queue_name()], {})
+
+
+class TestRetryOrDeadLetter(unittest.TestCase):
+    def setUp(self):
+        self.channel = FakeChannel()
+
+    def test_transient_failure_goes_to_the_next_tier(self):
+        properties = FakeProperties(message_id="m-1", headers={ATTEMPT_HEADER: 1})
+        outcome = retry_or_dead_letter(self.channel, FakeMethod(7), properties, b"body", POLICY, TRANSIENT)
+
+        self.assertEqual(outcome, RETRIED)
+        exchange, routing_key, body, published = self.channel.published[0]
+        self.assertEqual((exchange, routing_key, body), ("", retry_queue_name(30), b"body"))
+        self.assertEqual(published.headers[ATTEMPT_HEADER], 2)
+        self.assertEqual(published.message_id, "m-1")
+        self.assertEqual(self.channel.acks, [7])
+
+    def test_exhausted_retries_are_dead_lettered(self):
+        properties = FakeProperties(headers={ATTEMPT_HEADER: 3})
+        outcome = retry_or_dead_letter(self.channel, FakeMethod(1), properties, b"body", POLICY, TRANSIENT)
+        self.assertEqual(outcome, DEAD_LETTERED)
+        self.assertEqual(self.channel.published[0][1], dead_letter_queue_name())
+
+    def test_permanent_failure_skips_the_retries(self):
+        error = smtplib.SMTPDataError(554, b"rejected as spam")
+        outcome = retry_or_dead_letter(self.channel, FakeMethod(1), None, b"body", POLICY, error)
+        self.assertEqual(outcome, DEAD_LETTERED)
+        self.assertEqual(self.channel.published[0][3].headers[ATTEMPT_HEADER], 1)
+
+
+class TestConsumerRetries(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False)
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = FakeChannel()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_failed_send_is_scheduled_for_retry_and_acked(self):
+        self.server.queue_response("RCPT", "451 Mailbox busy")
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), FakeProperties(), otp_body(1))
+
+        # OTP_EMAIL retries after 5s first
+        self.assertEqual(self.channel.published[0][1], retry_queue_name(5))
+        self.assertEqual(self.channel.acks, [1])
+        self.assertEqual(self.channel.nacks, [])
+
+    def test_broken_template_is_retried_in_every_mode(self):
+        consumer = AsyncRabbitMQConsumer(smtp_pool=mock.Mock())
+        with mock.patch("sending_emails.emails.events.get_template", side_effect=OSError("template gone")):
+            self.assertFalse(rabitmq_consumer_callback(self.channel, FakeMethod(1), FakeProperties(), otp_body(1)))
+            results = rabitmq_consumer_batch_callback(
+                self.channel, [Delivery(FakeMethod(tag), FakeProperties(), otp_body(tag)) for tag in (2, 3)]
+            )
+            self.assertFalse(asyncio.run(
+                consumer.process_message(self.channel, FakeMethod(4), FakeProperties(), otp_body(4))
+            ))
+
+        self.assertEqual(results, [False, False])
+        self.assertEqual([published[1] for published in self.channel.published], [retry_queue_name(5)] * 4)
+        self.assertIn("template gone", self.channel.published[0][3].headers["x-email-last-error"])
+        self.assertEqual(sorted(self.channel.acks), [1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
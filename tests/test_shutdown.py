@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.batching import MicroBatcher
+from sending_emails.core.health import ConsumerState
+from sending_emails.core.rabitmq_consumer import RabbitMQConsumerSupervisor
+from sending_emails.core.shutdown import CONSUMER_DRAINS, drain_consumer, stop_consumer_thread
+from sending_emails.core.worker_pool import ConcurrentDispatcher
+from tests.fake_broker import FakeBroker, FakeChannel, FakeConnection, FakeMethod
+from tests.test_async_consumer import otp_body
+
+
+class HangingAsyncPool:
+    """Async SMTP pool whose sends never complete."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeSMTPPool:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestDispatcherShutdown(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.channel = FakeChannel()
+
+    def test_queued_deliveries_are_nacked_back(self):
+        release = threading.Event()
+
+        def callback(ch, method, properties, body):
+            release.wait(2)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        dispatcher = ConcurrentDispatcher(self.connection, callback, workers=1)
+        for tag in (1, 2, 3):
+            dispatcher.dispatch(self.channel, FakeMethod(tag), None, b"{}")
+        time.sleep(0.05)
+        threading.Timer(0.1, release.set).start()
+        self.assertEqual(dispatcher.shutdown(), 2)
+        self.connection.process_data_events()
+
+        # The running send finished and was acked; the rest goes back to the queue
+        self.assertEqual(self.channel.acks, [1])
+        self.assertEqual(sorted(self.channel.nacks), [(2, True), (3, True)])
+
+    def test_unflushed_batch_is_nacked_back(self):
+        batcher = MicroBatcher(self.connection, lambda ch, batch: None, batch_size=10, max_wait=60)
+        for tag in (1, 2):
+            batcher.add(self.channel, FakeMethod(tag), None, b"{}")
+        self.assertEqual(batcher.shutdown(), 2)
+        self.connection.process_data_events()
+        self.assertEqual(self.channel.nacks, [(1, True), (2, True)])
+        self.assertEqual(self.connection.timers, {})
+
+
+class TestAsyncConsumerStop(unittest.TestCase):
+    def test_sends_past_the_deadline_are_cancelled_and_nacked(self):
+        channel = FakeChannel()
+        pool = HangingAsyncPool()
+
+        async def scenario():
+            consumer = AsyncRabbitMQConsumer(smtp_pool=pool)
+            await consumer.start()
+            consumer.on_message(channel, FakeMethod(1), None, otp_body())
+            await asyncio.sleep(0.05)
+            return await consumer.stop(timeout=0.1)
+
+        self.assertFalse(asyncio.run(scenario()))
+        self.assertEqual(channel.nacks, [(1, True)])
+        self.assertEqual(channel.acks, [])
+        self.assertTrue(pool.closed)
+
+
+class TestDrainConsumer(unittest.TestCase):
+    def setUp(self):
+        self.state = ConsumerState(backlog_probe=mock.Mock(read=lambda: {"messages": 0}))
+        self.state.watch(lambda: True, mock.Mock(health=lambda: {"healthy": True}))
+        self.state.mark_connected()
+        patcher = mock.patch("sending_emails.core.shutdown.consumer_state", self.state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_readiness_fails_while_draining_and_the_drain_is_reported(self):
+        readiness = []
+
+        async def stop():
+            readiness.append(self.state.readiness()[0])
+            return True
+
+        drained_before = CONSUMER_DRAINS.values().get(("drained",), 0)
+        report = asyncio.run(drain_consumer("threaded", stop))
+        self.assertEqual(readiness, [False])
+        self.assertTrue(report.drained)
+        self.assertGreaterEqual(report.seconds, 0)
+        self.assertEqual(CONSUMER_DRAINS.values()[("drained",)], drained_before + 1)
+
+    def test_consumer_thread_stops_and_closes_its_connections(self):
+        started = threading.Event()
+
+        def on_consume(channel):
+            started.set()
+            connection = broker.connections[-1]
+            while channel.consuming:
+                connection.process_data_events(time_limit=0.01)
+
+        broker = FakeBroker(on_consume=on_consume)
+        supervisor = RabbitMQConsumerSupervisor(connect=broker.connect)
+        thread = threading.Thread(target=supervisor.run, args=("infinite_running",), daemon=True)
+        thread.start()
+        self.assertTrue(started.wait(2))
+        smtp_pool = FakeSMTPPool()
+
+        self.assertTrue(stop_consumer_thread(supervisor, thread, smtp_pool, timeout=2))
+        self.assertFalse(broker.connections[0].is_open)
+        self.assertTrue(smtp_pool.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
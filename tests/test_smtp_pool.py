@@ -0,0 +1,94 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from sending_emails.emails.helpers import send_email
+from sending_emails.emails.smtp_pool import SMTPConnectionPool, SMTPPoolExhausted
+from tests.fake_smtp import FakeSMTPServer
+
+
+def make_pool(server, **overrides):
+    options = {
+        "host": "127.0.0.1",
+        "port": server.port,
+        "username": "user",
+        "password": "secret",
+        "use_ssl": False,
+        "size": 2,
+        "timeout": 5,
+    }
+    options.update(overrides)
+    return SMTPConnectionPool(**options)
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_one_handshake_per_connection(self):
+        pool = make_pool(self.server, size=1)
+        for index in range(20):
+            self.assertTrue(
+                send_email("Subject", f"user{index}@example.com", "<p>hi</p>", pool=pool)
+            )
+        pool.close()
+        self.assertEqual(len(self.server.messages), 20)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.logins, 1)
+
+    def test_concurrent_senders_bounded_by_pool_size(self):
+        pool = make_pool(self.server, size=3)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(
+                    lambda i: send_email("S", f"u{i}@example.com", "<p>x</p>", pool=pool),
+                    range(40),
+                )
+            )
+        pool.close()
+        self.assertTrue(all(results))
+        self.assertLessEqual(self.server.logins, 3)
+        self.assertEqual(len(self.server.messages), 40)
+
+    def test_max_messages_per_connection(self):
+        pool = make_pool(self.server, size=1, max_messages=5)
+        for _ in range(12):
+            pool.sendmail("from@example.com", "to@example.com", "Subject: x\r\n\r\nbody")
+        pool.close()
+        self.assertEqual(self.server.logins, 3)
+
+    def test_transparent_reconnect_after_server_disconnect(self):
+        self.server.disconnect_after = 2
+        pool = make_pool(self.server, size=1, health_check_after=60)
+        for _ in range(5):
+            pool.sendmail("from@example.com", "to@example.com", "Subject: x\r\n\r\nbody")
+        pool.close()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertGreaterEqual(pool.reconnects, 1)
+
+    def test_noop_health_check_and_idle_timeout(self):
+        pool = make_pool(self.server, size=1, health_check_after=0, idle_timeout=60)
+        pool.sendmail("from@example.com", "to@example.com", "Subject: x\r\n\r\nbody")
+        pool.sendmail("from@example.com", "to@example.com", "Subject: x\r\n\r\nbody")
+        self.assertGreaterEqual(self.server.noops, 1)
+        self.assertEqual(self.server.logins, 1)
+
+        pool.idle_timeout = 0.01
+        time.sleep(0.05)
+        pool.sendmail("from@example.com", "to@example.com", "Subject: x\r\n\r\nbody")
+        pool.close()
+        self.assertEqual(self.server.logins, 2)
+
+    def test_acquire_times_out_when_exhausted(self):
+        pool = make_pool(self.server, size=1, acquire_timeout=0.05)
+        conn = pool.acquire()
+        with self.assertRaises(SMTPPoolExhausted):
+            pool.acquire()
+        pool.release(conn)
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
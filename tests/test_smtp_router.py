@@ -0,0 +1,260 @@
+import asyncio
+import smtplib
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from sending_emails.emails import smtp_pool
+from sending_emails.emails.async_smtp_pool import AsyncSMTPConnectionPool
+from sending_emails.emails.helpers import OutgoingEmail, deliver_email, deliver_emails
+from sending_emails.emails.smtp_router import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    SMTP_RELAY_FAILURES,
+    AsyncSMTPRelayRouter,
+    RelayAddress,
+    RelayHealth,
+    SMTPRelayRouter,
+    SMTPRelaysUnavailable,
+    parse_relays,
+)
+from tests.fake_smtp import FakeSMTPServer
+from tests.test_rate_limit import FakeClock
+from tests.test_smtp_pool import make_pool
+
+
+def dead_server():
+    """A relay nobody listens on: connections are refused."""
+    server = FakeSMTPServer()
+    server.server_close()
+    return server
+
+
+def make_router(servers, cls=SMTPRelayRouter, pool=make_pool, **overrides):
+    options = {"explore_rate": 0, "clock": FakeClock()}
+    options.update(overrides)
+    return cls([pool(server) for server in servers], **options)
+
+
+def send(router, index=0):
+    deliver_email("Subject", f"user{index}@example.com", "<p>hi</p>", pool=router)
+
+
+class TestParseRelays(unittest.TestCase):
+    def test_entries(self):
+        self.assertEqual(
+            parse_relays(["smtp1.example.com:2525=3", " smtp2.example.com ", "smtp3.example.com=0.5"], "465"),
+            [
+                RelayAddress("smtp1.example.com", 2525, 3.0),
+                RelayAddress("smtp2.example.com", 465, 1.0),
+                RelayAddress("smtp3.example.com", 465, 0.5),
+            ],
+        )
+
+    def test_invalid_entries(self):
+        for entry in ("", ":25", "smtp.example.com:x", "smtp.example.com=0", "smtp.example.com=fast"):
+            with self.assertRaises(ValueError, msg=entry):
+                parse_relays([entry], 465)
+
+
+class TestRelayHealth(unittest.TestCase):
+    def setUp(self):
+        self.health = RelayHealth("relay:25", 1.0, 0.5, breaker_failures=2, cooldown=10, max_cooldown=30)
+
+    def fail(self, now=0.0):
+        self.health.begin()
+        self.health.failed(OSError("refused"), now)
+
+    def test_circuit_opens_after_failures_in_a_row(self):
+        self.fail()
+        self.assertEqual(self.health.state, CLOSED)
+        self.fail()
+        self.assertEqual(self.health.state, OPEN)
+        self.assertFalse(self.health.available(9.9))
+        self.assertEqual(self.health.error_rate, 0.75)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.fail()
+        self.fail()
+        self.assertTrue(self.health.available(10))
+        self.assertEqual(self.health.state, HALF_OPEN)
+        self.health.begin()
+        self.assertFalse(self.health.available(10))
+
+        # A failed probe reopens the circuit for twice as long
+        self.health.failed(OSError("refused"), 10)
+        self.assertFalse(self.health.available(29.9))
+        self.assertTrue(self.health.available(30))
+        self.health.begin()
+        self.health.succeeded(0.2)
+        self.assertEqual((self.health.state, self.health.cooldown, self.health.latency), (CLOSED, 10, 0.2))
+
+    def test_latency_is_smoothed(self):
+        for seconds in (1.0, 0.0, 0.0):
+            self.health.begin()
+            self.health.succeeded(seconds)
+        self.assertEqual(self.health.latency, 0.25)
+
+
+class TestSMTPRelayRouter(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def start(self, **options):
+        server = FakeSMTPServer(**options).start()
+        self.servers.append(server)
+        return server
+
+    def test_prefers_the_fastest_relay(self):
+        slow, fast = self.start(delay=0.05), self.start()
+        router = make_router([slow, fast])
+        for index in range(20):
+            send(router, index)
+        router.close()
+        self.assertLessEqual(len(slow.messages), 1)
+        self.assertGreaterEqual(len(fast.messages), 19)
+
+    def test_concurrent_sends_use_every_relay(self):
+        servers = [self.start(delay=0.05), self.start(delay=0.05), self.start(delay=0.1)]
+        router = make_router(servers, pool=lambda server: make_pool(server, size=4))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda index: send(router, index), range(60)))
+        router.close()
+
+        shares = [len(server.messages) for server in servers]
+        self.assertEqual(sum(shares), 60)
+        self.assertGreater(shares[0], shares[2])
+        self.assertGreater(shares[1], shares[2])
+        self.assertGreater(shares[2], 0)
+
+    def test_fails_over_from_a_dead_relay(self):
+        dead, alive = dead_server(), self.start()
+        router = make_router([dead, alive])
+        before = SMTP_RELAY_FAILURES.values().get((router.pools[0].relay,), 0)
+        for index in range(10):
+            send(router, index)
+
+        self.assertEqual(len(alive.messages), 10)
+        self.assertEqual(router.relays[0].failures, 1)
+        self.assertEqual(SMTP_RELAY_FAILURES.values()[(router.pools[0].relay,)], before + 1)
+
+    def test_message_failures_are_not_failed_over(self):
+        first, second = self.start(), self.start()
+        first.queue_response("RCPT", "550 No such user")
+        router = make_router([first, second])
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            send(router)
+        self.assertEqual(second.messages, [])
+        self.assertEqual((router.relays[0].failures, router.relays[0].state), (0, CLOSED))
+
+    def test_open_circuit_is_reprobed_after_its_cooldown(self):
+        server = self.start()
+        for _ in range(3):
+            server.queue_response("MAIL", "421 Try again later")
+        clock = FakeClock()
+        router = make_router([server], breaker_failures=2, cooldown=10, clock=clock)
+        for _ in range(2):
+            with self.assertRaises(smtplib.SMTPSenderRefused):
+                send(router)
+        with self.assertRaises(SMTPRelaysUnavailable):
+            send(router)
+        self.assertFalse(router.health()["healthy"])
+
+        clock.now += 10
+        with self.assertRaises(smtplib.SMTPSenderRefused):
+            send(router)
+        clock.now += 10
+        with self.assertRaises(SMTPRelaysUnavailable):
+            send(router)
+        clock.now += 10
+        send(router)
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(router.relays[0].state, CLOSED)
+        self.assertTrue(router.health()["healthy"])
+
+    def test_batch_moves_to_the_next_relay(self):
+        dead, alive = dead_server(), self.start()
+        router = make_router([dead, alive])
+        emails = [OutgoingEmail("Subject", f"user{index}@example.com", "<p>hi</p>") for index in range(5)]
+        self.assertEqual(deliver_emails(emails, pool=router), [None] * 5)
+        self.assertEqual(len(alive.messages), 5)
+
+    def test_health_reports_every_relay(self):
+        dead, alive = dead_server(), self.start()
+        router = make_router([dead, alive], breaker_failures=1)
+        self.assertEqual(router.prewarm(2), 2)
+        health = router.health()
+
+        self.assertTrue(health["healthy"])
+        self.assertEqual(health["idle_connections"], 2)
+        self.assertEqual([relay["circuit"] for relay in health["relays"]], [OPEN, CLOSED])
+        self.assertFalse(health["relays"][0]["healthy"])
+        self.assertIn("ConnectionRefusedError", health["last_error"])
+
+    def test_process_pool_is_a_router_with_several_relays(self):
+        first, second = self.start(), self.start()
+        relays = [f"127.0.0.1:{first.port}=2", f"127.0.0.1:{second.port}"]
+        with mock.patch.object(smtp_pool, "SMTP_RELAYS", relays), \
+                mock.patch.object(smtp_pool, "_smtp_pool", None), \
+                mock.patch.object(smtp_pool, "EMAIL_USE_SSL", False):
+            router = smtp_pool.get_smtp_pool()
+            self.addCleanup(router.close)
+            self.assertIsInstance(router, SMTPRelayRouter)
+            self.assertEqual([health.weight for health in router.relays], [2.0, 1.0])
+            self.assertEqual(router.relay, f"127.0.0.1:{first.port},127.0.0.1:{second.port}")
+
+
+class TestAsyncSMTPRelayRouter(unittest.TestCase):
+    def test_fails_over_and_prewarms_the_live_relays(self):
+        alive = FakeSMTPServer().start()
+        self.addCleanup(alive.stop)
+
+        def pool(server):
+            return AsyncSMTPConnectionPool("127.0.0.1", server.port, "user", "secret", use_ssl=False, timeout=5)
+
+        async def scenario():
+            router = make_router([dead_server(), alive], cls=AsyncSMTPRelayRouter, pool=pool)
+            opened = await router.prewarm(2)
+            for index in range(3):
+                await router.sendmail("noreply@example.com", f"user{index}@example.com", b"Subject: hi\r\n\r\nhi")
+            await router.close()
+            return opened, router
+
+        opened, router = asyncio.run(scenario())
+        self.assertEqual(opened, 2)
+        self.assertEqual(len(alive.messages), 3)
+        self.assertEqual(router.relays[0].failures, 1)
+        self.assertTrue(router._closed)
+
+    def test_cancelled_send_releases_the_relay(self):
+        slow = FakeSMTPServer(delay=1).start()
+        self.addCleanup(slow.stop)
+
+        async def scenario():
+            pool = AsyncSMTPConnectionPool("127.0.0.1", slow.port, "user", "secret", use_ssl=False, timeout=10)
+            router = make_router([slow], cls=AsyncSMTPRelayRouter, pool=lambda server: pool)
+            # A half-open circuit lets a single probe through
+            router.relays[0].state = HALF_OPEN
+            send = asyncio.ensure_future(
+                router.sendmail("noreply@example.com", "user@example.com", b"Subject: hi\r\n\r\nhi")
+            )
+            await asyncio.sleep(0.2)
+            self.assertEqual((router.relays[0].in_flight, router.relays[0].probing), (1, True))
+            send.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await send
+            await router.close()
+            return router
+
+        router = asyncio.run(scenario())
+        health = router.relays[0]
+        self.assertEqual((health.in_flight, health.probing, health.failures), (0, False, 0))
+        self.assertTrue(health.available(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
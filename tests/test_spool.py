@@ -0,0 +1,321 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from sending_emails.core.async_consumer import AsyncRabbitMQConsumer
+from sending_emails.core.batching import Delivery
+from sending_emails.core.idempotency import IdempotencyCache
+from sending_emails.core.metrics import MESSAGES_TOTAL
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback, rabitmq_consumer_callback
+from sending_emails.core.retry import retry_policy_for
+from sending_emails.core.lanes import PUBLISHED_AT_HEADER
+from sending_emails.core.spool import SPOOL_SENDS, EmailSpool, SpooledEmail, SpoolSender
+from sending_emails.emails.helpers import OutgoingEmail, deliver_emails
+from sending_emails.emails.send_mails import get_email_event
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeChannel, FakeMethod, FakeProperties
+from tests.fake_smtp import FakeSMTPServer
+from tests.test_batching import otp_body
+from tests.test_rate_limit import FakeClock
+
+
+def spooled(index, event="user_otp_request", expires_at=None):
+    return SpooledEmail(
+        f"id:{index}", event, OutgoingEmail("Your OTP", f"user{index}@example.com", "<p>123456</p>", "123456\n"),
+        expires_at,
+    )
+
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "outbox.sqlite3")
+        self.clock = FakeClock()
+        self.spool = EmailSpool(self.path, lease_seconds=60, clock=self.clock)
+        self.addCleanup(self.spool.close)
+
+
+class TestEmailSpool(SpoolTestCase):
+    def test_appended_emails_survive_a_restart(self):
+        self.spool.append([spooled(1), spooled(2)])
+        self.spool.close()
+
+        reopened = EmailSpool(self.path, clock=self.clock)
+        self.addCleanup(reopened.close)
+        claimed = reopened.claim(10)
+        self.assertEqual([entry.key for entry in claimed], ["id:1", "id:2"])
+        self.assertEqual(claimed[0].email, spooled(1).email)
+        self.assertEqual(claimed[0].attempts, 0)
+
+    def test_a_key_is_spooled_once(self):
+        self.spool.append([spooled(1)])
+        self.spool.append([spooled(1), spooled(2)])
+        self.assertEqual(self.spool.depth(), 2)
+
+    def test_concurrent_appends_are_all_committed(self):
+        threads = [
+            threading.Thread(target=self.spool.append, args=([spooled(index)],)) for index in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.spool.depth(), 20)
+
+    def test_claimed_emails_are_leased(self):
+        self.spool.append([spooled(1), spooled(2)])
+        self.assertEqual(len(self.spool.claim(1)), 1)
+        self.assertEqual([entry.key for entry in self.spool.claim(10)], ["id:2"])
+        self.assertEqual(self.spool.claim(10), [])
+
+        # The sender holding them died: they are due again after the lease
+        self.clock.now += 61
+        self.assertEqual(len(self.spool.claim(10)), 2)
+
+    def test_retried_email_waits_for_its_delay(self):
+        self.spool.append([spooled(1)])
+        claimed = self.spool.claim(1)[0]
+        self.spool.retry(claimed.id, 30, OSError("timeout"))
+
+        self.assertEqual(self.spool.claim(1), [])
+        self.clock.now += 30
+        self.assertEqual(self.spool.claim(1)[0].attempts, 1)
+
+    def test_buried_email_is_kept_but_not_sent(self):
+        self.spool.append([spooled(1)])
+        self.spool.bury(self.spool.claim(1)[0].id, OSError("550 no such user"))
+        self.clock.now += 3600
+        self.assertEqual(self.spool.claim(1), [])
+        self.assertEqual((self.spool.depth(), self.spool.dead_count()), (0, 1))
+
+    def bodies(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute("SELECT html_content, text_content FROM outbox").fetchall()
+
+    def test_buried_email_loses_its_body_and_is_purged_after_retention(self):
+        self.spool.append([spooled(1)])
+        self.spool.bury(self.spool.claim(1)[0].id, OSError("550 no such user"))
+        self.assertEqual(self.bodies(), [("", None)])
+
+        self.clock.now += 3600
+        self.assertEqual(self.spool.purge(3601), 0)
+        self.assertEqual(self.spool.purge(3600), 1)
+        self.assertEqual(self.spool.dead_count(), 0)
+
+    def test_expired_email_is_buried_instead_of_claimed(self):
+        self.spool.append([spooled(1, expires_at=self.clock.now + 60), spooled(2)])
+        self.clock.now += 60
+        self.assertEqual([entry.key for entry in self.spool.claim(10)], ["id:2"])
+        self.assertEqual(self.spool.expire(), 1)
+        self.assertEqual(self.spool.dead_count(), 1)
+        self.assertEqual(self.bodies()[0], ("", None))
+
+    def test_outbox_of_an_older_version_is_migrated(self):
+        self.spool.close()
+        with sqlite3.connect(self.path) as db:
+            db.execute("DROP TABLE outbox")
+            db.execute(
+                "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, "
+                "event TEXT NOT NULL, subject TEXT NOT NULL, recipient TEXT NOT NULL, html_content TEXT NOT NULL, "
+                "text_content TEXT, attempts INTEGER NOT NULL DEFAULT 0, due_at REAL NOT NULL, "
+                "claimed_until REAL NOT NULL DEFAULT 0, dead INTEGER NOT NULL DEFAULT 0, last_error TEXT)"
+            )
+            db.executemany(
+                "INSERT INTO outbox (key, event, subject, recipient, html_content, due_at, dead) "
+                "VALUES (?, 'user_otp_request', 'Your OTP', 'a@example.com', '<p>123456</p>', 0, ?)",
+                [("id:1", 0), ("id:2", 1)],
+            )
+        self.spool = EmailSpool(self.path, clock=self.clock)
+        self.addCleanup(self.spool.close)
+
+        self.assertEqual([entry.key for entry in self.spool.claim(10)], ["id:1"])
+        self.assertEqual(self.bodies()[1], ("", None))
+        self.clock.now += 10
+        self.assertEqual(self.spool.purge(10), 1)
+
+
+class TestSpoolSender(SpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False)
+        patcher = mock.patch("sending_emails.emails.smtp_pool._smtp_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_sent_emails_leave_the_spool(self):
+        self.spool.append([spooled(1), spooled(2)])
+        self.assertEqual(SpoolSender(self.spool).send_due(), 2)
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.spool.depth(), 0)
+
+    def test_transient_failure_is_retried_with_the_event_policy(self):
+        self.server.queue_response("RCPT", "451 Mailbox busy")
+        self.spool.append([spooled(1)])
+        sender = SpoolSender(self.spool)
+        sender.send_due()
+
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(sender.send_due(), 0)
+        self.clock.now += retry_policy_for(get_email_event("user_otp_request")).delay_for(1)
+        self.assertEqual(sender.send_due(), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.spool.depth(), 0)
+
+    def test_permanent_failure_is_buried(self):
+        self.server.queue_response("RCPT", "550 No such user")
+        self.spool.append([spooled(1), spooled(2)])
+        SpoolSender(self.spool).send_due()
+
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual((self.spool.depth(), self.spool.dead_count()), (0, 1))
+
+    def test_poison_email_in_a_raising_batch_ends_up_buried(self):
+        def send(emails):
+            if any(email.recipient == "user1@example.com" for email in emails):
+                raise ValueError("Subject header must be a single line")
+            return deliver_emails(emails, pool=self.pool)
+
+        self.spool.append([spooled(1), spooled(2)])
+        sender = SpoolSender(self.spool, send=send)
+        self.assertEqual(sender.send_due(), 2)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn(b"user2@example.com", self.server.messages[0])
+        self.assertEqual(self.spool.depth(), 1)
+
+        for _ in range(5):
+            self.clock.now += 3600
+            sender.send_due()
+        self.assertEqual((self.spool.depth(), self.spool.dead_count()), (0, 1))
+
+    def test_expired_secrets_are_not_sent(self):
+        before = SPOOL_SENDS.values().get(("expired",), 0)
+        self.spool.append([spooled(1, expires_at=self.clock.now + 600)])
+        self.clock.now += 600
+        self.assertEqual(SpoolSender(self.spool).send_due(), 0)
+
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual((self.spool.depth(), self.spool.dead_count()), (0, 1))
+        self.assertEqual(SPOOL_SENDS.values()[("expired",)], before + 1)
+
+    def test_idle_pass_purges_old_dead_rows(self):
+        self.spool.append([spooled(1)])
+        self.spool.bury(self.spool.claim(1)[0].id, OSError("550 no such user"))
+        sender = SpoolSender(self.spool, dead_retention=60)
+        sender.send_due()
+        self.assertEqual(self.spool.dead_count(), 1)
+        self.clock.now += 60
+        sender.send_due()
+        self.assertEqual(self.spool.dead_count(), 0)
+
+    def test_started_sender_drains_appended_emails(self):
+        sender = SpoolSender(self.spool, senders=2, poll_interval=5)
+        sender.start()
+        self.addCleanup(sender.stop)
+        self.spool.append([spooled(1)])
+        for _ in range(200):
+            if self.server.messages:
+                break
+            threading.Event().wait(0.01)
+        sender.stop()
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_stop_reports_senders_still_sending(self):
+        sending, release = threading.Event(), threading.Event()
+
+        def send(emails):
+            sending.set()
+            release.wait(5)
+            return [None] * len(emails)
+
+        sender = SpoolSender(self.spool, senders=1, send=send)
+        self.spool.append([spooled(1)])
+        sender.start()
+        self.assertTrue(sending.wait(5))
+        self.assertFalse(sender.stop(timeout=0.05))
+
+        release.set()
+        self.assertTrue(sender.stop(timeout=5))
+        self.assertEqual(self.spool.depth(), 0)
+
+
+class TestConsumerSpooling(SpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = IdempotencyCache()
+        for target, value in (
+            ("sending_emails.core.spool._spool", self.spool),
+            ("sending_emails.core.idempotency._idempotency_cache", self.cache),
+            ("sending_emails.core.rabitmq_consumer.deliver_email", mock.Mock(side_effect=AssertionError)),
+            ("sending_emails.core.rabitmq_consumer.deliver_emails", mock.Mock(side_effect=AssertionError)),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.channel = FakeChannel()
+
+    def test_delivery_is_acked_once_spooled(self):
+        before = MESSAGES_TOTAL.values().get(("user_otp_request", "spooled"), 0)
+        properties = FakeProperties(message_id="otp-1")
+        self.assertTrue(rabitmq_consumer_callback(self.channel, FakeMethod(1), properties, otp_body(1)))
+        rabitmq_consumer_callback(self.channel, FakeMethod(2, redelivered=True), properties, otp_body(1))
+
+        self.assertEqual(self.channel.acks, [1, 2])
+        self.assertEqual(self.spool.depth(), 1)
+        self.assertEqual(self.spool.claim(1)[0].key, "id:otp-1")
+        self.assertEqual(MESSAGES_TOTAL.values()[("user_otp_request", "spooled")], before + 1)
+
+    def test_spooled_otp_expires_with_its_secret(self):
+        published_at = time.time() - 100
+        properties = FakeProperties(message_id="otp-1", headers={PUBLISHED_AT_HEADER: published_at})
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), properties, otp_body(1))
+
+        self.clock.now = published_at + get_email_event("user_otp_request").secret_ttl
+        self.assertEqual(self.spool.claim(1), [])
+        self.assertEqual(self.spool.expire(), 1)
+
+    def test_batch_is_spooled_in_one_append(self):
+        deliveries = [
+            Delivery(FakeMethod(tag), FakeProperties(message_id=f"otp-{tag}"), otp_body(tag)) for tag in (1, 2, 3)
+        ]
+        with mock.patch.object(self.spool, "append", wraps=self.spool.append) as append:
+            results = rabitmq_consumer_batch_callback(self.channel, deliveries)
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(sorted(self.channel.acks), [1, 2, 3])
+        self.assertEqual(append.call_count, 1)
+        self.assertEqual(self.spool.depth(), 3)
+
+    def test_failed_append_falls_back_to_sending(self):
+        deliver_email = mock.Mock()
+        with mock.patch.object(self.spool, "append", side_effect=OSError("disk full")), \
+                mock.patch("sending_emails.core.rabitmq_consumer.deliver_email", deliver_email):
+            rabitmq_consumer_callback(self.channel, FakeMethod(1), FakeProperties(message_id="otp-1"), otp_body(1))
+
+        deliver_email.assert_called_once()
+        self.assertEqual(self.channel.acks, [1])
+
+    def test_async_consumer_acks_once_spooled(self):
+        async def scenario():
+            consumer = AsyncRabbitMQConsumer(smtp_pool=mock.Mock(), idempotency_cache=self.cache)
+            with mock.patch("sending_emails.core.async_consumer.deliver_email_async", side_effect=AssertionError):
+                return await consumer.process_message(
+                    self.channel, FakeMethod(1), FakeProperties(message_id="otp-1"), otp_body(1)
+                )
+
+        self.assertTrue(asyncio.run(scenario()))
+        self.assertEqual(self.channel.acks, [1])
+        self.assertEqual(self.spool.depth(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from benchmarks.bench_templates import TEMPLATES, TEMPLATE_FOLDER_PATH, legacy_render
+from sending_emails.emails.template_engine import CompiledTemplate, TemplateCache
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def test_matches_legacy_rendering_for_all_templates(self):
+        cache = TemplateCache()
+        for name, replacements in TEMPLATES.items():
+            path = f"{TEMPLATE_FOLDER_PATH}/{name}"
+            with self.subTest(template=name):
+                self.assertEqual(
+                    cache.get(path).render(replacements),
+                    legacy_render(path, replacements),
+                )
+
+    def test_missing_values_default_and_unknown_placeholders_kept(self):
+        template = CompiledTemplate("inline", "<p>[a] [b] [c] [a]</p>")
+        self.assertEqual(
+            template.render({"a": "x", "b": None}), "<p>x N/A [c] x</p>"
+        )
+
+    def test_values_are_not_reexpanded(self):
+        template = CompiledTemplate("inline", "[a]|[b]")
+        self.assertEqual(template.render({"a": "[b]", "b": "y"}), "[b]|y")
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".html")
+        os.close(handle)
+        self.write("<p>Hello [name]</p>", mtime=1_000_000)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write(self, content, mtime):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_compiled_once_and_reloaded_on_mtime_change(self):
+        cache = TemplateCache(check_interval=0)
+        first = cache.get(self.path)
+        self.assertIs(cache.get(self.path), first)
+
+        self.write("<p>Bye [name]</p>", mtime=2_000_000)
+        self.assertEqual(cache.get(self.path).render({"name": "Ann"}), "<p>Bye Ann</p>")
+
+    def test_check_interval_skips_stat(self):
+        cache = TemplateCache(check_interval=3600)
+        cache.get(self.path)
+        self.write("<p>Bye [name]</p>", mtime=2_000_000)
+        self.assertEqual(cache.get(self.path).render({"name": "Ann"}), "<p>Hello Ann</p>")
+
+    def test_missing_template_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            TemplateCache().get(self.path + ".missing")
+
+
+if __name__ == "__main__":
+    unittest.main()
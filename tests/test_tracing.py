@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from sending_emails.core import rabitmq_publisher
+from sending_emails.core.batching import Delivery
+from sending_emails.core.idempotency import IdempotencyCache
+from sending_emails.core.lanes import PRIORITY_LANE, PUBLISHED_AT_HEADER
+from sending_emails.core.rabitmq_consumer import rabitmq_consumer_batch_callback, rabitmq_consumer_callback
+from sending_emails.core.rabitmq_publisher import get_rabbit_mq_publisher
+from sending_emails.core.tracing import (
+    QUEUE_WAIT_SECONDS,
+    TRACEPARENT_HEADER,
+    TraceExporter,
+    new_traceparent,
+    parse_traceparent,
+)
+from sending_emails.emails.smtp_pool import SMTPConnectionPool
+from tests.fake_broker import FakeBlockingConnection, FakeChannel, FakeMethod, FakeProperties
+from tests.fake_smtp import FakeSMTPServer
+from tests.test_batching import otp_body
+from tests.test_lanes import OTP
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def otp_properties(tag, sampled=True, waited=1.5):
+    return FakeProperties(
+        message_id=f"otp-{tag}",
+        headers={
+            PUBLISHED_AT_HEADER: time.time() - waited,
+            TRACEPARENT_HEADER: f"00-{TRACE_ID}-{PARENT_ID}-{'01' if sampled else '00'}",
+        },
+    )
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "traces.jsonl")
+        exporter = TraceExporter(self.path)
+        self.addCleanup(exporter.close)
+        patcher = mock.patch("sending_emails.core.tracing._exporter", exporter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exported(self):
+        """Every exported span, as OTLP/JSON dicts."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file]
+        return [
+            span
+            for record in records
+            for resource in record["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]
+        ]
+
+
+class TestTraceparent(unittest.TestCase):
+    def test_round_trip(self):
+        header, span_id, sampled = new_traceparent(TRACE_ID, sampled=True)
+        self.assertEqual(parse_traceparent(header), (TRACE_ID, span_id, True))
+        self.assertEqual(parse_traceparent(header.encode())[2], True)
+        self.assertFalse(parse_traceparent(new_traceparent(TRACE_ID, sampled=False)[0])[2])
+
+    def test_malformed_headers_are_ignored(self):
+        for value in (None, 42, "", "00-xyz-00f067aa0ba902b7-01", f"00-{'0' * 32}-{PARENT_ID}-01",
+                      f"01-{TRACE_ID}-{PARENT_ID}-01", f"00-{TRACE_ID}-{PARENT_ID}"):
+            self.assertIsNone(parse_traceparent(value), value)
+
+
+class TestPublisherTracing(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeBlockingConnection.opened = []
+        patcher = mock.patch.object(rabitmq_publisher.pika, "BlockingConnection", FakeBlockingConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rabitmq_publisher.close_rabbit_mq_publishers)
+
+    def test_message_id_is_the_trace_id(self):
+        with mock.patch("sending_emails.core.tracing.trace_sample_rate", 1.0):
+            get_rabbit_mq_publisher().publish_many([OTP, OTP], ttl=60)
+        published = FakeBlockingConnection.opened[0].channel_obj.published
+        spans = self.exported()
+
+        self.assertEqual(len(spans), 2)
+        for (_, _, properties), span in zip(published, spans):
+            trace_id, span_id, sampled = parse_traceparent(properties.headers[TRACEPARENT_HEADER])
+            self.assertEqual((trace_id, sampled), (properties.message_id, True))
+            self.assertIn(PUBLISHED_AT_HEADER, properties.headers)
+            self.assertEqual((span["traceId"], span["spanId"], span["kind"]), (trace_id, span_id, 4))
+
+    def test_unsampled_publishes_are_not_exported(self):
+        with mock.patch("sending_emails.core.tracing.trace_sample_rate", 0.0):
+            get_rabbit_mq_publisher().publish_message(OTP, ttl=60)
+        _, _, properties = FakeBlockingConnection.opened[0].channel_obj.published[0]
+        self.assertFalse(parse_traceparent(properties.headers[TRACEPARENT_HEADER])[2])
+        self.assertEqual(self.exported(), [])
+
+
+class TestConsumerTracing(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FakeSMTPServer().start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.port, "user", "secret", use_ssl=False)
+        for target, value in (
+            ("sending_emails.emails.smtp_pool._smtp_pool", self.pool),
+            ("sending_emails.core.idempotency._idempotency_cache", IdempotencyCache()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.channel = FakeChannel()
+        QUEUE_WAIT_SECONDS.reset()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_sampled_delivery_is_exported_with_every_stage(self):
+        method = FakeMethod(1, routing_key=PRIORITY_LANE.routing_key)
+        rabitmq_consumer_callback(self.channel, method, otp_properties(1), otp_body(1))
+
+        spans = {span["name"]: span for span in self.exported()}
+        root = spans["priority process"]
+        self.assertEqual((root["traceId"], root["parentSpanId"], root["kind"]), (TRACE_ID, PARENT_ID, 5))
+        self.assertIn({"key": "email.outcome", "value": {"stringValue": "acked"}}, root["attributes"])
+        for stage in ("queue_wait", "decode", "decrypt", "render", "smtp_send", "ack"):
+            self.assertEqual(spans[stage]["parentSpanId"], root["spanId"], stage)
+        queue_wait = spans["queue_wait"]
+        waited = int(queue_wait["endTimeUnixNano"]) - int(queue_wait["startTimeUnixNano"])
+        self.assertAlmostEqual(waited / 1e9, 1.5, delta=0.5)
+        self.assertLessEqual(int(root["startTimeUnixNano"]), int(spans["decode"]["startTimeUnixNano"]))
+
+        (labels, counts), = QUEUE_WAIT_SECONDS.values().items()
+        self.assertEqual(labels, ("priority", "user_otp_request"))
+        self.assertAlmostEqual(counts[-1], 1.5, delta=0.5)
+
+    def test_unsampled_delivery_only_feeds_the_histogram(self):
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), otp_properties(1, sampled=False), otp_body(1))
+        self.assertEqual(self.exported(), [])
+        self.assertEqual(len(QUEUE_WAIT_SECONDS.values()), 1)
+
+    def test_malformed_publish_time_is_sent_without_a_queue_wait(self):
+        properties = otp_properties(1)
+        properties.headers[PUBLISHED_AT_HEADER] = "not a time"
+        self.assertTrue(rabitmq_consumer_callback(self.channel, FakeMethod(1), properties, otp_body(1)))
+        self.assertEqual(self.channel.acks, [1])
+        self.assertNotIn("queue_wait", [span["name"] for span in self.exported()])
+        self.assertEqual(QUEUE_WAIT_SECONDS.values(), {})
+
+    def test_rejected_delivery_is_traced_as_an_error(self):
+        rabitmq_consumer_callback(self.channel, FakeMethod(1), otp_properties(1), b"not json")
+        root, = [span for span in self.exported() if span["name"] == "bulk process"]
+        self.assertEqual(root["status"], {"code": 2})
+
+    def test_batched_deliveries_share_the_smtp_span(self):
+        deliveries = [Delivery(FakeMethod(tag), otp_properties(tag), otp_body(tag)) for tag in (1, 2)]
+        rabitmq_consumer_batch_callback(self.channel, deliveries)
+
+        spans = self.exported()
+        roots = [span for span in spans if span["name"] == "bulk process"]
+        smtp = [span for span in spans if span["name"] == "smtp_batch"]
+        self.assertEqual(len(roots), 2)
+        self.assertEqual({span["parentSpanId"] for span in smtp}, {root["spanId"] for root in roots})
+        first, second = (int(span["startTimeUnixNano"]) for span in smtp)
+        self.assertLess(abs(first - second), 1_000_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
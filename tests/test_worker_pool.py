@@ -0,0 +1,62 @@
+import threading
+import time
+import unittest
+from sending_emails.core.worker_pool import ConcurrentDispatcher
+from tests.fake_broker import FakeChannel, FakeConnection, FakeMethod
+
+
+class TestConcurrentDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.channel = FakeChannel()
+
+    def drain_until(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.01)
+
+    def test_deliveries_run_concurrently_and_ack_on_connection_thread(self):
+        def slow_callback(ch, method, properties, body):
+            time.sleep(0.1)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        dispatcher = ConcurrentDispatcher(self.connection, slow_callback, workers=8)
+        started = time.monotonic()
+        for tag in range(1, 9):
+            dispatcher.dispatch(self.channel, FakeMethod(tag), None, b"{}")
+        self.drain_until(lambda: len(self.channel.acks) == 8)
+        elapsed = time.monotonic() - started
+        dispatcher.shutdown()
+
+        self.assertEqual(sorted(self.channel.acks), list(range(1, 9)))
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(self.channel.threads, {threading.get_ident()})
+
+    def test_failing_callback_is_requeued_once_then_dropped(self):
+        def failing_callback(ch, method, properties, body):
+            raise ValueError("boom")
+
+        dispatcher = ConcurrentDispatcher(self.connection, failing_callback, workers=2)
+        dispatcher.dispatch(self.channel, FakeMethod(1), None, b"{}")
+        dispatcher.dispatch(self.channel, FakeMethod(2, redelivered=True), None, b"{}")
+        self.drain_until(lambda: len(self.channel.nacks) == 2)
+        dispatcher.shutdown()
+        self.assertEqual(sorted(self.channel.nacks), [(1, True), (2, False)])
+
+    def test_ack_after_connection_closed_is_dropped(self):
+        done = threading.Event()
+
+        def callback(ch, method, properties, body):
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            done.set()
+
+        self.connection.is_open = False
+        dispatcher = ConcurrentDispatcher(self.connection, callback, workers=1)
+        dispatcher.dispatch(self.channel, FakeMethod(1), None, b"{}")
+        self.assertTrue(done.wait(2))
+        dispatcher.shutdown()
+        self.assertEqual(self.channel.acks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()